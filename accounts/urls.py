@@ -8,10 +8,4 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('profile/', views.profile_view, name='profile'),
-    
-    # Корзина
-    path('cart/', views.cart_view, name='cart'),
-    path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('cart/clear/', views.clear_cart, name='clear_cart'),
 ]
\ No newline at end of file
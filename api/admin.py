@@ -1,18 +1,55 @@
 # api/admin.py - ПРАВИЛЬНЫЙ ФАЙЛ
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from .models import Category, Product, Cart, CartItem, Favorite, Order
+from .cart import LINE_TOTAL
+from .inventory import adjust, cancel_order
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'slug']
     prepopulated_fields = {'slug': ('name',)}
 
+class ProductAdminForm(forms.ModelForm):
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Остаток, показанный в форме, возвращается скрытым полем: правка
+        # сохраняется как разница с ним, а не как новое абсолютное значение
+        self.fields['stock'].show_hidden_initial = True
+
+    def stock_delta(self):
+        field = self.fields['stock']
+        shown = field.to_python(field.hidden_widget().value_from_datadict(
+            self.data, self.files, self.add_initial_prefix('stock')
+        ))
+        if shown is None:
+            return 0
+        return self.cleaned_data['stock'] - shown
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'price', 'category', 'in_stock', 'created_at']
+    form = ProductAdminForm
+    list_display = ['name', 'sku', 'price', 'category', 'stock', 'in_stock', 'created_at']
     list_filter = ['category', 'in_stock', 'created_at']
-    search_fields = ['name', 'description']
-    list_editable = ['price', 'in_stock']
+    search_fields = ['name', 'sku', 'description']
+    # stock в списке не редактируется: форма списка не знает, какой остаток
+    # видел оператор, и перезаписала бы резервы заказов (inventory.reserve)
+    list_editable = ['price']
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # stock не пишется целиком: резервы после открытия формы сохраняются
+        fields = [name for name in form.changed_data if name != 'stock']
+        obj.save(update_fields=[*fields, 'updated_at'])
+        adjust(obj.pk, form.stock_delta())
+        obj.refresh_from_db(fields=['stock', 'in_stock'])
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
@@ -22,9 +59,13 @@ class CartAdmin(admin.ModelAdmin):
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'quantity', 'total_price']
+    list_select_related = ['cart__user', 'product']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(line_total=LINE_TOTAL)
     
     def total_price(self, obj):
-        return obj.total_price()
+        return obj.line_total
     total_price.short_description = 'Сумма'
 
 @admin.register(Favorite)
@@ -38,5 +79,25 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'created_at']
     list_editable = ['status']
     search_fields = ['user__username', 'shipping_address']
+    actions = ['cancel_orders']
+    
+    def save_model(self, request, obj, form, change):
+        # Отмена через смену статуса тоже возвращает товар на склад
+        if change and 'status' in form.changed_data and obj.status == 'cancelled':
+            obj.status = form.initial['status']
+            super().save_model(request, obj, form, change)
+            if not cancel_order(obj):
+                self.message_user(
+                    request,
+                    f'Заказ #{obj.pk} в статусе "{obj.get_status_display()}" нельзя отменить',
+                    level=messages.ERROR,
+                )
+        else:
+            super().save_model(request, obj, form, change)
+    
+    @admin.action(description='Отменить и вернуть товар на склад')
+    def cancel_orders(self, request, queryset):
+        cancelled = sum(cancel_order(order) for order in queryset)
+        self.message_user(request, f'Отменено заказов: {cancelled}')
 
 # Register your models here.
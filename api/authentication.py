@@ -0,0 +1,158 @@
+# api/authentication.py
+"""Аутентификация по токену с кэшированием.
+
+TokenAuthentication из DRF на каждый запрос выполняет SELECT токена с JOIN
+пользователя. CachedTokenAuthentication сначала ищет токен в LRU процесса
+(TOKEN_AUTH_LOCAL_CACHE_SIZE записей, TOKEN_AUTH_LOCAL_TIMEOUT секунд),
+затем в общем кэше (TOKEN_AUTH_CACHE_ALIAS, TOKEN_AUTH_CACHE_TIMEOUT) и
+только потом в БД. Неактивные пользователи и неизвестные токены не
+кэшируются.
+
+Удаление токена и изменение или удаление пользователя сбрасывают записи
+сигналами (api/signals.py) - в общем кэше и в LRU текущего процесса; LRU
+других процессов устаревает не дольше TOKEN_AUTH_LOCAL_TIMEOUT секунд.
+В кэше лежат значения полей, а не экземпляры моделей: каждый запрос
+получает свои объекты User и Token.
+TOKEN_EXPIRY (секунды, None - бессрочно) ограничивает срок жизни токена
+от момента его создания.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+KEY_PREFIX = 'auth:token'
+
+
+def get_cache():
+    return caches[getattr(settings, 'TOKEN_AUTH_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'TOKEN_AUTH_CACHE_TIMEOUT', 300)
+
+
+def get_expiry():
+    seconds = getattr(settings, 'TOKEN_EXPIRY', None)
+    return None if seconds is None else timedelta(seconds=seconds)
+
+
+def cache_key(key):
+    # Сам токен в ключ общего кэша не попадает
+    return f'{KEY_PREFIX}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+class LocalTokenCache:
+    """Ограниченный LRU в памяти процесса: ключ токена -> snapshot()"""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        with self._lock:
+            self._entries[key] = (data, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_cache = LocalTokenCache(
+    getattr(settings, 'TOKEN_AUTH_LOCAL_CACHE_SIZE', 1024),
+    getattr(settings, 'TOKEN_AUTH_LOCAL_TIMEOUT', 30),
+)
+
+
+def _user_fields():
+    # Хэш пароля в кэш не попадает: поле остается отложенным
+    return [f.attname for f in get_user_model()._meta.concrete_fields if f.attname != 'password']
+
+
+def snapshot(token):
+    """Значения полей токена и пользователя для кэша (не сам экземпляр модели)"""
+    user = token.user
+    return token.key, token.created, tuple(getattr(user, name) for name in _user_fields())
+
+
+def restore(data):
+    """Новые экземпляры Token и User из snapshot() - у каждого запроса свои"""
+    key, created, user_values = data
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, _user_fields(), user_values)
+    token_values = {'key': key, 'user_id': user.pk, 'created': created}
+    names = [f.attname for f in Token._meta.concrete_fields]
+    token = Token.from_db(DEFAULT_DB_ALIAS, names, [token_values[name] for name in names])
+    token.user = user
+    return token
+
+
+def remember(token):
+    """Кладет токен (с загруженным token.user) в оба уровня кэша"""
+    data = snapshot(token)
+    local_cache.set(token.key, data)
+    get_cache().set(cache_key(token.key), data, get_timeout())
+
+
+def forget(*keys):
+    for key in keys:
+        local_cache.delete(key)
+    get_cache().delete_many([cache_key(key) for key in keys])
+
+
+def is_expired(token):
+    expiry = get_expiry()
+    return expiry is not None and token.created + expiry < timezone.now()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Замена TokenAuthentication: в установившемся режиме без запросов к БД"""
+
+    def authenticate_credentials(self, key):
+        data = local_cache.get(key)
+        if data is None:
+            data = get_cache().get(cache_key(key))
+            if data is not None:
+                local_cache.set(key, data)
+        if data is None:
+            token = super().authenticate_credentials(key)[1]
+            remember(token)
+        else:
+            token = restore(data)
+        if is_expired(token):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        return token.user, token
@@ -0,0 +1,52 @@
+# api/benchmarks.py
+"""Общие помощники для команд-бенчмарков (bench_*).
+
+Бенчмарки работают на временной тестовой БД, чтобы не трогать рабочие данные.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    """Создает тестовую БД с миграциями на время блока и удаляет ее после"""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def run_concurrently(worker, args_list):
+    """Запускает worker(*args) в отдельном потоке на каждый набор аргументов.
+
+    Потоки стартуют одновременно (через барьер). Возвращает результаты в
+    порядке args_list и общее время в секундах.
+    """
+    barrier = threading.Barrier(len(args_list) + 1)
+    results = [None] * len(args_list)
+
+    def run(index, args):
+        try:
+            barrier.wait()
+            results[index] = worker(*args)
+        except Exception as exc:
+            results[index] = exc
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=run, args=(index, args))
+        for index, args in enumerate(args_list)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
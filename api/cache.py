@@ -0,0 +1,181 @@
+# api/cache.py
+"""Кэш каталога с версионированными ключами.
+
+Каждая запись зависит от одной или нескольких "областей" (scope):
+  products        - списки без фильтра по категории и главная страница
+  category:<id>   - списки товаров одной категории
+  product:<id>    - карточка одного товара
+  categories      - список категорий
+Версия области - время последнего изменения в миллисекундах. Версии входят
+в ключ, поэтому сброс области (bump) делает старые записи недостижимыми, и
+они просто вытесняются по TTL. Сигналы Product/Category сбрасывают только
+затронутые области.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+
+KEY_PREFIX = 'catalog'
+
+
+def category_scope(category_id):
+    return f'category:{category_id}'
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def listing_scope(category_id):
+    """Область списка товаров с учетом фильтра по категории"""
+    return category_scope(category_id) if category_id else PRODUCTS
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов в рамках процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+stats = CacheStats()
+
+
+def _version_key(scope):
+    return f'{KEY_PREFIX}:v:{scope}'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    """Текущие версии областей; отсутствующие инициализируются текущим временем"""
+    cache = get_cache()
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    missing = {key: _now_ms() for key in keys if key not in found}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, None)
+        found.update(cache.get_many(list(missing)))
+    return {keys[key]: found.get(key, missing.get(key)) for key in keys}
+
+
+def bump(*scopes):
+    """Сбрасывает области: новая версия строго больше прежней"""
+    if not scopes:
+        return
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    now = _now_ms()
+    cache.set_many({key: max(now, current.get(key, 0) + 1) for key in keys}, None)
+
+
+def make_key(name, scopes, parts=(), versions=None):
+    if versions is None:
+        versions = get_versions(scopes)
+    version_part = '.'.join(str(versions[scope]) for scope in scopes)
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'{KEY_PREFIX}:{name}:{version_part}:{digest}'
+
+
+def get_or_set(name, scopes, parts, producer, timeout=None, versions=None):
+    """Чтение через кэш: при промахе вызывает producer() и сохраняет результат.
+
+    versions - уже прочитанные get_versions(scopes), чтобы не читать их повторно.
+    """
+    cache = get_cache()
+    key = make_key(name, scopes, parts, versions)
+    value = cache.get(key)
+    if value is not None:
+        stats.record(hit=True)
+        return value
+    stats.record(hit=False)
+    value = producer()
+    cache.set(key, value, get_timeout() if timeout is None else timeout)
+    return value
+
+
+def validators(name, versions, parts=()):
+    """(ETag, Last-Modified в секундах) для ответа, зависящего от областей.
+
+    Версии меняются при каждом изменении данных, поэтому их достаточно, чтобы
+    ответить 304 без чтения и сериализации самих данных.
+    """
+    payload = repr((name, sorted(versions.items()), parts)).encode()
+    etag = 'W/"%s"' % hashlib.md5(payload, usedforsecurity=False).hexdigest()
+    return etag, max(versions.values()) / 1000
+
+
+def product_scopes(product, previous_category_id=None):
+    """Области, которые затрагивает изменение товара"""
+    scopes = {PRODUCTS, product_scope(product.pk)}
+    for category_id in (product.category_id, previous_category_id):
+        if category_id:
+            scopes.add(category_scope(category_id))
+    return scopes
+
+
+def category_scopes(category):
+    """Области, которые затрагивает изменение категории"""
+    from .models import Product
+
+    # Название категории выводится в карточках товаров
+    product_ids = Product.objects.filter(category_id=category.pk).values_list('id', flat=True)
+    return {CATEGORIES, PRODUCTS, category_scope(category.pk), *(product_scope(pk) for pk in product_ids)}
+
+
+def bump_on_commit(*scopes):
+    """bump() после фиксации текущей транзакции (вне транзакции - сразу).
+
+    Иначе параллельный запрос прочитал бы старые строки до фиксации и
+    сохранил их под новой версией - вместе с ETag до следующего изменения.
+    """
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def invalidate_product(product, previous_category_id=None):
+    bump(*product_scopes(product, previous_category_id))
+
+
+def invalidate_category(category):
+    bump(*category_scopes(category))
@@ -0,0 +1,18 @@
+# api/cached_sessions.py
+"""Движок сессий cached_db с записью только при изменении (api/sessions.py).
+
+Сессия читается из кэша SESSION_CACHE_ALIAS. Кэш должен быть общим для
+всех процессов (Redis, Memcached): выход и flush() очищают запись только
+в том кэше, который видит текущий процесс, и с локальным кэшем другие
+процессы продолжали бы отдавать сессию вошедшего пользователя.
+
+Подключается через SESSION_ENGINE = 'api.cached_sessions' (в shop/settings.py -
+при заданном SESSION_CACHE_BACKEND).
+"""
+from django.contrib.sessions.backends import cached_db
+
+from .sessions import WriteOnChangeMixin
+
+
+class SessionStore(WriteOnChangeMixin, cached_db.SessionStore):
+    pass
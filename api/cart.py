@@ -0,0 +1,334 @@
+# api/cart.py
+"""Сервис корзины.
+
+Суммы считаются в БД, а не циклом по товарам. Изменения количества
+выполняются одним UPDATE с F('quantity'), а пара (cart, product) уникальна,
+поэтому параллельные добавления не теряются и не создают дублей.
+
+Корзина создается лениво, при первом добавлении товара (get_cart).
+prune_carts() удаляет брошенные строки корзин и пустые корзины.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch, Sum, prefetch_related_objects
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+# Сумма по строке корзины: количество * текущая цена товара
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('product__price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
+@dataclass
+class CartSummary:
+    items: list
+    item_count: int
+    total: Decimal
+
+
+def cart_items(cart):
+    """Строки корзины с товаром, категорией и суммой по строке (line_total)"""
+    return (
+        CartItem.objects.filter(cart=cart)
+        .select_related('product__category')
+        .annotate(line_total=LINE_TOTAL)
+        .order_by('id')
+    )
+
+
+def cart_totals(cart):
+    """Число единиц товара и итоговая сумма одним агрегирующим запросом"""
+    totals = CartItem.objects.filter(cart=cart).aggregate(
+        item_count=Sum('quantity'),
+        total=Sum(LINE_TOTAL),
+    )
+    return totals['item_count'] or 0, totals['total'] or Decimal('0')
+
+
+def cart_summary(cart):
+    """Строки, количество и сумма корзины - два запроса при любом размере"""
+    if cart is None:
+        return CartSummary([], 0, Decimal('0'))
+    items = list(cart_items(cart))
+    item_count, total = cart_totals(cart)
+    return CartSummary(items, item_count, total)
+
+
+def _prefetched_items():
+    return Prefetch('items', queryset=CartItem.objects.select_related('product__category').annotate(
+        line_total=LINE_TOTAL
+    ).order_by('id'))
+
+
+def get_cart_with_items(user):
+    """Корзина пользователя с предзагруженными строками (для CartSerializer)"""
+    return Cart.objects.prefetch_related(_prefetched_items()).get(user=user)
+
+
+def with_items(cart):
+    """Предзагружает строки в уже полученную корзину - без повторного SELECT корзины"""
+    prefetch_related_objects([cart], _prefetched_items())
+    return cart
+
+
+def get_cart(user):
+    """Корзина пользователя; создается при первом обращении.
+
+    Давно не менявшейся корзине обновляется updated_at: иначе prune_carts()
+    мог бы удалить ее как пустую между get_cart() и вставкой строки, и
+    INSERT сослался бы на удаленную корзину.
+
+    У только что созданной корзины is_new=True: add_item() вставляет строку
+    сразу, без UPDATE, который заведомо ничего не нашел бы.
+    """
+    cart, created = Cart.objects.get_or_create(user=user)
+    cart.is_new = created
+    now = timezone.now()
+    if not created and cart.updated_at < now - get_empty_cart_ttl() / 2:
+        if not Cart.objects.filter(pk=cart.pk).update(updated_at=now):
+            # Корзину только что удалила prune_carts()
+            return get_cart(user)
+        cart.updated_at = now
+    return cart
+
+
+def _items(cart, product_id):
+    """Строка корзины; cart - объект Cart или его id"""
+    return CartItem.objects.filter(cart_id=getattr(cart, 'pk', cart), product_id=product_id)
+
+
+def _create_item(cart, product_id, quantity):
+    CartItem.objects.create(cart_id=getattr(cart, 'pk', cart), product_id=product_id, quantity=quantity)
+
+
+def _insert_item(cart, product_id, quantity):
+    try:
+        with transaction.atomic():
+            _create_item(cart, product_id, quantity)
+    except IntegrityError:
+        # Строку только что вставил параллельный запрос
+        _items(cart, product_id).update(quantity=F('quantity') + quantity, updated_at=timezone.now())
+
+
+def _item_quantity(cart, product_id):
+    return (
+        _items(cart, product_id)
+        .values_list('quantity', flat=True)
+        .first()
+    ) or 0
+
+
+def add_item(cart, product_id, quantity=1, return_quantity=True):
+    """Увеличивает количество товара в корзине (upsert). Возвращает новое количество.
+
+    return_quantity=False - без SELECT нового количества (возвращает None).
+    """
+    if quantity < 1:
+        raise ValueError('quantity должно быть положительным')
+    items = _items(cart, product_id)
+    if getattr(cart, 'is_new', False):
+        cart.is_new = False
+        _insert_item(cart, product_id, quantity)
+    else:
+        with transaction.atomic():
+            if not items.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+                _insert_item(cart, product_id, quantity)
+    if return_quantity:
+        return _item_quantity(cart, product_id)
+
+
+def set_quantity(cart, product_id, quantity):
+    """Устанавливает количество; 0 и меньше - удаление. Возвращает новое количество."""
+    if quantity <= 0:
+        remove_item(cart, product_id)
+        return 0
+    items = _items(cart, product_id)
+    with transaction.atomic():
+        if not items.update(quantity=quantity, updated_at=timezone.now()):
+            try:
+                with transaction.atomic():
+                    _create_item(cart, product_id, quantity)
+            except IntegrityError:
+                items.update(quantity=quantity, updated_at=timezone.now())
+    return quantity
+
+
+def decrease_item(cart, product_id, quantity=1):
+    """Уменьшает количество; строка удаляется, когда оно доходит до нуля"""
+    items = _items(cart, product_id)
+    with transaction.atomic():
+        if not items.filter(quantity__gt=quantity).update(
+            quantity=F('quantity') - quantity, updated_at=timezone.now()
+        ):
+            items.delete()
+            return 0
+    return _item_quantity(cart, product_id)
+
+
+def remove_item(cart, product_id):
+    deleted, _ = _items(cart, product_id).delete()
+    return bool(deleted)
+
+
+def merge_items(cart, quantities):
+    """Добавляет {product_id: quantity} к корзине одним INSERT ... ON CONFLICT.
+
+    Количество суммируется с уже лежащим в корзине, несуществующие товары
+    пропускаются. Возвращает число перенесенных товаров.
+    """
+    existing = set(Product.objects.filter(id__in=list(quantities)).values_list('id', flat=True))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (getattr(cart, 'pk', cart), product_id, quantity, now)
+        for product_id, quantity in quantities.items()
+        if product_id in existing and quantity > 0
+    ]
+    if not rows:
+        return 0
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    cart_id, product_id, quantity, updated_at = (
+        qn(CartItem._meta.get_field(name).column)
+        for name in ('cart', 'product', 'quantity', 'updated_at')
+    )
+    # Уникальность (cart, product) - ограничение unique_cart_product
+    sql = (
+        f'INSERT INTO {table} ({cart_id}, {product_id}, {quantity}, {updated_at}) VALUES '
+        f'{", ".join(["(%s, %s, %s, %s)"] * len(rows))} '
+        f'ON CONFLICT ({cart_id}, {product_id}) '
+        f'DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity}, '
+        f'{updated_at} = excluded.{updated_at}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+    return len(rows)
+
+
+class UnknownProducts(ValueError):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Товары не найдены: {self.product_ids}')
+
+
+def apply_operations(cart, operations):
+    """Применяет пакет операций к корзине в одной транзакции.
+
+    operations - список словарей {'op': 'add'|'set'|'remove', 'product_id', 'quantity'}.
+    Операции применяются по порядку; в БД уходит фиксированное число запросов:
+    чтение строк и товаров, bulk_create, bulk_update и один DELETE.
+    """
+    product_ids = {op['product_id'] for op in operations}
+    if not product_ids:
+        return
+    is_new = getattr(cart, 'is_new', False)
+    cart.is_new = False
+    try:
+        _apply_operations(cart, operations, product_ids, is_new)
+    except IntegrityError:
+        # Параллельный запрос вставил одну из строк - пересчитываем от нового состояния
+        _apply_operations(cart, operations, product_ids)
+
+
+def _apply_operations(cart, operations, product_ids, is_new=False):
+    with transaction.atomic():
+        # В только что созданной корзине читать нечего
+        existing = {} if is_new else {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(
+                cart=cart, product_id__in=product_ids
+            )
+        }
+        missing = product_ids - set(existing) - set(
+            Product.objects.filter(id__in=product_ids - set(existing)).values_list('id', flat=True)
+        )
+        if missing:
+            raise UnknownProducts(missing)
+
+        quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        for op in operations:
+            product_id = op['product_id']
+            if op['op'] == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + op.get('quantity', 1)
+            elif op['op'] == 'set':
+                quantities[product_id] = op['quantity']
+            elif op['op'] == 'remove':
+                quantities[product_id] = 0
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id, quantity in quantities.items():
+            item = existing.get(product_id)
+            if quantity <= 0:
+                if item is not None:
+                    to_delete.append(item.pk)
+            elif item is None:
+                to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                item.updated_at = timezone.now()
+                to_update.append(item)
+
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+        if to_delete:
+            CartItem.objects.filter(pk__in=to_delete).delete()
+
+
+def get_item_ttl():
+    return timedelta(seconds=getattr(settings, 'CART_ITEM_TTL', 90 * 24 * 60 * 60))
+
+
+def get_empty_cart_ttl():
+    return timedelta(seconds=getattr(settings, 'CART_EMPTY_TTL', 60 * 60))
+
+
+@dataclass
+class PruneStats:
+    items: int = 0
+    carts: int = 0
+
+
+def _delete_in_batches(queryset, batch_size, pause):
+    """Удаляет строки queryset пачками; возвращает их число.
+
+    Каждая пачка - отдельная короткая транзакция, в которой условие
+    queryset проверяется заново: строка, которую успели изменить после
+    выборки id, не удаляется.
+    """
+    label = queryset.model._meta.label
+    removed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return removed
+            removed += queryset.filter(id__in=ids).delete()[1].get(label, 0)
+        if pause:
+            time.sleep(pause)
+
+
+def prune_carts(batch_size=1000, pause=0):
+    """Удаляет строки корзин старше CART_ITEM_TTL, затем пустые корзины старше CART_EMPTY_TTL.
+
+    pause - пауза между пачками в секундах, чтобы не занимать запись надолго
+    под нагрузкой. Возвращает PruneStats.
+    """
+    now = timezone.now()
+    stats = PruneStats()
+    stats.items = _delete_in_batches(
+        CartItem.objects.filter(updated_at__lt=now - get_item_ttl()), batch_size, pause
+    )
+    stats.carts = _delete_in_batches(
+        Cart.objects.filter(items__isnull=True, updated_at__lt=now - get_empty_cart_ttl()),
+        batch_size, pause,
+    )
+    return stats
@@ -0,0 +1,328 @@
+# api/catalog_io.py
+"""Массовый импорт и экспорт товаров (CSV и JSONL).
+
+Колонки: sku, name, description, price, category (slug), stock, image.
+Строка сопоставляется с товаром по артикулу (sku): новые товары создаются
+через bulk_create, измененные обновляются через bulk_update, совпадающие
+не трогаются. Вход читается потоково и обрабатывается пачками по
+batch_size строк: одна пачка - одна транзакция, один SELECT существующих
+артикулов и пакетное обновление поискового индекса, журнала изменений и
+кэша каталога (bulk-операции не вызывают сигналы save()).
+
+image - URL (http/https) или путь относительно images_dir (по умолчанию
+MEDIA_ROOT, так что файл экспорта загружается обратно без изменений);
+пути, ведущие за пределы images_dir, отклоняются.
+Изображения скачиваются в пуле потоков, ресайз идет в пуле процессов
+api/images.py.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from . import changes
+from . import images
+from . import search
+from .models import Category, Product
+from .renderers import dumps
+from .storage import product_image_storage
+
+FIELDS = ('sku', 'name', 'description', 'price', 'category', 'stock', 'image')
+FORMATS = ('csv', 'jsonl')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# Поля товара, которые импорт сравнивает и обновляет
+COMPARED_FIELDS = ('name', 'description', 'price', 'category_id', 'stock')
+UPDATE_FIELDS = ('name', 'description', 'price', 'category', 'stock', 'in_stock', 'updated_at')
+# Колонки .values() для экспорта
+EXPORT_COLUMNS = ('sku', 'name', 'description', 'price', 'category__slug', 'stock', 'image')
+
+DEFAULT_BATCH_SIZE = 1000
+IMAGE_TIMEOUT = 30  # секунд
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    try:
+        return EXTENSIONS[os.path.splitext(path)[1].lower()]
+    except KeyError:
+        raise ValueError(f'Не удалось определить формат по имени {path!r}, укажите --format')
+
+
+def read_rows(stream, fmt):
+    """(номер строки, dict или RowError) по одной записи входа"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield number, RowError(f'неверный JSON: {exc}')
+            continue
+        yield number, row if isinstance(row, dict) else RowError('ожидается объект JSON')
+
+
+def _clean_field(name, value):
+    try:
+        return Product._meta.get_field(name).clean(value, None)
+    except ValidationError as exc:
+        raise RowError(f'{name}: {" ".join(exc.messages)}')
+
+
+def clean_row(row, categories):
+    """Поля товара из строки входа; categories - {slug: id}"""
+    if isinstance(row, RowError):
+        raise row
+    values = {}
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError('sku: обязательное поле')
+    values['sku'] = _clean_field('sku', sku)
+    for name in ('name', 'description', 'price'):
+        value = row.get(name)
+        values[name] = _clean_field(name, value.strip() if isinstance(value, str) else value)
+    stock = row.get('stock')
+    values['stock'] = _clean_field('stock', 0 if stock in (None, '') else stock)
+
+    slug = (row.get('category') or '').strip()
+    if slug and slug not in categories:
+        raise RowError(f'category: нет категории {slug!r}')
+    values['category_id'] = categories.get(slug)
+    values['image'] = (row.get('image') or '').strip()
+    return values
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    errors: list = field(default_factory=list)
+    images: int = 0
+    image_errors: list = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+class ProductImporter:
+    """Импорт потока строк пачками; изображения - в пуле потоков.
+
+    image_workers=0 - изображения обрабатываются в текущем потоке (тесты,
+    отладка). progress(stats) вызывается после каждой пачки.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, images_dir=None, image_workers=4,
+                 fetch_images=True, progress=None):
+        self.batch_size = batch_size
+        self.images_dir = str(images_dir or settings.MEDIA_ROOT)
+        self.image_workers = image_workers
+        self.fetch_images = fetch_images
+        self.progress = progress
+        self.stats = ImportStats()
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self._lock = threading.Lock()
+        self._pool = None
+        # Не больше стольких изображений в очереди: память не растет с размером файла
+        self._pending = threading.BoundedSemaphore(max(1, image_workers) * 4)
+
+    def run(self, rows):
+        if self.fetch_images and self.image_workers:
+            self._pool = ThreadPoolExecutor(self.image_workers, thread_name_prefix='import-images')
+        try:
+            batch = []
+            for number, row in rows:
+                self.stats.rows += 1
+                try:
+                    batch.append((number, clean_row(row, self.categories)))
+                except RowError as exc:
+                    self.stats.errors.append((number, str(exc)))
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch)
+                    batch = []
+            if batch:
+                self._import_batch(batch)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+        return self.stats
+
+    def _import_batch(self, batch):
+        # Повтор артикула внутри пачки: действует последняя строка
+        by_sku = {values['sku']: values for _, values in batch}
+        now = timezone.now()
+        created, updated, image_jobs = [], [], []
+        with transaction.atomic():
+            existing = Product.objects.filter(sku__in=list(by_sku)).only(
+                'id', 'sku', 'image', *COMPARED_FIELDS, 'in_stock'
+            ).in_bulk(field_name='sku')
+            for sku, values in by_sku.items():
+                image = values.pop('image')
+                product = existing.get(sku)
+                if product is None:
+                    product = Product(**values, in_stock=values['stock'] > 0)
+                    created.append(product)
+                elif any(getattr(product, name) != values[name] for name in COMPARED_FIELDS):
+                    previous_category_id = product.category_id
+                    for name, value in values.items():
+                        setattr(product, name, value)
+                    product.in_stock = product.stock > 0
+                    product.updated_at = now
+                    product._loaded_category_id = previous_category_id
+                    updated.append(product)
+                if image:
+                    image_jobs.append((product, image))
+
+            Product.objects.bulk_create(created, batch_size=self.batch_size)
+            Product.objects.bulk_update(updated, UPDATE_FIELDS, batch_size=self.batch_size)
+            touched = created + updated
+            search.index_products(touched)
+            changes.record(changes.PRODUCT, [product.pk for product in touched])
+        self._invalidate(touched)
+
+        self.stats.created += len(created)
+        self.stats.updated += len(updated)
+        self.stats.unchanged += len(by_sku) - len(touched)
+        for product, image in image_jobs:
+            self._submit_image(product.pk, product.image.name if product.image else '', image)
+        if self.progress:
+            self.progress(self.stats)
+
+    def _invalidate(self, products):
+        if not products:
+            return
+        scopes = {catalog_cache.PRODUCTS}
+        for product in products:
+            scopes.add(catalog_cache.product_scope(product.pk))
+            for category_id in (product.category_id, getattr(product, '_loaded_category_id', None)):
+                if category_id:
+                    scopes.add(catalog_cache.category_scope(category_id))
+        catalog_cache.bump(*scopes)
+
+    def _submit_image(self, product_id, current, reference):
+        if not self.fetch_images:
+            return
+        if self._pool is None:
+            self._process_image(product_id, current, reference)
+            return
+        self._pending.acquire()
+        future = self._pool.submit(self._process_image_in_thread, product_id, current, reference)
+        future.add_done_callback(lambda _: self._pending.release())
+
+    def _process_image_in_thread(self, product_id, current, reference):
+        try:
+            self._process_image(product_id, current, reference)
+        finally:
+            connection.close()
+
+    def _load_image(self, reference):
+        if urlparse(reference).scheme in ('http', 'https'):
+            with urllib.request.urlopen(reference, timeout=IMAGE_TIMEOUT) as response:
+                data = response.read(MAX_IMAGE_SIZE + 1)
+            filename = os.path.basename(urlparse(reference).path) or 'image'
+        else:
+            root = os.path.realpath(self.images_dir)
+            path = os.path.realpath(os.path.join(root, reference))
+            # Абсолютный путь, ../ или ссылка наружу прочитали бы любой файл сервера
+            if os.path.commonpath([root, path]) != root:
+                raise RowError('путь вне каталога изображений')
+            with open(path, 'rb') as source:
+                data = source.read(MAX_IMAGE_SIZE + 1)
+            filename = os.path.basename(path)
+        if len(data) > MAX_IMAGE_SIZE:
+            raise RowError('файл больше MAX_IMAGE_SIZE')
+        return filename, data
+
+    def _process_image(self, product_id, current, reference):
+        from PIL import Image
+
+        try:
+            filename, data = self._load_image(reference)
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+            upload_name = Product._meta.get_field('image').generate_filename(None, filename)
+            name = product_image_storage.save(upload_name, ContentFile(data))
+            if name != current:
+                Product.objects.filter(pk=product_id).update(
+                    image=name, image_derivatives={}, updated_at=timezone.now()
+                )
+                product = Product.objects.only('id', 'category_id').get(pk=product_id)
+                catalog_cache.invalidate_product(product)
+                changes.record(changes.PRODUCT, [product_id])
+            elif images.is_current(Product.objects.only('image', 'image_derivatives').get(pk=product_id)):
+                return
+            images.save_to_product(product_id, name, images.store_derivatives(name, self._render(data)))
+        except Exception as exc:
+            with self._lock:
+                self.stats.image_errors.append((reference, str(exc) or type(exc).__name__))
+            return
+        with self._lock:
+            self.stats.images += 1
+
+    def _render(self, data):
+        args = (data, images.get_widths(), images.get_formats())
+        if not getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+            return images.render_derivatives(*args)
+        return images.get_executor().submit(images.render_derivatives, *args).result()
+
+
+def export_rows(queryset, chunk_size=DEFAULT_BATCH_SIZE):
+    """Строки экспорта (dict по FIELDS) без создания экземпляров модели"""
+    for row in queryset.values(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size):
+        yield {
+            'sku': row['sku'] or '',
+            'name': row['name'],
+            'description': row['description'],
+            'price': f'{row["price"]:.2f}',
+            'category': row['category__slug'] or '',
+            'stock': row['stock'],
+            'image': row['image'] or '',
+        }
+
+
+def write_rows(stream, rows, fmt):
+    """Пишет строки в поток; возвращает их число"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in rows:
+        stream.write(dumps(row).decode())
+        stream.write('\n')
+        count += 1
+    return count
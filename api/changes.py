@@ -0,0 +1,97 @@
+# api/changes.py
+"""Журнал изменений каталога для дельта-синхронизации клиентов.
+
+Сигналы Product/Category и массовые UPDATE (склад, копии изображений)
+дописывают в CatalogChange строки (модель, id объекта, upsert|delete).
+Клиент хранит курсор - id последней прочитанной строки - и запрашивает
+/api/products/changes/?since=<курсор>: в ответ приходят текущие версии
+измененных объектов и id удаленных, без повторной выгрузки всего каталога.
+SQLite сериализует запись, поэтому id растут в порядке фиксации транзакций.
+
+compact() оставляет по одной, последней, строке на объект: любой курсор
+остается действительным (все, что менялось после него, по-прежнему лежит
+в журнале выше курсора), а размер журнала ограничен числом объектов.
+Записи об удалении не истекают, иначе клиент со старым курсором не узнал
+бы об удалении.
+"""
+from django.conf import settings
+from django.db.models import Max
+
+from .models import CatalogChange, Product
+
+PRODUCT = 'product'
+CATEGORY = 'category'
+
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def record(kind, object_ids, action=CatalogChange.UPSERT):
+    """Дописывает в журнал изменения объектов kind с id из object_ids"""
+    object_ids = sorted(set(object_ids))
+    if object_ids:
+        CatalogChange.objects.bulk_create(
+            [CatalogChange(model=kind, object_id=pk, action=action) for pk in object_ids]
+        )
+
+
+def record_category_products(category_id):
+    """Товары категории: меняется их category_name или category (SET NULL)"""
+    record(PRODUCT, Product.objects.filter(category_id=category_id).values_list('pk', flat=True))
+
+
+def get_batch_size(value=None):
+    default = getattr(settings, 'CHANGE_FEED_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_BATCH_SIZE))
+
+
+def parse_cursor(value):
+    if not value:
+        return 0
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise InvalidCursor(value)
+    if cursor < 0:
+        raise InvalidCursor(value)
+    return cursor
+
+
+def read(kind, since=0, limit=DEFAULT_BATCH_SIZE):
+    """Следующая пачка журнала после курсора since.
+
+    Возвращает (курсор, есть_ли_еще, [id измененных], [id удаленных]);
+    повторы одного объекта в пачке схлопываются до последнего действия.
+    """
+    entries = list(
+        CatalogChange.objects.filter(model=kind, id__gt=since)
+        .order_by('id').values_list('id', 'object_id', 'action')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    latest = {}
+    for _, object_id, action in entries:
+        latest[object_id] = action
+    upserts = sorted(pk for pk, action in latest.items() if action == CatalogChange.UPSERT)
+    deletes = sorted(pk for pk, action in latest.items() if action == CatalogChange.DELETE)
+    cursor = entries[-1][0] if entries else since
+    return cursor, has_more, upserts, deletes
+
+
+def compact(batch_size=1000):
+    """Удаляет строки, перекрытые более поздними по тому же объекту; возвращает их число"""
+    latest = CatalogChange.objects.values('model', 'object_id').annotate(last=Max('id')).values('last')
+    removed = 0
+    while True:
+        ids = list(CatalogChange.objects.exclude(id__in=latest).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        removed += CatalogChange.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,133 @@
+# api/checkout.py
+"""Оформление заказа - общий путь для API и HTML-страницы."""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from . import inventory
+from .models import Cart, CartItem, IdempotencyKey, Order, OrderItem
+
+ORDER_LINE_TOTAL = ExpressionWrapper(
+    F('price') * F('quantity'),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+class InvalidIdempotencyKey(ValueError):
+    """Ключ длиннее IDEMPOTENCY_KEY_MAX_LENGTH - обрезать нельзя, ключи столкнутся"""
+
+
+def get_idempotency_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def find_replayed_order(user, key):
+    """Заказ, уже созданный с этим ключом (с учетом TTL), или None"""
+    cutoff = timezone.now() - get_idempotency_ttl()
+    record = (
+        IdempotencyKey.objects.select_related('order')
+        .filter(user=user, key=key, created_at__gte=cutoff, order__isnull=False)
+        .first()
+    )
+    return record.order if record else None
+
+
+def purge_expired_keys(batch_size=1000):
+    """Удаляет просроченные ключи пачками; возвращает число удаленных"""
+    cutoff = timezone.now() - get_idempotency_ttl()
+    removed = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(created_at__lt=cutoff)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+
+
+def place_order(user, shipping_address, idempotency_key=None):
+    """Создает заказ из корзины пользователя и очищает корзину.
+
+    Одна короткая транзакция: строки корзины блокируются, остатки списываются
+    условным UPDATE (при нехватке - OutOfStock), цены фиксируются на момент
+    заказа, OrderItem создаются через bulk_create, сумма считается в БД.
+
+    С idempotency_key повторный запрос возвращает уже созданный заказ
+    (атрибут replayed=True), не трогая корзину. Слишком длинный ключ -
+    InvalidIdempotencyKey.
+    """
+    if not idempotency_key:
+        return _place_order(user, shipping_address)
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise InvalidIdempotencyKey(idempotency_key)
+    try:
+        return _place_order(user, shipping_address, idempotency_key)
+    except IntegrityError:
+        # Параллельный запрос с тем же ключом успел первым
+        order = find_replayed_order(user, idempotency_key)
+        if order is None:
+            raise
+        order.replayed = True
+        return order
+
+
+def _place_order(user, shipping_address, idempotency_key=None):
+    with transaction.atomic():
+        record = None
+        if idempotency_key:
+            order = find_replayed_order(user, idempotency_key)
+            if order is not None:
+                order.replayed = True
+                return order
+            # Просроченная запись с тем же ключом больше не действует
+            IdempotencyKey.objects.filter(user=user, key=idempotency_key).delete()
+            record = IdempotencyKey.objects.create(user=user, key=idempotency_key)
+
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        if cart is None:
+            raise EmptyCartError()
+
+        lines = list(
+            CartItem.objects.select_for_update(of=('self',))
+            .filter(cart=cart)
+            .order_by('id')
+            .values_list('product_id', 'quantity', 'product__price')
+        )
+        if not lines:
+            raise EmptyCartError()
+
+        inventory.reserve((product_id, quantity) for product_id, quantity, _ in lines)
+
+        order = Order.objects.create(
+            user=user,
+            total_price=0,
+            shipping_address=shipping_address,
+            status='pending',
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity, price=price)
+            for product_id, quantity, price in lines
+        ])
+
+        order.total_price = OrderItem.objects.filter(order=order).aggregate(
+            total=Sum(ORDER_LINE_TOTAL)
+        )['total']
+        Order.objects.filter(pk=order.pk).update(total_price=order.total_price)
+
+        CartItem.objects.filter(cart=cart).delete()
+
+        if record is not None:
+            IdempotencyKey.objects.filter(pk=record.pk).update(order=order)
+    order.replayed = False
+    return order
@@ -0,0 +1,61 @@
+# api/checks.py
+"""Проверки настроек (manage.py check --deploy) и индекса поиска.
+
+Версии кэша каталога (api/cache.py) и сессии api.cached_sessions должны
+быть видны всем процессам сервера. LocMemCache у каждого процесса свой:
+сброс версии после изменения товара доходит только до одного процесса,
+остальные отдают старые страницы и ETag до истечения TTL.
+
+Индекс products_fts миграция 0003 создает пустым: товары, которые уже
+были в базе, не находятся поиском до manage.py rebuild_search_index.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.db import connections
+
+LOCAL_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def _is_local(alias):
+    return settings.CACHES.get(alias, {}).get('BACKEND') == LOCAL_BACKEND
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    if settings.DEBUG:
+        return []
+    errors = []
+    catalog_alias = getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')
+    if _is_local(catalog_alias):
+        errors.append(Error(
+            f'Кэш каталога CACHES[{catalog_alias!r}] - локальный для процесса',
+            hint='Задайте общий бэкенд через CATALOG_CACHE_BACKEND и CATALOG_CACHE_LOCATION '
+                 '(Redis, Memcached, FileBasedCache на общем диске)',
+            id='api.E001',
+        ))
+    if settings.SESSION_ENGINE == 'api.cached_sessions' and _is_local(settings.SESSION_CACHE_ALIAS):
+        errors.append(Error(
+            f'Кэш сессий CACHES[{settings.SESSION_CACHE_ALIAS!r}] - локальный для процесса',
+            hint='Задайте общий бэкенд через SESSION_CACHE_BACKEND или уберите его, '
+                 'чтобы сессии читались из БД',
+            id='api.E002',
+        ))
+    return errors
+
+
+@register(Tags.database)
+def check_search_index(app_configs, databases=None, **kwargs):
+    """Запускается с базой: manage.py check --database default, migrate"""
+    from . import search
+    from .models import Product
+
+    warnings = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if search.is_index_empty(connection) and Product.objects.using(alias).exists():
+            warnings.append(Warning(
+                f'Поисковый индекс {search.FTS_TABLE} в базе {alias!r} пуст, а товары есть',
+                hint='Выполните manage.py rebuild_search_index',
+                id='api.W001',
+            ))
+    return warnings
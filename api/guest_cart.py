@@ -0,0 +1,143 @@
+# api/guest_cart.py
+"""Корзина анонимного посетителя в подписанной cookie.
+
+Гостю не создается строка Cart: товары и количества лежат в cookie
+GUEST_CART_COOKIE_NAME вида "<id товара>:<количество>.<id>:<количество>",
+подписанной SECRET_KEY (клиент не может подделать содержимое, но может его
+прочитать - там только id и количества). Изменения гостевой корзины не
+пишут в БД ничего, страница корзины читает товары одним запросом.
+
+При входе (login_view, register_view, CustomAuthToken) merge() переносит
+гостевую корзину в Cart пользователя одним INSERT ... ON CONFLICT
+(cart.merge_items), после чего cookie удаляется.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import cart as cart_service
+from .cart import CartSummary
+from .models import Product
+
+SALT = 'api.guest_cart'
+# Ограничения держат cookie в пределах ~1 КБ
+MAX_ITEMS = 50
+MAX_QUANTITY = 99
+
+
+def get_cookie_name():
+    return getattr(settings, 'GUEST_CART_COOKIE_NAME', 'cart')
+
+
+def get_cookie_age():
+    return getattr(settings, 'GUEST_CART_COOKIE_AGE', 30 * 24 * 60 * 60)
+
+
+class GuestCartFull(ValueError):
+    pass
+
+
+def _parse(value):
+    items = {}
+    for pair in value.split('.') if value else ():
+        product_id, _, quantity = pair.partition(':')
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except ValueError:
+            continue
+        if product_id > 0 and quantity > 0:
+            items[product_id] = min(quantity, MAX_QUANTITY)
+    return dict(list(items.items())[:MAX_ITEMS])
+
+
+def _format(items):
+    return '.'.join(f'{product_id}:{quantity}' for product_id, quantity in items.items())
+
+
+def load(request):
+    """{id товара: количество} из cookie; подделанная или просроченная cookie - пустая корзина"""
+    value = request.get_signed_cookie(
+        get_cookie_name(), default=None, salt=SALT, max_age=get_cookie_age()
+    )
+    return _parse(value)
+
+
+def save(response, items):
+    if not items:
+        response.delete_cookie(get_cookie_name(), samesite='Lax')
+        return
+    response.set_signed_cookie(
+        get_cookie_name(), _format(items), salt=SALT, max_age=get_cookie_age(),
+        httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+def add(items, product_id, quantity=1):
+    """Увеличивает количество; возвращает новое"""
+    if product_id not in items and len(items) >= MAX_ITEMS:
+        raise GuestCartFull(f'В корзине гостя не больше {MAX_ITEMS} товаров')
+    items[product_id] = min(items.get(product_id, 0) + quantity, MAX_QUANTITY)
+    return items[product_id]
+
+
+def set_quantity(items, product_id, quantity):
+    """Устанавливает количество; 0 и меньше - удаление. Возвращает новое количество."""
+    if quantity <= 0:
+        items.pop(product_id, None)
+        return 0
+    if product_id not in items:
+        return add(items, product_id, quantity)
+    items[product_id] = min(quantity, MAX_QUANTITY)
+    return items[product_id]
+
+
+def decrease(items, product_id, quantity=1):
+    return set_quantity(items, product_id, items.get(product_id, 0) - quantity)
+
+
+@dataclass
+class GuestCartItem:
+    product: Product
+    quantity: int
+
+    @property
+    def id(self):
+        # Строк корзины в БД нет: в URL изменения и удаления - id товара
+        return self.product.pk
+
+    @property
+    def line_total(self):
+        return self.product.price * self.quantity
+
+
+def summary(items):
+    """CartSummary гостевой корзины одним запросом; удаленные товары пропускаются"""
+    products = Product.objects.select_related('category').in_bulk(list(items))
+    lines = [
+        GuestCartItem(products[product_id], quantity)
+        for product_id, quantity in items.items() if product_id in products
+    ]
+    return CartSummary(
+        lines,
+        sum(line.quantity for line in lines),
+        sum((line.line_total for line in lines), Decimal('0')),
+    )
+
+
+def merge(request, user):
+    """Переносит гостевую корзину из cookie запроса в Cart пользователя.
+
+    Возвращает число перенесенных товаров; cookie удаляет forget().
+    """
+    items = load(request)
+    if not items:
+        return 0
+    return cart_service.merge_items(cart_service.get_cart(user), items)
+
+
+def forget(request, response):
+    """Удаляет cookie гостевой корзины, если она была"""
+    if get_cookie_name() in request.COOKIES:
+        response.delete_cookie(get_cookie_name(), samesite='Lax')
+    return response
@@ -0,0 +1,197 @@
+# api/images.py
+"""Уменьшенные копии изображений товаров (WebP и JPEG нескольких ширин).
+
+Загруженный оригинал не меняется; рядом, в <каталог>/derived/, создаются
+копии шириной IMAGE_DERIVATIVE_WIDTHS. Ресайз выполняется в пуле процессов,
+чтобы не занимать поток запроса; результат записывается в
+Product.image_derivatives:
+  {'source': 'products/a.png', 'width': 1920, 'height': 1080,
+   'webp': {'320': 'products/derived/a-320w.webp', ...}, 'jpeg': {...}}
+Запись действительна, пока source совпадает с текущим Product.image.
+
+Модуль импортируется дочерними процессами пула (spawn), поэтому модели
+импортируются внутри функций.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+
+from .storage import product_image_storage
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+# Фон для JPEG вместо прозрачности
+JPEG_BACKGROUND = (255, 255, 255)
+
+
+def get_widths():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 960)))
+
+
+def get_formats():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('webp', 'jpeg')))
+
+
+def derivative_name(name, width, fmt):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/derived/{stem}-{width}w.{EXTENSIONS[fmt]}'.lstrip('/')
+
+
+def render_derivatives(data, widths, formats):
+    """Ресайз в дочернем процессе: байты оригинала -> размеры и байты копий.
+
+    Возвращает (width, height, {fmt: [(width, bytes), ...]}). Копии шире
+    оригинала не создаются; если оригинал меньше минимальной ширины,
+    делается одна копия в исходном размере.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        source = ImageOps.exif_transpose(original)
+        source.load()
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if source.has_transparency_data else 'RGB')
+
+    targets = sorted({w for w in widths if w < source.width} or {source.width})
+    rendered = {fmt: [] for fmt in formats}
+    for width in targets:
+        height = max(1, round(source.height * width / source.width))
+        resized = source.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            image = resized
+            if fmt == 'jpeg' and image.mode == 'RGBA':
+                image = Image.new('RGB', image.size, JPEG_BACKGROUND)
+                image.paste(resized, mask=resized.getchannel('A'))
+            buffer = io.BytesIO()
+            image.save(buffer, **SAVE_OPTIONS[fmt])
+            rendered[fmt].append((width, buffer.getvalue()))
+    return source.width, source.height, rendered
+
+
+def store_derivatives(name, result, storage=None):
+    """Сохраняет копии в хранилище и возвращает запись для image_derivatives"""
+    storage = storage or default_storage
+    width, height, rendered = result
+    derivatives = {'source': name, 'width': width, 'height': height}
+    for fmt, items in rendered.items():
+        names = {}
+        for item_width, data in items:
+            target = derivative_name(name, item_width, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            names[str(item_width)] = storage.save(target, ContentFile(data))
+        derivatives[fmt] = names
+    return derivatives
+
+
+def save_to_product(product_id, name, derivatives):
+    """Записывает копии, только если у товара все еще то же изображение"""
+    from . import cache as catalog_cache
+    from . import changes
+    from .models import Product
+
+    # UPDATE без сигналов: индекс и прочие обработчики save() здесь не нужны.
+    # updated_at меняется, чтобы устарели ключи, построенные на нем
+    updated = Product.objects.filter(pk=product_id, image=name).update(
+        image_derivatives=derivatives, updated_at=timezone.now()
+    )
+    if updated:
+        product = Product.objects.only('id', 'category_id').get(pk=product_id)
+        catalog_cache.invalidate_product(product)
+        changes.record(changes.PRODUCT, [product_id])
+    return bool(updated)
+
+
+def process(product_id, name):
+    """Синхронно строит копии для изображения товара"""
+    with product_image_storage.open(name, 'rb') as source:
+        data = source.read()
+    result = render_derivatives(data, get_widths(), get_formats())
+    return save_to_product(product_id, name, store_derivatives(name, result))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(replace_broken=None):
+    """Общий пул процессов; replace_broken - сломанный пул, который нужно заменить"""
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor is replace_broken:
+            # spawn: fork из многопоточного сервера может унести чужие блокировки
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _finish(product_id, name, future):
+    # Выполняется в служебном потоке пула
+    try:
+        save_to_product(product_id, name, store_derivatives(name, future.result()))
+    except Exception:
+        logger.exception('Не удалось построить копии изображения %s', name)
+    finally:
+        connection.close()
+
+
+def schedule(product_id, name):
+    """Ставит построение копий в очередь (или выполняет сразу, если ASYNC выключен)"""
+    if not getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+        return process(product_id, name)
+    with product_image_storage.open(name, 'rb') as source:
+        data = source.read()
+    args = (render_derivatives, data, get_widths(), get_formats())
+    executor = get_executor()
+    try:
+        future = executor.submit(*args)
+    except BrokenProcessPool:
+        # Дочерний процесс упал (например, по памяти) - пул больше не принимает задачи
+        future = get_executor(replace_broken=executor).submit(*args)
+    future.add_done_callback(lambda f: _finish(product_id, name, f))
+    return future
+
+
+def is_current(product):
+    return bool(product.image) and product.image_derivatives.get('source') == product.image.name
+
+
+def derivative_urls(product, fmt, build_url=None):
+    """[(ширина, url), ...] копий формата fmt по возрастанию ширины"""
+    if not product.image:
+        return []
+    return record_urls(product.image.name, product.image_derivatives, fmt, build_url)
+
+
+def record_urls(source, derivatives, fmt, build_url=None):
+    """То же по имени изображения и записи image_derivatives (строки .values())"""
+    if not source or not derivatives or derivatives.get('source') != source:
+        return []
+    names = derivatives.get(fmt) or {}
+    urls = []
+    for width, name in sorted(names.items(), key=lambda item: int(item[0])):
+        url = default_storage.url(name)
+        urls.append((int(width), build_url(url) if build_url else url))
+    return urls
+
+
+def srcset(urls):
+    return ', '.join(f'{url} {width}w' for width, url in urls)
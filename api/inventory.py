@@ -0,0 +1,139 @@
+# api/inventory.py
+"""Складские остатки.
+
+Резерв при оформлении заказа - один условный UPDATE ... WHERE stock >= qty
+для всех позиций (qty подставляется через CASE по id): блокируются только
+строки заказанных товаров, и число запросов не зависит от размера корзины.
+in_stock пересчитывается тем же запросом. Отмена заказа возвращает товар
+на склад.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from . import cache as catalog_cache
+from . import changes
+from .models import Order, Product
+
+# Статусы, из которых заказ можно отменить с возвратом на склад
+CANCELLABLE_STATUSES = ('pending', 'paid')
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Недостаточно товара на складе: {self.product_ids}')
+
+
+def _merge(lines):
+    quantities = defaultdict(int)
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+    # Единый порядок блокировок исключает взаимоблокировки между заказами
+    return sorted(quantities.items())
+
+
+def _invalidate(product_ids):
+    if not product_ids:
+        return
+    products = list(Product.objects.filter(pk__in=product_ids).only('id', 'category_id'))
+
+    def invalidate():
+        for product in products:
+            catalog_cache.invalidate_product(product)
+        # in_stock изменился UPDATE без сигналов
+        changes.record(changes.PRODUCT, product_ids)
+
+    # Вызывается в транзакции заказа: до фиксации другой запрос снова
+    # положил бы в кэш старые остатки, а при откате журнал получил бы
+    # изменение, которого не было
+    transaction.on_commit(invalidate)
+
+
+class _PartialReservation(Exception):
+    pass
+
+
+def _quantity_case(merged):
+    return Case(
+        *(When(pk=product_id, then=Value(quantity)) for product_id, quantity in merged),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def reserve(lines):
+    """Списывает остатки для [(product_id, quantity), ...].
+
+    Вызывается внутри транзакции заказа: при нехватке хотя бы одной позиции
+    поднимает OutOfStock, и транзакция откатывается целиком.
+    """
+    merged = _merge(lines)
+    if not merged:
+        return
+    product_ids = [product_id for product_id, _ in merged]
+    needed = _quantity_case(merged)
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(pk__in=product_ids, stock__gte=needed).update(
+                stock=F('stock') - needed,
+                in_stock=Case(When(stock__gt=needed, then=Value(True)), default=Value(False)),
+            )
+            if updated != len(merged):
+                raise _PartialReservation()
+    except _PartialReservation:
+        wanted = dict(merged)
+        stocks = dict(Product.objects.filter(pk__in=product_ids).values_list('id', 'stock'))
+        raise OutOfStock(
+            product_id for product_id in product_ids if stocks.get(product_id, 0) < wanted[product_id]
+        )
+
+    # Кэш каталога меняется только у товаров, которые закончились
+    sold_out = Product.objects.filter(pk__in=product_ids, stock=0).values_list('id', flat=True)
+    _invalidate(list(sold_out))
+
+
+def release(lines):
+    """Возвращает товар на склад"""
+    merged = _merge(lines)
+    if not merged:
+        return
+    product_ids = [product_id for product_id, _ in merged]
+    restocked = list(
+        Product.objects.filter(pk__in=product_ids, stock=0).values_list('id', flat=True)
+    )
+    Product.objects.filter(pk__in=product_ids).update(
+        stock=F('stock') + _quantity_case(merged), in_stock=Value(True)
+    )
+    _invalidate(restocked)
+
+
+def adjust(product_id, delta):
+    """Меняет остаток на delta (приход или списание) поверх текущего значения.
+
+    Ручная правка остатка не должна перезаписывать резервы, сделанные после
+    того, как значение было прочитано; остаток не уходит ниже нуля.
+    """
+    if not delta:
+        return
+    Product.objects.filter(pk=product_id).update(
+        stock=Greatest(F('stock') + delta, Value(0)),
+        in_stock=Case(When(stock__gt=-delta, then=Value(True)), default=Value(False)),
+    )
+
+
+def cancel_order(order):
+    """Отменяет заказ и возвращает его позиции на склад.
+
+    Возвращает False, если заказ уже отменен или отправлен.
+    """
+    with transaction.atomic():
+        cancelled = Order.objects.filter(
+            pk=order.pk, status__in=CANCELLABLE_STATUSES
+        ).update(status='cancelled')
+        if not cancelled:
+            return False
+        release(order.items.values_list('product_id', 'quantity'))
+    order.status = 'cancelled'
+    return True
@@ -0,0 +1,66 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+
+from api import cache as catalog_cache
+from api.benchmarks import temporary_database
+from api.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк рендеринга каталога: карточки без кэша, с холодным и с теплым кэшем'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=24, help='карточек на странице')
+        parser.add_argument('--repeat', type=int, default=200, help='рендеров на замер')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            self.run(options['cards'], options['repeat'])
+
+    def run(self, cards, repeat):
+        categories = [
+            Category.objects.create(name=f'Категория {i}', slug=f'category-{i}') for i in range(4)
+        ]
+        Product.objects.bulk_create([
+            Product(
+                name=f'Товар {i}', description='Официальный мерч. ' * 20, price=Decimal(990 + i),
+                category=categories[i % 4], stock=i % 3,
+            )
+            for i in range(cards)
+        ])
+        products = list(Product.objects.select_related('category').order_by('id'))
+        context = {'products': products, 'categories': categories}
+
+        request = RequestFactory().get('/products/')
+        request.user = User.objects.create_user('bench')
+        anonymous = RequestFactory().get('/products/')
+        anonymous.user = AnonymousUser()
+
+        def measure(req):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                render_to_string('shop/products.html', context, request=req)
+            return (time.perf_counter() - started) / repeat * 1000
+
+        results = []
+        for label, req in (('аноним', anonymous), ('покупатель', request)):
+            with override_settings(PRODUCT_CARD_CACHE=False):
+                before = measure(req)
+            catalog_cache.get_cache().clear()
+            started = time.perf_counter()
+            render_to_string('shop/products.html', context, request=req)
+            cold = (time.perf_counter() - started) * 1000
+            warm = measure(req)
+            results.append((label, before, cold, warm))
+
+        self.stdout.write(f'Карточек на странице: {cards}, рендеров на замер: {repeat}')
+        self.stdout.write(f'{"":<12}{"без кэша":>12}{"холодный":>12}{"теплый":>12}{"ускорение":>12}')
+        for label, before, cold, warm in results:
+            self.stdout.write(
+                f'{label:<12}{before:>9.2f} мс{cold:>9.2f} мс{warm:>9.2f} мс{before / warm:>11.1f}x'
+            )
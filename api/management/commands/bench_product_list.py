@@ -0,0 +1,74 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarks import temporary_database
+from api.models import Category, Product
+from api.serializers import ProductRowSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк сериализации списка товаров: ProductSerializer по экземплярам модели '
+        'против ProductRowSerializer по строкам .values(), с ?fields= и без'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5, help='замеров на вариант (берется лучший)')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            self.run(options['products'], options['repeat'])
+
+    def run(self, count, repeat):
+        categories = [
+            Category.objects.create(name=f'Категория {i}', slug=f'category-{i}') for i in range(8)
+        ]
+        Product.objects.bulk_create(
+            [
+                Product(
+                    name=f'Товар {i}', description='Официальный мерч, лимитированный тираж. ' * 15,
+                    price=Decimal(990 + i), category=categories[i % 8], stock=i % 5,
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        queryset = Product.objects.select_related('category').order_by('id')
+        factory = APIRequestFactory()
+
+        def model_path(request):
+            return ProductSerializer(queryset, many=True, context={'request': request}).data
+
+        def values_path(request):
+            serializer = ProductRowSerializer(request)
+            return serializer.serialize(queryset.values(*serializer.columns()))
+
+        def measure(serialize, params):
+            request = Request(factory.get('/api/products/', params))
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = serialize(request)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            assert len(rows) == count
+            return best
+
+        self.stdout.write(f'Товаров: {count}, замеров: {repeat} (запрос к БД входит в время)')
+        self.stdout.write(f'{"":<28}{"модели":>12}{".values()":>12}{"ускорение":>12}{"строк/с":>12}')
+        for label, params in (
+            ('все поля', {}),
+            ('?fields=id,name,price', {'fields': 'id,name,price'}),
+            ('?exclude=description', {'exclude': 'description'}),
+        ):
+            before = measure(model_path, params)
+            after = measure(values_path, params)
+            self.stdout.write(
+                f'{label:<28}{before * 1000:>9.0f} мс{after * 1000:>9.0f} мс'
+                f'{before / after:>11.1f}x{count / after:>12.0f}'
+            )
@@ -0,0 +1,119 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.benchmarks import temporary_database
+from api.models import Cart, Category, Product
+
+# (название, настройки) - None означает текущие настройки проекта
+CONFIGS = (
+    ('db + SessionStorage', {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.session.SessionStorage',
+    }),
+    ('db + FallbackStorage', {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    }),
+    ('текущие настройки', None),
+)
+WRITES = ('INSERT INTO "django_session"', 'UPDATE "django_session"', 'DELETE FROM "django_session"')
+READS = ('FROM "django_session"',)
+
+
+class SessionCounter:
+    """Клиент, который считает запросы и обращения к django_session"""
+
+    def __init__(self):
+        # testserver нет в ALLOWED_HOSTS вне тестового окружения
+        self.client = Client(SERVER_NAME='localhost')
+        self.requests = self.writes = self.reads = 0
+
+    def request(self, method, path, data=None):
+        # Редиректы проходятся вручную: страница после клика тоже считается
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(path, data)
+            self.requests += 1
+            for query in queries:
+                sql = query['sql']
+                if sql.startswith(WRITES):
+                    self.writes += 1
+                elif sql.startswith('SELECT') and READS[0] in sql:
+                    self.reads += 1
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path}: {response.status_code}')
+            if response.status_code != 302:
+                return response
+            method, path, data = 'get', response['Location'], None
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк записей в django_session на запрос в сценариях корзины и оформления '
+        'заказа: движок db и сообщения в сессии против текущих настроек'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=10, help='добавлений в корзину на сценарий')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            self.run(options['clicks'])
+
+    def run(self, clicks):
+        category = Category.objects.create(name='Футболки', slug='t-shirts')
+        products = Product.objects.bulk_create([
+            Product(name=f'Товар {i}', price=Decimal(990 + i), category=category, stock=10 ** 6)
+            for i in range(clicks)
+        ])
+        scenarios = (('корзина', self.cart_flow), ('оформление заказа', self.checkout_flow))
+
+        self.stdout.write(f'Кликов по корзине на сценарий: {clicks}')
+        self.stdout.write(f'{"":<24}{"сценарий":<20}{"запросов":>10}{"записей":>10}{"чтений":>10}{"записей/запрос":>16}')
+        for number, (label, overrides) in enumerate(CONFIGS):
+            for name, scenario in scenarios:
+                username = f'bench-{number}-{name}'
+                user = User.objects.create_user(username, password='bench-password')
+                Cart.objects.get_or_create(user=user)
+                counter = SessionCounter()
+                if overrides is None:
+                    scenario(counter, username, products)
+                else:
+                    with override_settings(**overrides):
+                        scenario(counter, username, products)
+                self.stdout.write(
+                    f'{label:<24}{name:<20}{counter.requests:>10}{counter.writes:>10}'
+                    f'{counter.reads:>10}{counter.writes / counter.requests:>16.2f}'
+                )
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def login(self, counter, username):
+        counter.request('post', reverse('login'), {'username': username, 'password': 'bench-password'})
+
+    def cart_flow(self, counter, username, products):
+        self.login(counter, username)
+        counter.request('get', reverse('products'))
+        for product in products:
+            counter.request('get', reverse('add_to_cart', args=[product.id]))
+        counter.request('get', reverse('cart'))
+        items = list(Cart.objects.get(user__username=username).items.values_list('id', flat=True))
+        for item_id in items[:len(items) // 2]:
+            counter.request('post', reverse('update_cart_item', args=[item_id]), {'action': 'increase'})
+        for item_id in items[len(items) // 2:]:
+            counter.request('get', reverse('remove_from_cart', args=[item_id]))
+        counter.request('post', reverse('clear_cart'))
+
+    def checkout_flow(self, counter, username, products):
+        self.login(counter, username)
+        for product in products:
+            counter.request('get', reverse('add_to_cart', args=[product.id]))
+        counter.request('get', reverse('checkout'))
+        counter.request('post', reverse('checkout'), {'shipping_address': 'Москва, ул. Тверская, 1'})
+        counter.request('get', reverse('profile'))
+        counter.request('get', reverse('logout'))
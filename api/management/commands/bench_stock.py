@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from api import cart as cart_service
+from api.benchmarks import run_concurrently, temporary_database
+from api.checkout import place_order
+from api.inventory import OutOfStock
+from api.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк оформления заказов: покупатели одновременно берут один товар'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50, help='число параллельных покупателей')
+        parser.add_argument('--stock', type=int, default=20, help='начальный остаток товара')
+        parser.add_argument('--quantity', type=int, default=1, help='штук в одном заказе')
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            self.run(options['buyers'], options['stock'], options['quantity'])
+
+    def run(self, buyers, stock, quantity):
+        product = Product.objects.create(
+            name='Лимитированный товар', description='', price=Decimal('1000'), stock=stock
+        )
+        users = []
+        for i in range(buyers):
+            user = User.objects.create_user(f'bench{i}')
+            cart_service.add_item(cart_service.get_cart(user), product.id, quantity)
+            users.append(user)
+
+        def buy(user):
+            try:
+                place_order(user, 'Москва')
+                return True
+            except OutOfStock:
+                return False
+
+        results, elapsed = run_concurrently(buy, [(user,) for user in users])
+        placed = results.count(True)
+        rejected = results.count(False)
+        errors = [r for r in results if isinstance(r, Exception)]
+
+        product.refresh_from_db()
+        sold = stock - product.stock
+        self.stdout.write(f'Покупателей: {buyers}, остаток: {stock}, штук в заказе: {quantity}')
+        self.stdout.write(f'Заказов: {placed}, отказов (нет на складе): {rejected}, ошибок: {len(errors)}')
+        self.stdout.write(f'Время: {elapsed:.3f} с, {placed / elapsed:.1f} заказов/с, '
+                          f'{buyers / elapsed:.1f} попыток/с')
+        for error in errors[:5]:
+            self.stderr.write(f'  {type(error).__name__}: {error}')
+
+        oversold = sold != placed * quantity or product.stock < 0 or Order.objects.count() != placed
+        if oversold:
+            self.stderr.write(self.style.ERROR(
+                f'Расхождение: продано {sold}, заказов {placed}, остаток {product.stock}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Перепродаж нет: продано {sold}, остаток {product.stock}, in_stock={product.in_stock}'
+            ))
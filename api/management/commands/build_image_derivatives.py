@@ -0,0 +1,61 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import images
+from api.storage import product_image_storage
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные WebP/JPEG копии для уже загруженных изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='пересобрать и актуальные копии')
+        parser.add_argument('--workers', type=int, default=None, help='число процессов')
+
+    def handle(self, *args, **options):
+        products = [
+            product for product in Product.objects.exclude(image='').exclude(image__isnull=True)
+            .only('id', 'image', 'image_derivatives')
+            if options['force'] or not images.is_current(product)
+        ]
+        if not products:
+            self.stdout.write('Все копии актуальны')
+            return
+
+        widths, formats = images.get_widths(), images.get_formats()
+        self.done = self.failed = 0
+        workers = options['workers'] or getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2)
+        # Исходники читаются в память по мере освобождения процессов: в работе
+        # не больше workers * 2 файлов, а не весь каталог сразу
+        window = workers * 2
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for product in products:
+                name = product.image.name
+                if not product_image_storage.exists(name):
+                    self.stderr.write(f'Нет файла {name} (товар {product.pk})')
+                    self.failed += 1
+                    continue
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self.collect(pending, done)
+                with product_image_storage.open(name, 'rb') as source:
+                    pending[executor.submit(images.render_derivatives, source.read(), widths, formats)] = (product.pk, name)
+            self.collect(pending, list(pending))
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {self.done}, ошибок: {self.failed}'))
+
+    def collect(self, pending, futures):
+        """Сохраняет результаты завершенных (или ждет оставшиеся) futures"""
+        for future in as_completed(futures):
+            product_id, name = pending.pop(future)
+            try:
+                derivatives = images.store_derivatives(name, future.result())
+                images.save_to_product(product_id, name, derivatives)
+            except Exception as exc:
+                self.stderr.write(f'{name}: {exc}')
+                self.failed += 1
+            else:
+                self.done += 1
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.changes import compact
+from api.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = (
+        'Сжимает журнал изменений каталога: по каждому объекту остается '
+        'только последняя запись (запускать периодически, например из cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed = compact(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей: {removed}, осталось: {CatalogChange.objects.count()}'
+        ))
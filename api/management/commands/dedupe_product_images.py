@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api import cache as catalog_cache
+from api import changes
+from api.models import Product
+from api.storage import product_image_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит изображения товаров на имена по содержимому (sha256): '
+        'одинаковые файлы объединяются, пути в Product.image переписываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default='products', help='каталог внутри MEDIA_ROOT')
+        parser.add_argument('--dry-run', action='store_true', help='только показать, что изменится')
+
+    def handle(self, *args, **options):
+        storage = product_image_storage
+        directory = options['directory'].strip('/')
+        _, files = storage.listdir(directory)
+
+        groups = defaultdict(list)
+        for filename in sorted(files):
+            name = f'{directory}/{filename}'
+            with storage.open(name, 'rb') as content:
+                groups[storage.hashed_name(name, content)].append(name)
+
+        renamed = removed = freed = products = 0
+        for canonical, names in groups.items():
+            stale = [name for name in names if name != canonical]
+            if not stale:
+                continue
+            size = storage.size(stale[0])
+            duplicates = len(names) - 1
+            self.stdout.write(f'{canonical} <- {", ".join(stale)}')
+            removed += duplicates
+            freed += size * duplicates
+            if not storage.exists(canonical):
+                renamed += 1
+                if not options['dry_run']:
+                    with storage.open(stale[0], 'rb') as content:
+                        storage.save(canonical, content)
+            if options['dry_run']:
+                products += Product.objects.filter(image__in=stale).count()
+                continue
+
+            with transaction.atomic():
+                affected = list(Product.objects.filter(image__in=stale).only('id', 'category_id'))
+                # Копии строятся от имени оригинала - после переименования их нужно пересобрать
+                Product.objects.filter(image__in=stale).update(
+                    image=canonical, image_derivatives={}, updated_at=timezone.now()
+                )
+            for product in affected:
+                catalog_cache.invalidate_product(product)
+            changes.record(changes.PRODUCT, [product.pk for product in affected])
+            for name in stale:
+                storage.delete(name)
+            products += len(affected)
+
+        prefix = 'План (--dry-run)' if options['dry_run'] else 'Готово'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}: переименовано файлов: {renamed}, удалено дублей: {removed} '
+            f'({freed / 1024 / 1024:.1f} МБ), обновлено товаров: {products}'
+        ))
+        if products and not options['dry_run']:
+            self.stdout.write('Запустите build_image_derivatives, чтобы пересобрать уменьшенные копии')
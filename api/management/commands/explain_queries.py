@@ -0,0 +1,115 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from api import cart as cart_service
+from api.benchmarks import temporary_database
+from api.checkout import place_order
+from api.models import Category, Favorite, Product
+from api.queryplan import audit, build_path, collect_urls
+
+DUMMY_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in ('default', 'catalog')
+}
+SORTS = (None, 'price_asc', 'price_desc', 'new')
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет GET на все адреса проекта на временной БД и проверяет SELECT-запросы '
+        'через EXPLAIN QUERY PLAN: полные просмотры таблиц с фильтром и сортировки во '
+        'временном B-дереве'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='печатать SQL замечаний')
+        parser.add_argument('--fail-on-issues', action='store_true',
+                            help='завершиться с ошибкой, если есть замечания (для CI)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN поддерживается только для SQLite')
+        # Кэши выключены: иначе повторные запросы не доходят до БД
+        with temporary_database(), override_settings(
+            CACHES=DUMMY_CACHES, ANONYMOUS_PAGE_CACHE=False, PRODUCT_CARD_CACHE=False,
+            SESSION_ENGINE='django.contrib.sessions.backends.db',
+        ):
+            issues = self.run(options['verbose_plans'])
+        if issues and options['fail_on_issues']:
+            raise CommandError(f'Замечаний к планам запросов: {issues}')
+
+    def seed(self):
+        categories = [
+            Category.objects.create(name=f'Категория {i}', slug=f'category-{i}') for i in range(3)
+        ]
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Товар {i}', description='Официальный мерч', price=Decimal(100 + i * 7 % 50),
+                category=categories[i % 3], stock=10,
+            )
+            for i in range(30)
+        ])
+        user = User.objects.create_user('query-plan-advisor', password='advisor')
+        cart = cart_service.get_cart(user)
+        cart_service.add_item(cart, products[0].id)
+        order = place_order(user, 'Москва')
+        cart_service.add_item(cart, products[1].id)
+        favorite = Favorite.objects.create(user=user, product=products[2])
+        samples = {
+            'product_id': products[0].id,
+            'order_id': order.id,
+            'item_id': cart.items.first().id,
+            'pk': {
+                'product': products[0].id, 'category': categories[0].id,
+                'order': order.id, 'favorite': favorite.id,
+            },
+        }
+        catalog_variants = [
+            {name: value for name, value in (('category', category), ('sort', sort)) if value}
+            for category in (None, categories[0].id) for sort in SORTS
+        ]
+        variants = {
+            '/products/': catalog_variants,
+            '/api/products/': catalog_variants,
+            '/api/products/search/': [{'q': 'Товар'}],
+        }
+        return user, samples, variants
+
+    def run(self, verbose_plans):
+        user, samples, variants = self.seed()
+        paths, skipped = [], []
+        for route, name, _ in collect_urls():
+            path = build_path(route, name, samples)
+            if path is None:
+                # Суффиксы формата DRF (.json) - те же view, что и без суффикса
+                if 'format>' not in route:
+                    skipped.append(route)
+            elif path not in paths:
+                paths.append(path)
+
+        client = Client(SERVER_NAME='localhost')
+        client.force_login(user)
+        reports = audit(client, paths, variants)
+
+        total = 0
+        for report in reports:
+            line = f'GET {report.url}  [{report.status}] запросов: {report.queries}'
+            if not report.issues:
+                self.stdout.write(line)
+                continue
+            self.stdout.write(self.style.WARNING(line))
+            for issue in report.issues:
+                total += 1
+                self.stdout.write(f'    ! {issue.kind}: {issue.detail}')
+                if verbose_plans:
+                    self.stdout.write(f'      {issue.sql}')
+        for route in skipped:
+            self.stdout.write(f'пропущен {route}: нет значения параметра')
+
+        summary = f'Адресов: {len(reports)}, замечаний: {total}'
+        self.stdout.write(self.style.WARNING(summary) if total else self.style.SUCCESS(summary))
+        return total
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_io import DEFAULT_BATCH_SIZE, FORMATS, detect_format, export_rows, write_rows
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Потоковый экспорт товаров в CSV/JSONL (формат import_products)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='файл или - для stdout')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--category', help='slug категории')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = detect_format(path, options['format'] or ('csv' if path == '-' else None))
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        queryset = Product.objects.order_by('id')
+        if options['category']:
+            queryset = queryset.filter(category__slug=options['category'])
+        rows = export_rows(queryset, chunk_size=options['batch_size'])
+
+        started = time.perf_counter()
+        if path == '-':
+            # Строки уже содержат переводы строк
+            self.stdout.ending = ''
+            count = write_rows(self.stdout, rows, fmt)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as stream:
+                count = write_rows(stream, rows, fmt)
+        elapsed = time.perf_counter() - started
+        # При выгрузке в stdout итог идет в stderr, чтобы не смешиваться с данными
+        report = self.stderr if path == '-' else self.stdout
+        report.write(self.style.SUCCESS(
+            f'Выгружено товаров: {count} за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.0f} строк/с)'
+        ))
@@ -0,0 +1,66 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_io import DEFAULT_BATCH_SIZE, FORMATS, ProductImporter, detect_format, read_rows
+
+# Сколько ошибок строк показывать подробно
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт товаров из CSV/JSONL с сопоставлением по артикулу (sku): '
+        'пачки через bulk_create/bulk_update, изображения в пуле потоков'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл CSV/JSONL или - для stdin')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--images-dir', help='каталог для относительных путей image (по умолчанию MEDIA_ROOT)')
+        parser.add_argument('--image-workers', type=int, default=4, help='0 - в основном потоке')
+        parser.add_argument('--skip-images', action='store_true', help='не загружать изображения')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = detect_format(path, options['format'] or ('csv' if path == '-' else None))
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        last_report = [time.perf_counter()]
+
+        def progress(stats):
+            now = time.perf_counter()
+            if now - last_report[0] >= 1:
+                last_report[0] = now
+                self.stderr.write(
+                    f'строк: {stats.rows}, создано: {stats.created}, обновлено: {stats.updated}, '
+                    f'ошибок: {len(stats.errors)}, {stats.rate:.0f} строк/с'
+                )
+
+        importer = ProductImporter(
+            batch_size=options['batch_size'],
+            images_dir=options['images_dir'],
+            image_workers=options['image_workers'],
+            fetch_images=not options['skip_images'],
+            progress=progress,
+        )
+        if path == '-':
+            stats = importer.run(read_rows(sys.stdin, fmt))
+        else:
+            # newline='' - переводы строк внутри полей CSV сохраняются как есть
+            with open(path, newline='', encoding='utf-8-sig') as stream:
+                stats = importer.run(read_rows(stream, fmt))
+
+        for number, message in stats.errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(f'строка {number}: {message}')
+        for reference, message in stats.image_errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(f'изображение {reference}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк: {stats.rows} за {stats.elapsed:.1f} с ({stats.rate:.0f} строк/с): '
+            f'создано {stats.created}, обновлено {stats.updated}, без изменений {stats.unchanged}, '
+            f'ошибок {len(stats.errors)}; изображений {stats.images}, ошибок изображений {len(stats.image_errors)}'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.cart import prune_carts
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет брошенные товары из корзин (CART_ITEM_TTL) и пустые корзины '
+        '(CART_EMPTY_TTL) пачками в коротких транзакциях; можно запускать по cron под нагрузкой'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0, help='пауза между пачками, секунд')
+
+    def handle(self, *args, **options):
+        stats = prune_carts(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено товаров из корзин: {stats.items}, пустых корзин: {stats.carts}'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.checkout import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные ключи идемпотентности заказов (IDEMPOTENCY_KEY_TTL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed = purge_expired_keys(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей: {removed}'))
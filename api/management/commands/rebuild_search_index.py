@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api import search
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров (FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError(f'FTS5-индекс поддерживается только для SQLite, а не {connection.vendor}')
+        with connection.cursor() as cursor:
+            cursor.execute(search.CREATE_TABLE_SQL)
+        rows = Product.objects.values_list('id', 'name', 'description').iterator(chunk_size=2000)
+        with transaction.atomic():
+            total = search.rebuild_index(rows, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {total}'))
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# SQL зафиксирован здесь, а не импортируется из api.search: миграция не должна
+# меняться вместе с кодом приложения. Текст в индексе стеммится в Python
+# (api.search.document_text), поэтому товары, созданные до этой миграции,
+# индексируются командой manage.py rebuild_search_index (пока индекс пуст,
+# manage.py check --database default выдает предупреждение api.W001).
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, description, tokenize='porter unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = 'DROP TABLE IF EXISTS products_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(DROP_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_orderitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
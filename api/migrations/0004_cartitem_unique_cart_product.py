@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Сливает повторяющиеся строки (cart, product), суммируя количество"""
+    CartItem = apps.get_model('api', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(rows=Count('id'), keep_id=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        items = CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id'])
+        items.filter(id=row['keep_id']).update(quantity=row['total'])
+        items.exclude(id=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_products_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17 20:13
+
+import os
+
+from django.db import migrations, models
+
+# Остаток товаров, отмеченных "в наличии". По умолчанию 0: выдуманные
+# единицы можно было бы продать. Оператор задает значение при миграции
+# (INITIAL_PRODUCT_STOCK=10 manage.py migrate) или потом в админке.
+INITIAL_STOCK_ENV = 'INITIAL_PRODUCT_STOCK'
+
+
+def set_initial_stock(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    initial = max(int(os.environ.get(INITIAL_STOCK_ENV) or 0), 0)
+    Product.objects.filter(in_stock=True).update(stock=initial, in_stock=initial > 0)
+
+
+def restore_in_stock(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    Product.objects.filter(stock__gt=0).update(in_stock=True)
+    Product.objects.filter(stock=0).update(in_stock=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock',
+            field=models.PositiveIntegerField(default=0, verbose_name='Остаток на складе'),
+        ),
+        migrations.RunPython(set_initial_stock, restore_in_stock),
+        migrations.AlterField(
+            model_name='product',
+            name='in_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
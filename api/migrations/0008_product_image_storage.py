@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 20:20
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.ContentAddressedStorage(), upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 20:31
+
+from django.db import migrations, models
+
+
+def seed_change_log(apps, schema_editor):
+    """Существующий каталог попадает в журнал, чтобы ?since=0 отдавал его целиком"""
+    CatalogChange = apps.get_model('api', 'CatalogChange')
+    for model_name, kind in (('Category', 'category'), ('Product', 'product')):
+        Model = apps.get_model('api', model_name)
+        CatalogChange.objects.bulk_create(
+            [CatalogChange(model=kind, object_id=pk) for pk in Model.objects.values_list('pk', flat=True)],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_product_image_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Изменен'), ('delete', 'Удален')], default='upsert', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'id'], name='catalog_change_feed'), models.Index(fields=['model', 'object_id'], name='catalog_change_object')],
+            },
+        ),
+        migrations.RunPython(seed_change_log, migrations.RunPython.noop),
+    ]
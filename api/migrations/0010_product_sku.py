@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_catalogchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Артикул'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['updated_at'], name='cart_item_updated'),
+        ),
+    ]
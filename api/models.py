@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 
+from .storage import product_image_storage
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True)
@@ -10,14 +12,45 @@ class Category(models.Model):
         return self.name
 
 class Product(models.Model):
+    # Артикул - естественный ключ для импорта (import_products)
+    sku = models.CharField('Артикул', max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
-    image = models.ImageField(upload_to='products/', null=True, blank=True)
+    image = models.ImageField(upload_to='products/', storage=product_image_storage, null=True, blank=True)
+    # Уменьшенные копии изображения (api/images.py)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # Индекс FK (category_id) = (category_id, id): фильтр по категории с сортировкой по id
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    in_stock = models.BooleanField(default=True)
+    stock = models.PositiveIntegerField('Остаток на складе', default=0)
+    # Производное от stock; хранится в таблице для фильтров и индексов
+    in_stock = models.BooleanField(default=False, editable=False)
+    
+    class Meta:
+        # Под сортировки каталога (api/pagination.py): ключ + id как в ORDER BY,
+        # с категорией и без; (created_at, id) нужен и главной странице
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price'),
+            models.Index(fields=['created_at', 'id'], name='product_created'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_created'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Категория на момент загрузки - чтобы сбросить кэш старой категории при переносе
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        self.in_stock = self.stock > 0
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'stock' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'in_stock'}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.name
@@ -34,6 +67,17 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Последнее изменение строки: по нему prune_carts находит брошенные товары.
+    # UPDATE через QuerySet.update() выставляет его явно (api/cart.py)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at'], name='cart_item_updated'),
+        ]
     
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
@@ -58,12 +102,19 @@ class Order(models.Model):
         ('cancelled', 'Отменен'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    # Отдельный индекс FK не нужен: user - первая колонка order_user_created
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_index=False)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     shipping_address = models.TextField()
     
+    class Meta:
+        indexes = [
+            # Заказы пользователя от новых к старым (личный кабинет)
+            models.Index(fields=['user', 'created_at'], name='order_user_created'),
+        ]
+    
     def __str__(self):
         return f"Заказ #{self.id} - {self.user.username}"
 
@@ -79,4 +130,41 @@ class OrderItem(models.Model):
     
     @property
     def total(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class IdempotencyKey(models.Model):
+    """Ключ идемпотентности оформления заказа (заголовок Idempotency-Key или скрытое поле формы)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} -> {self.order_id}"
+
+class CatalogChange(models.Model):
+    """Запись журнала изменений каталога (api/changes.py); id - курсор ленты"""
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = [(UPSERT, 'Изменен'), (DELETE, 'Удален')]
+    
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=UPSERT)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Лента: WHERE model = ? AND id > ? ORDER BY id
+            models.Index(fields=['model', 'id'], name='catalog_change_feed'),
+            # Сжатие: последняя запись по каждому объекту
+            models.Index(fields=['model', 'object_id'], name='catalog_change_object'),
+        ]
+    
+    def __str__(self):
+        return f"{self.id}: {self.action} {self.model} #{self.object_id}"
@@ -0,0 +1,78 @@
+# api/pagecache.py
+"""Кэш целых страниц каталога для анонимных посетителей.
+
+Страница кэшируется, если у запроса нет cookie сессии и cookie сообщений:
+такой посетитель гарантированно анонимен, и проверка не обращается к БД.
+Ключ - нормализованный набор значимых GET-параметров (остальные, например
+utm-метки, отбрасываются) и версии областей кэша каталога (api/cache.py),
+поэтому сохранение товара или категории сбрасывает только затронутые
+страницы. Попадание в кэш не обращается к ORM.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse
+
+from . import cache as catalog_cache
+
+# Cookie хранилища сообщений (CookieStorage)
+MESSAGES_COOKIE = 'messages'
+CACHE_HEADER = 'X-Page-Cache'
+
+
+def is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    cookies = request.COOKIES
+    return settings.SESSION_COOKIE_NAME not in cookies and MESSAGES_COOKIE not in cookies
+
+
+def normalized_query(request, params):
+    """((имя, значение), ...) значимых параметров в постоянном порядке"""
+    return tuple(
+        (name, request.GET[name]) for name in sorted(params) if request.GET.get(name)
+    )
+
+
+def is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # Страница с CSRF-токеном или сообщениями персональна
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and not len(messages.get_messages(request))
+    )
+
+
+def anonymous_page_cache(name, params=(), scopes=None):
+    """Кэширует ответ view для анонимных запросов.
+
+    params - GET-параметры, от которых зависит страница; scopes(query) -
+    области кэша каталога для нормализованных параметров (dict).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'ANONYMOUS_PAGE_CACHE', True) or not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            query = normalized_query(request, params)
+            cache = catalog_cache.get_cache()
+            key = catalog_cache.make_key(f'page:{name}', scopes(dict(query)), query)
+            cached = cache.get(key)
+            catalog_cache.stats.record(hit=cached is not None)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response[CACHE_HEADER] = 'hit'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if is_cacheable_response(request, response):
+                cache.set(key, (response.content, response['Content-Type']), catalog_cache.get_timeout())
+                response[CACHE_HEADER] = 'miss'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,270 @@
+# api/pagination.py
+"""Keyset (курсорная) пагинация каталога.
+
+Страница выбирается условием WHERE по паре (ключ сортировки, id), а не через
+OFFSET, поэтому N-я страница стоит столько же, сколько первая.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Порядок сортировки каталога: значение ?sort= -> (ключ, направление)
+PRODUCT_SORTS = {
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    'new': ('created_at', True),
+}
+DEFAULT_SORT = ('id', False)
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidCategory(ValueError):
+    pass
+
+
+def parse_category(value):
+    """id категории из ?category=; пустое значение - без фильтра"""
+    if not value:
+        return None
+    try:
+        category_id = int(value)
+    except (TypeError, ValueError) as exc:
+        raise InvalidCategory(value) from exc
+    if category_id < 1:
+        raise InvalidCategory(value)
+    return category_id
+
+
+def get_sort(sort):
+    """Ключ и направление сортировки для значения ?sort="""
+    return PRODUCT_SORTS.get(sort, DEFAULT_SORT)
+
+
+def filter_products(queryset, category_id=None, sort=None):
+    """Общие фильтры каталога для API и HTML-страницы.
+
+    Поднимает InvalidCategory, если category_id - не id.
+    """
+    category_id = parse_category(category_id)
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+    key, descending = get_sort(sort)
+    return queryset.order_by(*_ordering(key, descending))
+
+
+def _ordering(key, descending):
+    prefix = '-' if descending else ''
+    if key == 'id':
+        return (prefix + 'id',)
+    return (prefix + key, prefix + 'id')
+
+
+def encode_cursor(position, reverse=False):
+    payload = {'p': position}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        position = payload['p']
+        if not isinstance(position, list) or len(position) not in (1, 2):
+            raise ValueError(cursor)
+        return position, bool(payload.get('r'))
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def _value(item, name):
+    if isinstance(item, dict):
+        return item[name]
+    return getattr(item, name)
+
+
+def _serialize_value(value):
+    if value is None or isinstance(value, (int, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    count: Optional[int] = None
+    page_size: int = DEFAULT_PAGE_SIZE
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class KeysetPaginator:
+    """Пагинатор по паре (ключ сортировки, id).
+
+    Курсор хранит позицию последнего (или первого, для "назад") элемента
+    страницы. Для ключа 'id' позиция состоит из одного значения.
+    """
+
+    def __init__(self, key='id', descending=False, page_size=DEFAULT_PAGE_SIZE):
+        self.key = key
+        self.descending = descending
+        self.page_size = page_size
+
+    @classmethod
+    def for_sort(cls, sort, page_size=DEFAULT_PAGE_SIZE):
+        key, descending = get_sort(sort)
+        return cls(key, descending, page_size)
+
+    def _position(self, item):
+        if self.key == 'id':
+            return [_value(item, 'id')]
+        return [_serialize_value(_value(item, self.key)), _value(item, 'id')]
+
+    def _after(self, position, descending):
+        op = 'lt' if descending else 'gt'
+        if self.key == 'id':
+            return Q(**{f'id__{op}': position[0]})
+        value, pk = position
+        if value is None:
+            raise InvalidCursor(position)
+        return Q(**{f'{self.key}__{op}': value}) | Q(**{self.key: value, f'id__{op}': pk})
+
+    def paginate(self, queryset, cursor=None, with_count=False):
+        """Возвращает KeysetPage. Запрос к БД - один (плюс COUNT по желанию)."""
+        reverse = False
+        position = None
+        if cursor:
+            position, reverse = decode_cursor(cursor)
+            if len(position) != (1 if self.key == 'id' else 2):
+                raise InvalidCursor(cursor)
+
+        # "Назад" - идем в обратном порядке от первого элемента страницы
+        descending = self.descending != reverse
+        qs = queryset.order_by(*_ordering(self.key, descending))
+        if position is not None:
+            qs = qs.filter(self._after(position, descending))
+
+        rows = list(qs[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = encode_cursor(self._position(rows[-1]))
+            if position is not None and (has_more or not reverse):
+                prev_cursor = encode_cursor(self._position(rows[0]), reverse=True)
+
+        count = queryset.order_by().count() if with_count else None
+        return KeysetPage(rows, next_cursor, prev_cursor, count, self.page_size)
+
+
+class ProductCursorPagination(BasePagination):
+    """DRF-пагинация каталога поверх KeysetPaginator.
+
+    Параметры: ?cursor=, ?page_size=, ?count=1 (добавить общее число строк).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    page_size = DEFAULT_PAGE_SIZE
+    max_page_size = MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_page(self, queryset, request):
+        paginator = KeysetPaginator.for_sort(
+            request.query_params.get('sort'), self.get_page_size(request)
+        )
+        with_count = request.query_params.get(self.count_query_param) in ('1', 'true')
+        try:
+            return paginator.paginate(
+                queryset,
+                cursor=request.query_params.get(self.cursor_query_param),
+                with_count=with_count,
+            )
+        except InvalidCursor:
+            raise NotFound('Неверный курсор')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = self.get_page(queryset, request)
+        return self.page.items
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data, page=None):
+        if page is None:
+            page = self.page
+        payload = {
+            'next': self.get_cursor_link(page.next_cursor),
+            'previous': self.get_cursor_link(page.prev_cursor),
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+        }
+        if page.count is not None:
+            payload['count'] = page.count
+        payload['results'] = data
+        return payload
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'prev_cursor': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+
+def page_querystring(request, cursor):
+    """Строка запроса для ссылок на соседние страницы в HTML-шаблоне"""
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return params.urlencode()
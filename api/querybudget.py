@@ -0,0 +1,100 @@
+# api/querybudget.py
+"""Бюджеты на число SQL-запросов.
+
+- @query_budget(n) объявляет бюджет для view-функции; для ViewSet задается
+  атрибут класса query_budget = n или {'list': n, 'create': m, ...};
+- QueryBudgetMiddleware (для разработки) считает запросы и при превышении
+  пишет предупреждение в лог или падает (QUERY_BUDGET_MODE = 'raise');
+- QueryBudgetTestMixin.assertMaxQueries() - для тестов.
+"""
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """execute_wrapper, запоминающий выполненные запросы"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+
+@contextmanager
+def count_queries(using=connection):
+    counter = QueryCounter()
+    with using.execute_wrapper(counter):
+        yield counter
+
+
+def query_budget(limit):
+    """Объявляет максимальное число запросов для view"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def get_view_budget(view_func, request):
+    budget = getattr(view_func, 'query_budget', None)
+    view_class = getattr(view_func, 'cls', None)
+    if budget is None and view_class is not None:
+        budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        actions = getattr(view_func, 'actions', None) or {}
+        budget = budget.get(actions.get(request.method.lower()))
+    if budget is None:
+        budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+    return budget
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with count_queries() as counter:
+            response = self.get_response(request)
+        response['X-Query-Count'] = str(len(counter))
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and len(counter) > budget:
+            message = (
+                f'{request.method} {request.path}: {len(counter)} запросов '
+                f'при бюджете {budget}'
+            )
+            if getattr(settings, 'QUERY_BUDGET_MODE', 'log') == 'raise':
+                raise QueryBudgetExceeded(message + '\n' + '\n'.join(counter.queries))
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_view_budget(view_func, request)
+
+
+class QueryBudgetTestMixin:
+    """Примесь для TestCase: проверка верхней границы числа запросов"""
+
+    @contextmanager
+    def assertMaxQueries(self, limit, using=connection):
+        with count_queries(using) as counter:
+            yield counter
+        if len(counter) > limit:
+            self.fail(
+                f'{len(counter)} запросов при бюджете {limit}:\n'
+                + '\n'.join(counter.queries)
+            )
@@ -0,0 +1,138 @@
+# api/queryplan.py
+"""Проверка планов SQL-запросов view через EXPLAIN QUERY PLAN (SQLite).
+
+collect_urls() обходит URLconf проекта, audit() выполняет GET на каждый
+адрес тестовым клиентом в транзакции с откатом, собирает SELECT-запросы и
+разбирает их план. Так проверяются запросы всех view и ViewSet, в том
+числе добавленных позже, без списка querysets вручную.
+
+Замечания:
+- temp-b-tree - USE TEMP B-TREE FOR ORDER BY/GROUP BY/DISTINCT: сортировка
+  всей выборки, индекса под ORDER BY нет (кроме ранжирования FTS5);
+- scan - SCAN таблицы без индекса в запросе с WHERE: фильтр проверяется
+  по каждой строке. SCAN без WHERE (весь справочник, первая страница по
+  id) замечанием не считается.
+"""
+import copy
+import re
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+
+SKIP_PREFIXES = ('admin/', 'media/', 'static/')
+
+_REGEX_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+_PATH_CONVERTER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+@dataclass
+class Issue:
+    kind: str
+    detail: str
+    sql: str
+
+
+@dataclass
+class Report:
+    url: str
+    status: int
+    queries: int = 0
+    issues: list = field(default_factory=list)
+
+
+def collect_urls(resolver=None, prefix=''):
+    """(маршрут, имя, view) всех URLPattern, кроме админки и статики"""
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        route = prefix + str(pattern.pattern)
+        if route.lstrip('^').startswith(SKIP_PREFIXES):
+            continue
+        if isinstance(pattern, URLResolver):
+            yield from collect_urls(pattern, route)
+        elif isinstance(pattern, URLPattern):
+            yield route, pattern.name, pattern.callback
+
+
+def build_path(route, name, samples):
+    """Конкретный путь для маршрута; None, если параметр нечем заполнить.
+
+    samples - {имя параметра: значение}; для pk ViewSet значение берется
+    по префиксу имени маршрута (product-detail -> samples['pk']['product']).
+    """
+    missing = []
+
+    def value(match):
+        param = match.group(1)
+        sample = samples.get(param)
+        if isinstance(sample, dict):
+            sample = sample.get((name or '').split('-')[0])
+        if sample is None:
+            missing.append(param)
+            return ''
+        return str(sample)
+
+    path = _PATH_CONVERTER.sub(value, _REGEX_GROUP.sub(value, route))
+    path = path.replace('^', '').replace('$', '').replace('\\', '')
+    if missing or re.search(r'[()?*+\[\]]', path):
+        # Суффиксы формата (.json) и прочие регулярные выражения не проверяются
+        return None
+    return '/' + path
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_issues(sql):
+    issues = []
+    has_where = ' WHERE ' in sql
+    plan = explain(sql)
+    # Ранжирование полнотекстового поиска (bm25) индексом не покрыть:
+    # сортируются только найденные строки
+    full_text = any('VIRTUAL TABLE' in detail for detail in plan)
+    for detail in plan:
+        if detail.startswith('USE TEMP B-TREE') and not full_text:
+            issues.append(Issue('temp-b-tree', detail, sql))
+        elif (
+            has_where and detail.startswith('SCAN ') and 'USING' not in detail
+            and 'VIRTUAL TABLE' not in detail and 'CONSTANT ROW' not in detail
+            and not detail.startswith('SCAN (')
+        ):
+            issues.append(Issue('scan', detail, sql))
+    return issues
+
+
+def audit(client, urls, variants=None):
+    """Report на каждый (путь, параметры): GET в транзакции с откатом и разбор SELECT.
+
+    urls - пути; variants - {путь: [dict GET-параметров, ...]}, по умолчанию
+    один запрос без параметров. Только для SQLite.
+    """
+    variants = variants or {}
+    reports = []
+    for path in urls:
+        for params in variants.get(path, [{}]):
+            # Ответ может сменить cookie (выход, сообщения) - следующий запрос идет с прежними
+            cookies = copy.deepcopy(client.cookies)
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(path, params)
+                transaction.set_rollback(True)
+            client.cookies = cookies
+            url = f'{path}?{urlencode(params)}' if params else path
+            report = Report(url, response.status_code)
+            seen = set()
+            for query in queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT') or sql in seen:
+                    continue
+                seen.add(sql)
+                report.queries += 1
+                report.issues.extend(plan_issues(sql))
+            reports.append(report)
+    return reports
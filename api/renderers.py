@@ -0,0 +1,91 @@
+# api/renderers.py
+"""Быстрый JSON для API и потоковая выдача больших списков.
+
+ORJSONRenderer кодирует ответ через orjson (в несколько раз быстрее json из
+стандартной библиотеки и без промежуточной str). Типы, которых orjson не
+знает, и datetime проходят через JSONEncoder из DRF, поэтому вывод
+совпадает с JSONRenderer. Отступы (Browsable API, ?indent=), ensure_ascii и
+любые ошибки orjson обрабатываются обычным JSONRenderer. orjson -
+необязательная зависимость: без него рендерер работает как JSONRenderer.
+
+stream_json_array() отдает JSON-массив по частям: элементы кодируются по
+одному по мере чтения queryset.iterator(), память не растет с размером
+выборки.
+"""
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Строк queryset.iterator() за один запрос к БД и элементов в одной части ответа
+STREAM_CHUNK_SIZE = 500
+
+_encoder = JSONEncoder()
+# Как JSONRenderer: строго подмножество JavaScript
+_LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+def _escape_separators(data):
+    for raw, escaped in _LINE_SEPARATORS:
+        if raw in data:
+            data = data.replace(raw, escaped)
+    return data
+
+
+def dumps(data):
+    """Компактный UTF-8 JSON в байтах, как у JSONRenderer по умолчанию"""
+    if orjson is not None:
+        try:
+            return _escape_separators(orjson.dumps(
+                data, default=_encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            ))
+        except orjson.JSONEncodeError:
+            # Например, int больше 64 бит - пусть решает стандартный json
+            pass
+    return _escape_separators(json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'),
+    ).encode())
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+def stream_json_array(items, to_representation, chunk_size=STREAM_CHUNK_SIZE):
+    """Байты JSON-массива [to_representation(item), ...] частями по chunk_size элементов"""
+    yield b'['
+    chunk, first = [], True
+    for item in items:
+        chunk.append(dumps(to_representation(item)))
+        if len(chunk) >= chunk_size:
+            yield (b'' if first else b',') + b','.join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield (b'' if first else b',') + b','.join(chunk)
+    yield b']'
+
+
+def streaming_json_response(queryset, to_representation, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+    """StreamingHttpResponse с JSON-массивом строк queryset.
+
+    Запрос выполняется при отдаче ответа, строки читаются через
+    .iterator(chunk_size), без кэша результатов QuerySet.
+    """
+    items = queryset.iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(
+        stream_json_array(items, to_representation, chunk_size),
+        content_type='application/json', **kwargs,
+    )
@@ -0,0 +1,162 @@
+# api/search.py
+"""Полнотекстовый поиск по товарам (SQLite FTS5).
+
+В виртуальную таблицу products_fts пишется уже застемленный текст: русские
+слова обрабатывает api.stemmer, английские - токенайзер porter. Запрос
+проходит ту же обработку, поэтому формы слова совпадают при поиске.
+На других СУБД поиск откатывается к icontains по name и description.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .stemmer import stem
+
+FTS_TABLE = 'products_fts'
+# Вес совпадения в названии выше, чем в описании
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, description, tokenize='porter unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = f'DROP TABLE IF EXISTS {FTS_TABLE}'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_QUERY_TERMS = 8
+
+
+def document_text(text):
+    """Текст для индекса: слова через пробел, русские - в виде основ"""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def build_match_query(query):
+    """Строка для MATCH: все слова обязательны, последнее - по префиксу"""
+    terms = [stem(word) for word in WORD_RE.findall(query or '')][:MAX_QUERY_TERMS]
+    if not terms:
+        return ''
+    quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def is_available(using=None):
+    conn = using or connection
+    return conn.vendor == 'sqlite'
+
+
+def index_product(product):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.pk, document_text(product.name), document_text(product.description)],
+        )
+
+
+def index_products(products, batch_size=500):
+    """Пакетное обновление индекса после bulk_create / bulk_update (сигналов нет)"""
+    if not is_available():
+        return
+    products = list(products)
+    with connection.cursor() as cursor:
+        for start in range(0, len(products), batch_size):
+            batch = products[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', [p.pk for p in batch]
+            )
+            _insert_batch(cursor, [
+                (p.pk, document_text(p.name), document_text(p.description)) for p in batch
+            ])
+
+
+def remove_product(product_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def is_index_empty(using=None):
+    """True, если таблица индекса есть, но в ней нет ни одной записи"""
+    conn = using or connection
+    if not is_available(conn) or FTS_TABLE not in conn.introspection.table_names():
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {FTS_TABLE})')
+        return not cursor.fetchone()[0]
+
+
+def rebuild_index(rows, using=None, batch_size=1000):
+    """Полная перестройка индекса.
+
+    rows - итерируемое из (id, name, description). Возвращает число записей.
+    """
+    conn = using or connection
+    if not is_available(conn):
+        return 0
+    total = 0
+    with conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        batch = []
+        for pk, name, description in rows:
+            batch.append((pk, document_text(name), document_text(description)))
+            if len(batch) >= batch_size:
+                _insert_batch(cursor, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            _insert_batch(cursor, batch)
+            total += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def _insert_batch(cursor, batch):
+    cursor.executemany(
+        f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+        batch,
+    )
+
+
+def search_ids(query, limit, offset=0):
+    """id товаров по убыванию релевантности (limit строк начиная с offset)"""
+    match = build_match_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s OFFSET %s',
+            [match, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(queryset, query, limit, offset=0):
+    """Товары из queryset, найденные по запросу, в порядке релевантности.
+
+    Пустой запрос (без слов) возвращает весь queryset по id, как до FTS.
+    """
+    words = WORD_RE.findall(query or '')
+    if not words:
+        return list(queryset.order_by('id')[offset:offset + limit])
+    if not is_available():
+        condition = Q()
+        for word in words[:MAX_QUERY_TERMS]:
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        return list(queryset.filter(condition).order_by('id')[offset:offset + limit])
+
+    ids = search_ids(query, limit, offset)
+    # queryset может быть и .values(): тогда строки - словари
+    products = {
+        item['id'] if isinstance(item, dict) else item.pk: item
+        for item in queryset.filter(pk__in=ids)
+    }
+    return [products[pk] for pk in ids if pk in products]
@@ -1,31 +1,199 @@
-from rest_framework import serializers
+from decimal import Decimal
+from operator import itemgetter
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import Category, Product, Cart, CartItem, Favorite, Order
+from .cart import cart_totals
+from . import images
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+
+def _names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def sparse_fieldset(request, path=()):
+    """Поля сериализатора на пути path по ?fields= и ?exclude=.
+
+    Имена вложенных полей пишутся через точку: ?fields=id,product.name,
+    ?exclude=product.description. Возвращает (оставить или None, исключить).
+    """
+    params = getattr(request, 'query_params', None)
+    if not params:
+        return None, set()
+    prefix = ''.join(f'{name}.' for name in path)
+    only = {
+        name[len(prefix):].split('.')[0] for name in _names(params.get(FIELDS_PARAM))
+        if name.startswith(prefix) and len(name) > len(prefix)
+    }
+    exclude = {
+        name[len(prefix):] for name in _names(params.get(EXCLUDE_PARAM))
+        if name.startswith(prefix) and '.' not in name[len(prefix):]
+    }
+    return only or None, exclude
+
+
+class SparseFieldsMixin:
+    """Оставляет только поля, запрошенные через ?fields= / ?exclude="""
+    
+    def _field_path(self):
+        path, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return path[::-1]
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        only, exclude = sparse_fieldset(self.context.get('request'), self._field_path())
+        for name in list(fields):
+            if (only is not None and name not in only) or name in exclude:
+                del fields[name]
+        return fields
+
+
+def derivatives_data(source, derivatives, build_url=None, formats=None):
+    """URL уменьшенных копий и готовый srcset по форматам; None, пока их нет"""
+    if not derivatives:
+        return None
+    result = {}
+    for fmt in formats or images.get_formats():
+        urls = images.record_urls(source, derivatives, fmt, build_url)
+        if urls:
+            result[fmt] = {
+                'urls': {str(width): url for width, url in urls},
+                'srcset': images.srcset(urls),
+            }
+    return result or None
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'is_staff']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
+    image_derivatives = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'image', 
+        fields = ['id', 'sku', 'name', 'description', 'price', 'image', 'image_derivatives',
                  'category', 'category_name', 'in_stock', 'created_at']
+    
+    def get_image_derivatives(self, obj):
+        request = self.context.get('request')
+        build_url = request.build_absolute_uri if request else None
+        return derivatives_data(obj.image.name if obj.image else None, obj.image_derivatives, build_url)
+
+class ProductRowSerializer:
+    """Быстрый путь списков товаров: строки .values() вместо экземпляров модели.
+
+    Вывод совпадает с ProductSerializer (включая ?fields= / ?exclude=), но
+    модель не создается, а значения форматируются напрямую, без полей DRF
+    на каждое значение.
+    """
+    # Поле ответа -> колонки .values(), из которых оно строится
+    COLUMNS = {
+        'id': ('id',),
+        'sku': ('sku',),
+        'name': ('name',),
+        'description': ('description',),
+        'price': ('price',),
+        'image': ('image',),
+        'image_derivatives': ('image', 'image_derivatives'),
+        'category': ('category_id',),
+        'category_name': ('category_id', 'category__name'),
+        'in_stock': ('in_stock',),
+        'created_at': ('created_at',),
+    }
+    
+    def __init__(self, request=None):
+        self.request = request
+        only, exclude = sparse_fieldset(request)
+        self.fields = [
+            name for name in ProductSerializer.Meta.fields
+            if (only is None or name in only) and name not in exclude
+        ]
+        self._created_at = serializers.DateTimeField()
+        # Часовой пояс вывода определяется один раз на список, а не на каждое значение
+        self._timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+        self._storage = Product._meta.get_field('image').storage
+        self._formatters = [(name, self._formatter(name)) for name in self.fields]
+    
+    def columns(self):
+        return list(dict.fromkeys(column for name in self.fields for column in self.COLUMNS[name]))
+    
+    def _image_url(self, name):
+        if not name:
+            return None
+        url = self._storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request else url
+    
+    def _datetime(self, value):
+        if api_settings.DATETIME_FORMAT != ISO_8601:
+            return self._created_at.to_representation(value)
+        if self._timezone is not None and timezone.is_aware(value):
+            value = value.astimezone(self._timezone)
+        value = value.isoformat()
+        # Как DateTimeField в DRF
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    
+    def _formatter(self, name):
+        build_url = self.request.build_absolute_uri if self.request else None
+        if name == 'price':
+            return lambda row: f'{row["price"]:.2f}'
+        if name == 'image':
+            return lambda row: self._image_url(row['image'])
+        if name == 'image_derivatives':
+            formats = images.get_formats()
+            return lambda row: derivatives_data(row['image'], row['image_derivatives'], build_url, formats)
+        if name == 'category':
+            return itemgetter('category_id')
+        if name == 'category_name':
+            return itemgetter('category__name')
+        if name == 'created_at':
+            return lambda row: self._datetime(row['created_at'])
+        return itemgetter(name)
+    
+    def to_representation(self, row):
+        data = {name: format_value(row) for name, format_value in self._formatters}
+        # Как у ProductSerializer: без категории поля category_name нет в ответе
+        if 'category_name' in data and row['category_id'] is None:
+            del data['category_name']
+        return data
+    
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
 
 class ProductCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['name', 'description', 'price', 'image', 'category', 'in_stock']
+        fields = ['sku', 'name', 'description', 'price', 'image', 'category', 'stock']
+    
+    def validate(self, attrs):
+        # in_stock вычисляется из stock; старые клиенты, присылающие in_stock,
+        # иначе молча создавали бы товар с нулевым остатком
+        if 'in_stock' in self.initial_data:
+            raise serializers.ValidationError({'in_stock': 'Поле только для чтения, передайте stock'})
+        return attrs
+    
+    def validate_sku(self, value):
+        # Пустой артикул хранится как NULL: уникальность проверяется только у заданных
+        return value or None
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
     
@@ -36,28 +204,71 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
     
     def get_total_price(self, obj):
-        return obj.product.price * obj.quantity
+        # line_total считается в запросе (api.cart.LINE_TOTAL)
+        line_total = getattr(obj, 'line_total', None)
+        if line_total is None:
+            line_total = obj.product.price * obj.quantity
+        return line_total
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
+    item_count = serializers.SerializerMethodField()
     total = serializers.SerializerMethodField()
     
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total', 'created_at']
+        fields = ['id', 'user', 'items', 'item_count', 'total', 'created_at']
+    
+    def _totals(self, obj):
+        # Один агрегирующий запрос на корзину для item_count и total
+        cached = self.__dict__.setdefault('_totals_by_cart', {})
+        if obj.pk not in cached:
+            cached[obj.pk] = cart_totals(obj)
+        return cached[obj.pk]
+    
+    def get_item_count(self, obj):
+        return self._totals(obj)[0]
     
     def get_total(self, obj):
-        return sum(item.product.price * item.quantity for item in obj.items.all())
+        return self._totals(obj)[1]
+    
+    def to_representation(self, instance):
+        if instance.pk is None:
+            # Корзины еще нет: она создается при первом добавлении товара
+            empty = {'id': None, 'user': instance.user_id, 'items': [], 'item_count': 0,
+                     'total': Decimal('0'), 'created_at': None}
+            return {name: empty[name] for name in self.fields}
+        return super().to_representation(instance)
+
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['add', 'set', 'remove']
+    
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(required=False, min_value=0, max_value=10000)
+    
+    def validate(self, attrs):
+        if attrs['op'] == 'set' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'Обязательно для операции set'})
+        if attrs['op'] == 'add' and attrs.get('quantity', 1) < 1:
+            raise serializers.ValidationError({'quantity': 'Должно быть положительным для операции add'})
+        return attrs
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     
     class Meta:
         model = Favorite
         fields = ['id', 'product', 'added_at']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'user', 'total_price', 'status', 
-                 'created_at', 'shipping_address']
\ No newline at end of file
+                 'created_at', 'shipping_address']
+        # Статус меняется только через cancel_order (возврат на склад),
+        # сумма и владелец задаются при оформлении
+        read_only_fields = ['user', 'total_price', 'status', 'created_at']
\ No newline at end of file
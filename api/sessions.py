@@ -0,0 +1,45 @@
+# api/sessions.py
+"""Движок сессий в БД без лишних записей.
+
+Django сохраняет сессию, если она помечена modified, даже когда значение
+записали то же самое (например, повторный session['x'] = session['x']).
+WriteOnChangeMixin запоминает содержимое сессии после чтения или записи и
+пропускает save(), если оно не изменилось: в БД попадают только настоящие
+изменения.
+
+cycle_key() (вызывается из login()) у сессии, которой еще нет в БД, не
+делает отдельный INSERT: ротировать нечего, и сессия сохраняется один раз
+при ответе - уже с данными пользователя.
+
+Подключается через SESSION_ENGINE = 'api.sessions'. Вариант с чтением из
+кэша - api/cached_sessions.py.
+"""
+import copy
+
+from django.contrib.sessions.backends import db
+
+
+class WriteOnChangeMixin:
+    def load(self):
+        data = super().load()
+        self._stored = copy.deepcopy(data)
+        return data
+
+    def cycle_key(self):
+        # Загрузка сбрасывает ключ, которого нет в хранилище (подставленная cookie)
+        self._get_session()
+        if self.session_key is None:
+            self.modified = True
+            return
+        super().cycle_key()
+
+    def save(self, must_create=False):
+        # Новая сессия, смена ключа (cycle_key) и create() пишутся всегда
+        if not must_create and self.session_key and self._session == getattr(self, '_stored', None):
+            return
+        super().save(must_create=must_create)
+        self._stored = copy.deepcopy(self._session)
+
+
+class SessionStore(WriteOnChangeMixin, db.SessionStore):
+    pass
@@ -1,9 +1,81 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Cart
+from rest_framework.authtoken.models import Token
+from .models import CatalogChange, Category, Product
+from . import authentication
+from . import cache as catalog_cache
+from . import changes
+from . import images
+from . import search
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Обновляет запись товара в поисковом индексе"""
+    if not raw:
+        search.index_product(instance)
+
+@receiver(post_save, sender=Product)
+def build_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Ставит в очередь ресайз нового изображения после фиксации транзакции"""
+    if raw or not instance.image or images.is_current(instance):
+        return
+    product_id, name = instance.pk, instance.image.name
+    transaction.on_commit(lambda: images.schedule(product_id, name))
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    catalog_cache.bump_on_commit(*catalog_cache.product_scopes(
+        instance, previous_category_id=getattr(instance, '_loaded_category_id', None)
+    ))
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    # pre_delete: после удаления у товаров уже будет category=NULL
+    catalog_cache.bump_on_commit(*catalog_cache.category_scopes(instance))
+
+@receiver(post_save, sender=Product)
+def log_product_change(sender, instance, **kwargs):
+    changes.record(changes.PRODUCT, [instance.pk])
+
+@receiver(post_delete, sender=Product)
+def log_product_delete(sender, instance, **kwargs):
+    changes.record(changes.PRODUCT, [instance.pk], action=CatalogChange.DELETE)
+
+@receiver(post_save, sender=Category)
+def log_category_change(sender, instance, created, **kwargs):
+    changes.record(changes.CATEGORY, [instance.pk])
+    if not created:
+        # Название категории входит в данные товара (category_name)
+        changes.record_category_products(instance.pk)
+
+@receiver(pre_delete, sender=Category)
+def log_category_delete(sender, instance, **kwargs):
+    # Товары получат category=NULL через UPDATE без сигналов
+    changes.record_category_products(instance.pk)
+
+@receiver(post_delete, sender=Category)
+def log_category_tombstone(sender, instance, **kwargs):
+    changes.record(changes.CATEGORY, [instance.pk], action=CatalogChange.DELETE)
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    authentication.forget(instance.key)
 
 @receiver(post_save, sender=User)
-def create_user_cart(sender, instance, created, **kwargs):
-    if created:
-        Cart.objects.create(user=instance)
\ No newline at end of file
+def forget_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """В кэше аутентификации лежат поля пользователя (is_active, is_staff, ...)"""
+    # last_login меняется при каждом входе и на права не влияет
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    keys = list(Token.objects.filter(user=instance).values_list('key', flat=True))
+    if keys:
+        authentication.forget(*keys)
@@ -0,0 +1,153 @@
+# api/stemmer.py
+"""Стеммер Snowball для русского языка.
+
+Английские слова стеммит токенайзер porter в FTS5, поэтому здесь
+обрабатываются только слова на кириллице.
+"""
+import re
+from functools import lru_cache
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+    'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя',
+    'ою', 'ею',
+)
+PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил',
+     'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит',
+     'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+CYRILLIC_RE = re.compile('[а-яё]')
+
+
+def _by_length(suffixes):
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+PERFECTIVE_GERUND = tuple(_by_length(group) for group in PERFECTIVE_GERUND)
+PARTICIPLE = tuple(_by_length(group) for group in PARTICIPLE)
+VERB = tuple(_by_length(group) for group in VERB)
+ADJECTIVE = _by_length(ADJECTIVE)
+NOUN = _by_length(NOUN)
+
+
+def _regions(word):
+    """Начала областей RV и R2"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _strip(rv, suffixes):
+    for suffix in suffixes:
+        if rv.endswith(suffix):
+            return rv[:-len(suffix)]
+    return None
+
+
+def _strip_grouped(rv, groups):
+    """Первая группа требует перед окончанием 'а' или 'я'"""
+    candidates = []
+    for suffix in groups[0]:
+        if rv.endswith(suffix) and rv[:-len(suffix)][-1:] in ('а', 'я'):
+            candidates.append(suffix)
+    for suffix in groups[1]:
+        if rv.endswith(suffix):
+            candidates.append(suffix)
+    if not candidates:
+        return None
+    return rv[:-len(max(candidates, key=len))]
+
+
+def _strip_adjectival(rv):
+    stem = _strip(rv, ADJECTIVE)
+    if stem is None:
+        return None
+    participle = _strip_grouped(stem, PARTICIPLE)
+    return stem if participle is None else participle
+
+
+# Словарь каталога невелик, а слова повторяются из товара в товар
+@lru_cache(maxsize=65536)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    stemmed = _strip_grouped(rv, PERFECTIVE_GERUND)
+    if stemmed is None:
+        without_reflexive = _strip(rv, REFLEXIVE)
+        if without_reflexive is not None:
+            rv = without_reflexive
+        for step in (
+            _strip_adjectival,
+            lambda s: _strip_grouped(s, VERB),
+            lambda s: _strip(s, NOUN),
+        ):
+            stemmed = step(rv)
+            if stemmed is not None:
+                break
+    if stemmed is not None:
+        rv = stemmed
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания в R2
+    r2 = (prefix + rv)[r2_start:]
+    for suffix in DERIVATIONAL:
+        if r2.endswith(suffix):
+            rv = rv[:-len(suffix)]
+            break
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative
+            if rv.endswith('нн'):
+                rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
@@ -0,0 +1,50 @@
+# api/storage.py
+"""Хранилище изображений товаров с адресацией по содержимому.
+
+Файл сохраняется под именем <каталог>/<sha256 содержимого><расширение>:
+одинаковые загрузки получают одно и то же имя и делят один файл на диске,
+а повторная загрузка уже известного файла ничего не пишет. Содержимое
+хэшируется по частям (File.chunks()), без чтения файла в память целиком.
+
+Файлы больше не получают суффиксов _AbCdEfG при совпадении имен, поэтому
+удалять файл при удалении товара нельзя - он может быть общим.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_ALGORITHM = 'sha256'
+
+
+def content_hash(content):
+    """Хэш файла по частям; позиция чтения возвращается в начало"""
+    digest = hashlib.new(HASH_ALGORITHM)
+    for chunk in content.chunks():
+        digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible(path='api.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, **kwargs):
+        # Одинаковое имя означает одинаковое содержимое, так что перезапись
+        # безопасна: параллельные загрузки одного файла пишут те же байты
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def hashed_name(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, content_hash(content) + extension).replace('\\', '/')
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+product_image_storage = ContentAddressedStorage()
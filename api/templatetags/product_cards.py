@@ -0,0 +1,76 @@
+"""Карточки товаров с кэшем отрендеренного HTML.
+
+Карточка рендерится один раз без request и хранится в кэше каталога под
+ключом (вариант, id, updated_at, версия области product:<id>): версия
+области меняется и тогда, когда updated_at остается прежним - при
+переименовании категории или когда товар закончился. Персональная часть
+(форма "В корзину", у вошедшего пользователя - с CSRF) рендерится на каждый запрос
+и подставляется на место ACTION_SLOT. Она отличается между карточками только
+id товара в URL, поэтому рендерится один раз с PRODUCT_ID_PLACEHOLDER.
+"""
+from django import template
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from api import cache as catalog_cache
+
+register = template.Library()
+
+CARD_TEMPLATE = 'shop/product_card.html'
+ACTION_TEMPLATE = 'shop/product_card_action.html'
+ACTION_SLOT = '<!--card-action-->'
+PRODUCT_ID_PLACEHOLDER = '987654321987'
+# Увеличить при изменении разметки карточки, чтобы не отдавать старый HTML
+CARD_MARKUP_VERSION = 1
+
+
+def card_key(product, variant, version):
+    updated = product.updated_at.timestamp() if product.updated_at else 0
+    return (
+        f'{catalog_cache.KEY_PREFIX}:card:{CARD_MARKUP_VERSION}:{variant}:'
+        f'{product.pk}:{updated}:{version}'
+    )
+
+
+def render_cards(products, variant):
+    """HTML карточек без персональной части; кэш читается одним get_many"""
+    card_template = get_template(CARD_TEMPLATE)
+    if not getattr(settings, 'PRODUCT_CARD_CACHE', True):
+        return [card_template.render({'product': p, 'variant': variant}) for p in products]
+
+    cache = catalog_cache.get_cache()
+    versions = catalog_cache.get_versions([catalog_cache.product_scope(p.pk) for p in products])
+    keys = [
+        card_key(p, variant, versions[catalog_cache.product_scope(p.pk)]) for p in products
+    ]
+    cached = cache.get_many(keys)
+    cards, missing = [], {}
+    for product, key in zip(products, keys):
+        html = cached.get(key)
+        catalog_cache.stats.record(hit=html is not None)
+        if html is None:
+            html = missing[key] = card_template.render({'product': product, 'variant': variant})
+        cards.append(html)
+    if missing:
+        cache.set_many(missing, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 24 * 60 * 60))
+    return cards
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, variant='catalog'):
+    """{% product_cards products %} / {% product_cards products "home" %}"""
+    products = list(products)
+    if not products:
+        return ''
+    # Без request: context processors здесь не нужны
+    action = get_template(ACTION_TEMPLATE).render({
+        'user': context.get('user'),
+        'csrf_token': context.get('csrf_token'),
+        'variant': variant,
+        'product': {'id': PRODUCT_ID_PLACEHOLDER},
+    })
+    html = []
+    for product, card in zip(products, render_cards(products, variant)):
+        html.append(card.replace(ACTION_SLOT, action.replace(PRODUCT_ID_PLACEHOLDER, str(product.pk)), 1))
+    return mark_safe(''.join(html))
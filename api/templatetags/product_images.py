@@ -0,0 +1,31 @@
+from django import template
+from django.utils.html import format_html
+
+from api import images
+
+register = template.Library()
+
+# Ширина карточки в сетке каталога (col-md-4 col-lg-3)
+DEFAULT_SIZES = '(min-width: 992px) 25vw, (min-width: 768px) 33vw, 100vw'
+
+
+@register.simple_tag
+def product_image(product, css_class='', sizes=DEFAULT_SIZES):
+    """<picture> с WebP и JPEG копиями; без копий - исходное изображение"""
+    webp = images.derivative_urls(product, 'webp')
+    jpeg = images.derivative_urls(product, 'jpeg')
+    if not webp and not jpeg:
+        return format_html(
+            '<img src="{}" class="{}" alt="{}" loading="lazy" decoding="async">',
+            product.image.url, css_class, product.name,
+        )
+    fallback = jpeg or webp
+    derivatives = product.image_derivatives
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" '
+        'class="{}" alt="{}" loading="lazy" decoding="async"></picture>',
+        format_html('<source type="image/webp" srcset="{}" sizes="{}">', images.srcset(webp), sizes)
+        if webp and jpeg else '',
+        fallback[len(fallback) // 2][1], images.srcset(fallback), sizes,
+        derivatives['width'], derivatives['height'], css_class, product.name,
+    )
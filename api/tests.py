@@ -1,3 +1,1778 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
 
+from shop.views import checkout_view
+
+from . import authentication
+from . import cache as catalog_cache
+from . import cart as cart_service
+from . import changes
+from . import checks
+from . import guest_cart
+from . import images
+from . import queryplan
+from . import search
+from .cart import cart_summary
+from .checkout import (
+    IDEMPOTENCY_KEY_MAX_LENGTH, EmptyCartError, place_order, purge_expired_keys,
+)
+from .inventory import OutOfStock, cancel_order, reserve
+from .models import Cart, CartItem, CatalogChange, Category, Favorite, IdempotencyKey, Order, OrderItem, Product
+from .authentication import CachedTokenAuthentication
+from .cached_sessions import SessionStore as CachedSessionStore
+from .querybudget import QueryBudgetTestMixin
+from .renderers import ORJSONRenderer, stream_json_array
+from .serializers import ProductSerializer
+from .storage import product_image_storage
+from .pagination import KeysetPaginator, filter_products
+from .pagecache import MESSAGES_COOKIE
+from .sessions import SessionStore
+from .views import CartViewSet
+
+
+def make_catalog():
+    category = Category.objects.create(name='Одежда', slug='odezhda')
+    other = Category.objects.create(name='Альбомы', slug='albomy')
+    prices = ['500', '100', '300', '300', '900', '100', '700']
+    products = [
+        Product.objects.create(
+            name=f'Товар {i}', description='Описание', price=Decimal(price),
+            category=category if i % 2 else other, stock=100,
+        )
+        for i, price in enumerate(prices)
+    ]
+    return category, other, products
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+
+    def walk(self, sort, page_size=3):
+        paginator = KeysetPaginator.for_sort(sort, page_size)
+        queryset = filter_products(Product.objects.all(), sort=sort)
+        pages, cursor = [], None
+        while True:
+            page = paginator.paginate(queryset, cursor=cursor)
+            pages.append(page)
+            if not page.next_cursor:
+                return queryset, paginator, pages
+            cursor = page.next_cursor
+
+    def test_forward_walk_matches_full_ordering(self):
+        for sort in (None, 'price_asc', 'price_desc', 'new'):
+            with self.subTest(sort=sort):
+                queryset, _, pages = self.walk(sort)
+                walked = [p.id for page in pages for p in page]
+                self.assertEqual(walked, [p.id for p in queryset])
+                self.assertIsNone(pages[0].prev_cursor)
+
+    def test_prev_cursor_returns_previous_page(self):
+        for sort in (None, 'price_asc', 'price_desc', 'new'):
+            with self.subTest(sort=sort):
+                queryset, paginator, pages = self.walk(sort)
+                back = paginator.paginate(queryset, cursor=pages[2].prev_cursor)
+                self.assertEqual([p.id for p in back], [p.id for p in pages[1]])
+                self.assertIsNotNone(back.next_cursor)
+
+    def test_page_is_single_query(self):
+        paginator = KeysetPaginator.for_sort('price_desc', 3)
+        page = paginator.paginate(Product.objects.all())
+        with self.assertNumQueries(1):
+            paginator.paginate(Product.objects.all(), cursor=page.next_cursor)
+
+
+class ProductListPaginationTests(APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+
+    def test_api_list_returns_cursors_and_count(self):
+        response = self.client.get(
+            '/api/products/',
+            {'sort': 'price_asc', 'page_size': 4, 'count': 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIsNotNone(response.data['next_cursor'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_api_list_filters_by_category(self):
+        response = self.client.get('/api/products/', {'category': self.category.id})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_category_is_400(self):
+        admin = User.objects.create_user('admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        for url in ('/api/products/', '/api/products/export/'):
+            for value in ('abc', '-1', '1.5'):
+                with self.subTest(url=url, category=value):
+                    response = self.client.get(url, {'category': value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('category', response.data)
+        response = self.client.get(reverse('products'), {'category': 'abc'})
+        self.assertRedirects(response, reverse('products'), fetch_redirect_response=False)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/products/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_products_page_paginates(self):
+        response = self.client.get(reverse('products'), {'sort': 'new'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 7)
+        self.assertIsNone(response.context['next_query'])
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        self.hoodie = Product.objects.create(
+            name='Худи Stray Kids', description='Тёплая толстовка с капюшоном', price=Decimal('4500'),
+        )
+        self.stick = Product.objects.create(
+            name='Световая палочка', description='Official lightstick for concerts', price=Decimal('3900'),
+        )
+        self.shirt = Product.objects.create(
+            name='Футболка', description='Хлопковая футболка, подходит к худи', price=Decimal('1900'),
+        )
+
+    def search(self, q, **params):
+        response = self.client.get('/api/products/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranks_name_matches_first(self):
+        data = self.search('худи')
+        self.assertEqual([p['id'] for p in data['results']], [self.hoodie.id, self.shirt.id])
+
+    def test_matches_word_forms_and_description(self):
+        self.assertEqual([p['id'] for p in self.search('футболки')['results']], [self.shirt.id])
+        self.assertEqual([p['id'] for p in self.search('concert')['results']], [self.stick.id])
+        self.assertEqual([p['id'] for p in self.search('свет')['results']], [self.stick.id])
+
+    def test_index_follows_save_and_delete(self):
+        self.stick.name = 'Лайтстик'
+        self.stick.save()
+        self.assertEqual(self.search('световая')['results'], [])
+        self.shirt.delete()
+        self.assertEqual([p['id'] for p in self.search('худи')['results']], [self.hoodie.id])
+
+    def test_empty_query_lists_catalog(self):
+        ids = [self.hoodie.id, self.stick.id, self.shirt.id]
+        self.assertEqual([p['id'] for p in self.search('')['results']], ids)
+        self.assertEqual([p['id'] for p in self.search('?!')['results']], ids)
+
+    def test_check_warns_about_empty_index(self):
+        self.assertEqual(checks.check_search_index(None, databases=['default']), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        self.assertEqual(checks.check_search_index(None), [])
+        warnings = checks.check_search_index(None, databases=['default'])
+        self.assertEqual([w.id for w in warnings], ['api.W001'])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(checks.check_search_index(None, databases=['default']), [])
+
+    def test_paginates(self):
+        data = self.search('худи', page_size=1)
+        self.assertEqual(data['next_page'], 2)
+        data = self.search('худи', page_size=1, page=2)
+        self.assertEqual([p['id'] for p in data['results']], [self.shirt.id])
+        self.assertIsNone(data['next_page'])
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+        Product.objects.filter(pk=self.products[0].pk).update(category=None)
+        Product.objects.filter(pk=self.products[1].pk).update(
+            image='products/a.png',
+            image_derivatives={'source': 'products/a.png', 'width': 800, 'height': 600,
+                               'webp': {'320': 'products/derived/a-320w.webp'}},
+        )
+        catalog_cache.bump(catalog_cache.PRODUCTS)
+
+    def test_fast_path_matches_serializer(self):
+        response = self.client.get('/api/products/', {'page_size': 100})
+        expected = ProductSerializer(
+            Product.objects.select_related('category').order_by('id'), many=True,
+            context={'request': response.wsgi_request},
+        ).data
+        self.assertEqual(response.data['results'], expected)
+        self.assertNotIn('category_name', response.data['results'][0])
+        self.assertIn('webp', response.data['results'][1]['image_derivatives'])
+
+    def test_fields_and_exclude(self):
+        data = self.client.get('/api/products/', {'fields': 'id,name,price', 'sort': 'price_asc'}).data
+        self.assertEqual(set(data['results'][0]), {'id', 'name', 'price'})
+        data = self.client.get('/api/products/', {'exclude': 'description,image_derivatives'}).data
+        self.assertNotIn('description', data['results'][0])
+        self.assertIn('name', data['results'][0])
+        full = self.client.get(f'/api/products/{self.products[2].id}/').data
+        self.assertIn('description', full)
+        detail = self.client.get(f'/api/products/{self.products[2].id}/', {'fields': 'id'}).data
+        self.assertEqual(detail, {'id': self.products[2].id})
+
+    def test_nested_fields(self):
+        user = User.objects.create_user('buyer', password='pass')
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.create(cart=cart, product=self.products[2], quantity=2)
+        Favorite.objects.create(user=user, product=self.products[2])
+        self.client.force_authenticate(user)
+        data = self.client.get('/api/cart/', {'fields': 'total,items.quantity,items.product.name'}).data
+        self.assertEqual(set(data), {'total', 'items'})
+        self.assertEqual(data['items'], [{'quantity': 2, 'product': {'name': self.products[2].name}}])
+        data = self.client.get('/api/favorites/', {'exclude': 'product.description'}).data
+        self.assertNotIn('description', data[0]['product'])
+        self.assertIn('price', data[0]['product'])
+
+
+class RendererTests(APITestCase):
+    def test_orjson_matches_json_renderer(self):
+        data = {
+            'price': Decimal('500.00'),
+            'total': Decimal('1600'),
+            'created_at': timezone.now(),
+            'local': timezone.localtime(),
+            'day': timezone.now().date(),
+            'name': 'Худи \u2028 "Stray Kids"',
+            'lazy': gettext_lazy('Корзина'),
+            'items': [1, 2.5, None, True, ('a', 'b')],
+            7: 'ключ-число',
+            'id': uuid.uuid4(),
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=4'
+        self.assertEqual(
+            ORJSONRenderer().render(data, indented), JSONRenderer().render(data, indented)
+        )
+        self.assertEqual(ORJSONRenderer().render({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+
+    def test_stream_json_array(self):
+        for count in (0, 1, 4, 5):
+            content = b''.join(stream_json_array(range(count), lambda n: {'n': n}, chunk_size=2))
+            self.assertEqual(json.loads(content), [{'n': n} for n in range(count)])
+
+    def test_streaming_export(self):
+        make_catalog()
+        self.assertIn(self.client.get('/api/products/export/').status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get('/api/products/export/', {'sort': 'price_asc'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        expected = ProductSerializer(
+            filter_products(Product.objects.select_related('category'), sort='price_asc'),
+            many=True, context={'request': response.wsgi_request},
+        ).data
+        self.assertEqual(data, json.loads(JSONRenderer().render(expected)))
+
+        response = self.client.get('/api/products/export/', {'fields': 'id,price'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(set(data[0]), {'id', 'price'})
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        catalog_cache.stats.reset()
+        self.category, self.other, self.products = make_catalog()
+
+    def test_product_list_served_from_cache(self):
+        self.client.get('/api/products/', {'category': self.category.id})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', {'category': self.category.id})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(catalog_cache.stats.as_dict()['hits'], 1)
+
+    def test_product_save_invalidates_only_its_listings(self):
+        self.client.get('/api/products/', {'category': self.category.id})
+        self.client.get('/api/products/', {'category': self.other.id})
+
+        product = Product.objects.filter(category=self.category).first()
+        product.name = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get('/api/products/', {'category': self.category.id})
+        self.assertIn('Новое название', [p['name'] for p in response.data['results']])
+        with self.assertNumQueries(0):
+            self.client.get('/api/products/', {'category': self.other.id})
+
+    def test_version_changes_only_after_commit(self):
+        scopes = [catalog_cache.PRODUCTS, catalog_cache.product_scope(self.products[0].pk)]
+        before = catalog_cache.get_versions(scopes)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+            # До фиксации параллельный запрос закэшировал бы старые строки под новой версией
+            self.assertEqual(catalog_cache.get_versions(scopes), before)
+        after = catalog_cache.get_versions(scopes)
+        self.assertTrue(all(after[scope] > before[scope] for scope in scopes))
+
+    def test_moving_product_invalidates_old_category(self):
+        self.client.get('/api/products/', {'category': self.category.id})
+        product = Product.objects.filter(category=self.category).first()
+        product.category = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get('/api/products/', {'category': self.category.id})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_category_rename_invalidates_product_detail(self):
+        product = self.products[1]
+        self.client.get(f'/api/products/{product.id}/')
+        self.category.name = 'Мерч'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.data['category_name'], 'Мерч')
+
+    def test_category_list_cached(self):
+        self.client.get('/api/categories/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/categories/')
+        self.assertEqual(len(response.data), 2)
+
+
+class SharedCacheCheckTests(TestCase):
+    def errors(self, **overrides):
+        with override_settings(**overrides):
+            return [error.id for error in checks.check_shared_caches(None)]
+
+    def test_local_memory_caches_fail_deploy_check(self):
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/x'}
+        local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        self.assertEqual(self.errors(DEBUG=True), [])
+        self.assertEqual(self.errors(DEBUG=False), ['api.E001'])
+        self.assertEqual(self.errors(DEBUG=False, CACHES={**settings.CACHES, 'catalog': shared}), [])
+        self.assertEqual(self.errors(
+            DEBUG=False, CACHES={'default': local, 'catalog': shared, 'sessions': local},
+            SESSION_ENGINE='api.cached_sessions', SESSION_CACHE_ALIAS='sessions',
+        ), ['api.E002'])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+
+    def test_unchanged_listing_answers_not_modified(self):
+        url = '/api/products/'
+        params = {'category': self.category.id}
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+        with self.assertNumQueries(0):
+            second = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+        # Товар другой категории не меняет валидатор этого списка
+        other = Product.objects.filter(category=self.other).first()
+        other.price += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        product = Product.objects.filter(category=self.category).first()
+        product.price += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        third = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], first['ETag'])
+
+    def test_validators_depend_on_query(self):
+        first = self.client.get('/api/products/', {'sort': 'price_asc'})
+        other = self.client.get('/api/products/', {'sort': 'price_desc'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(other.status_code, 200)
+
+    def test_categories_if_modified_since(self):
+        first = self.client.get('/api/categories/')
+        response = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        detail = self.client.get(f'/api/categories/{self.category.id}/')
+        self.assertEqual(detail.data['name'], self.category.name)
+
+        catalog_cache.bump(catalog_cache.CATEGORIES)
+        self.assertEqual(
+            self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200
+        )
+
+
+class ChangeFeedTests(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+
+    def feed(self, url, since, **params):
+        response = self.client.get(url, {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_initial_feed_and_delta(self):
+        data = self.feed('/api/products/changes/', 0)
+        self.assertEqual([item['id'] for item in data['upserts']], [p.id for p in self.products])
+        self.assertFalse(data['has_more'])
+        cursor = data['cursor']
+
+        self.assertEqual(self.feed('/api/products/changes/', cursor)['upserts'], [])
+        changed, deleted = self.products[0], self.products[1]
+        changed.price = Decimal('1')
+        changed.save()
+        changed.save()
+        deleted_id = deleted.id
+        deleted.delete()
+        with self.assertMaxQueries(2):
+            data = self.feed('/api/products/changes/', cursor)
+        self.assertEqual([item['id'] for item in data['upserts']], [changed.id])
+        self.assertEqual(data['upserts'][0]['price'], '1.00')
+        self.assertEqual(data['deletes'], [deleted_id])
+
+    def test_batches(self):
+        seen, cursor = set(), 0
+        while True:
+            data = self.feed('/api/products/changes/', cursor, limit=3)
+            seen.update(item['id'] for item in data['upserts'])
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, {p.id for p in self.products})
+        self.assertEqual(self.client.get('/api/products/changes/', {'since': 'x'}).status_code, 400)
+
+    def test_category_changes_reach_products(self):
+        cursor = self.feed('/api/products/changes/', 0)['cursor']
+        category_cursor = self.feed('/api/categories/changes/', 0)['cursor']
+        other_id = self.other.id
+        self.other.delete()
+        data = self.feed('/api/products/changes/', cursor)
+        self.assertEqual(
+            {item['id'] for item in data['upserts']},
+            {p.id for p in self.products if p.category_id == other_id},
+        )
+        self.assertTrue(all(item['category'] is None for item in data['upserts']))
+        self.assertEqual(self.feed('/api/categories/changes/', category_cursor)['deletes'], [other_id])
+
+    def test_stock_updates_are_logged(self):
+        cursor = self.feed('/api/products/changes/', 0)['cursor']
+        product = self.products[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve([(product.id, 100)])
+        data = self.feed('/api/products/changes/', cursor)
+        self.assertEqual([item['id'] for item in data['upserts']], [product.id])
+        self.assertFalse(data['upserts'][0]['in_stock'])
+
+    def test_rolled_back_reservation_is_not_logged(self):
+        before = CatalogChange.objects.count()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(OutOfStock):
+                with transaction.atomic():
+                    reserve([(self.products[2].id, 100)])
+                    raise OutOfStock([self.products[3].id])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(CatalogChange.objects.count(), before)
+
+    def test_compaction_keeps_cursors_valid(self):
+        cursor = self.feed('/api/products/changes/', 0)['cursor']
+        product = self.products[0]
+        for _ in range(3):
+            product.save()
+        deleted_id = self.products[1].id
+        self.products[1].delete()
+        before = CatalogChange.objects.count()
+        removed = changes.compact(batch_size=2)
+        self.assertEqual(CatalogChange.objects.count(), before - removed)
+        self.assertEqual(
+            CatalogChange.objects.filter(model=changes.PRODUCT).count(), len(self.products)
+        )
+        data = self.feed('/api/products/changes/', cursor)
+        self.assertEqual([item['id'] for item in data['upserts']], [product.id])
+        self.assertEqual(data['deletes'], [deleted_id])
+
+
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+
+    def card_renders(self, url='/products/'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        names = [t.name for t in response.templates]
+        return names.count('shop/product_card.html'), response.content.decode()
+
+    def test_cards_render_once(self):
+        self.assertEqual(self.card_renders()[0], 7)
+        renders, html = self.card_renders()
+        self.assertEqual(renders, 0)
+        self.assertIn('Товар 6', html)
+        self.assertEqual(self.card_renders('/')[0], 6)
+
+    def test_personal_part_is_not_cached(self):
+        from .templatetags.product_cards import render_cards
+
+        self.card_renders()
+        user = User.objects.create_user('buyer', password='pass')
+        self.client.force_login(user)
+        renders, html = self.card_renders()
+        self.assertEqual(renders, 0)
+        self.assertEqual(html.count('<form action="/cart/add/'), 7)
+        url = reverse('add_to_cart', args=[self.products[0].id])
+        self.assertIn(f'<form action="{url}"', html)
+        self.assertIn('name="csrfmiddlewaretoken"', html)
+        self.assertNotIn('csrfmiddlewaretoken', ''.join(render_cards(self.products, 'catalog')))
+
+    def test_changes_rerender_only_affected_cards(self):
+        self.card_renders()
+        product = self.products[1]
+        product.name = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        renders, html = self.card_renders()
+        self.assertEqual(renders, 1)
+        self.assertIn('Новое название', html)
+
+        self.category.name = 'Мерч'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        renders, html = self.card_renders()
+        self.assertEqual(renders, 3)
+        self.assertIn('Мерч', html)
+
+        Product.objects.filter(pk=self.products[0].pk).update(stock=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve([(self.products[0].id, 1)])
+        renders, html = self.card_renders()
+        self.assertEqual(renders, 1)
+        self.assertIn('Нет в наличии', html)
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+
+    def test_anonymous_pages_served_without_orm(self):
+        for url in ('/', '/products/'):
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'hit')
+            self.assertContains(response, 'Товар 1')
+
+    def test_query_string_is_normalized(self):
+        self.client.get('/products/', {'category': self.category.id, 'sort': 'price_asc'})
+        response = self.client.get('/products/', {'utm_source': 'mail', 'sort': 'price_asc', 'category': self.category.id})
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get('/products/', {'sort': 'price_desc'})['X-Page-Cache'], 'miss')
+
+    def test_sessions_and_messages_bypass_cache(self):
+        self.client.get('/products/')
+        self.client.force_login(User.objects.create_user('buyer', password='pass'))
+        response = self.client.get('/products/')
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'buyer')
+
+        self.client.logout()
+        self.client.cookies.pop(settings.SESSION_COOKIE_NAME, None)
+        self.client.cookies['messages'] = 'x'
+        self.assertNotIn('X-Page-Cache', self.client.get('/products/'))
+
+    def test_product_save_purges_only_affected_listings(self):
+        other_page = {'category': self.other.id}
+        for data in (None, {'category': self.category.id}, other_page):
+            self.client.get('/products/', data)
+        self.client.get('/')
+
+        product = self.products[1]
+        product.name = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        self.assertContains(self.client.get('/products/', {'category': self.category.id}), 'Новое название')
+        self.assertContains(self.client.get('/products/'), 'Новое название')
+        self.assertContains(self.client.get('/'), 'Новое название')
+        self.assertEqual(self.client.get('/products/', other_page)['X-Page-Cache'], 'hit')
+
+    def test_category_save_purges_pages(self):
+        self.client.get('/products/', {'category': self.other.id})
+        self.category.name = 'Мерч'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get('/products/', {'category': self.other.id})
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Мерч')
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    """Число запросов не зависит от числа строк"""
+
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart, _ = Cart.objects.get_or_create(user=self.user)
+
+    def fill(self, count):
+        for product in self.products[:count]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+            Favorite.objects.create(user=self.user, product=product)
+
+    def count_for(self, url, count):
+        CartItem.objects.all().delete()
+        Favorite.objects.all().delete()
+        self.fill(count)
+        with self.assertMaxQueries(10) as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(counter)
+
+    def test_api_cart_and_favorites(self):
+        self.client.force_authenticate(self.user)
+        for url in ('/api/cart/', '/api/favorites/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.count_for(url, 1), self.count_for(url, 6))
+
+    def test_cart_page(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.count_for(reverse('cart'), 1), self.count_for(reverse('cart'), 6))
+
+    def test_catalog_pages_within_budget(self):
+        for url in (reverse('home'), reverse('products'), '/api/products/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        authentication.local_cache.clear()
+        authentication.get_cache().clear()
+        self.user = User.objects.create_user('buyer', password='pass')
+        response = self.client.post('/api/login/', {'username': 'buyer', 'password': 'pass'})
+        self.key = response.data['token']
+        self.assertEqual(response.data['user']['username'], 'buyer')
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def test_login_primes_cache(self):
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.key))
+        # Каждый запрос получает свои экземпляры
+        self.assertIsNot(self.authenticate()[0], user)
+        self.assertEqual(self.client.get('/api/favorites/', HTTP_AUTHORIZATION=f'Token {self.key}').status_code, 200)
+
+    def test_shared_cache_refills_local(self):
+        authentication.local_cache.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+        authentication.local_cache.clear()
+        authentication.get_cache().clear()
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_revocation(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+        self.user.is_active = True
+        self.user.save()
+        self.authenticate()
+        Token.objects.filter(key=self.key).delete()
+        response = self.client.get('/api/favorites/', HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_last_login_does_not_invalidate(self):
+        self.authenticate()
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    @override_settings(TOKEN_EXPIRY=3600)
+    def test_expiry(self):
+        self.authenticate()
+        Token.objects.filter(key=self.key).update(created=timezone.now() - timedelta(hours=2))
+        authentication.forget(self.key)
+        with self.assertRaisesMessage(AuthenticationFailed, 'expired'):
+            self.authenticate()
+
+    @override_settings(TOKEN_EXPIRY=3600)
+    def test_login_after_expiry_issues_new_token(self):
+        self.authenticate()
+        Token.objects.filter(key=self.key).update(created=timezone.now() - timedelta(hours=2))
+        response = self.client.post('/api/login/', {'username': 'buyer', 'password': 'pass'})
+        new_key = response.data['token']
+        self.assertNotEqual(new_key, self.key)
+        self.assertFalse(Token.objects.filter(key=self.key).exists())
+        response = self.client.get('/api/favorites/', HTTP_AUTHORIZATION=f'Token {new_key}')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/favorites/', HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 401)
+
+
+class CartSummaryTests(APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart, _ = Cart.objects.get_or_create(user=self.user)
+        # 500 * 2 + 100 * 3 + 300 * 1
+        for product, quantity in zip(self.products[:3], (2, 3, 1)):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def test_summary_is_two_queries(self):
+        with self.assertNumQueries(2):
+            summary = cart_summary(self.cart)
+        self.assertEqual(summary.total, Decimal('1600'))
+        self.assertEqual(summary.item_count, 6)
+        self.assertEqual([item.line_total for item in summary.items],
+                         [Decimal('1000'), Decimal('300'), Decimal('300')])
+
+    def test_empty_cart(self):
+        self.cart.items.all().delete()
+        summary = cart_summary(self.cart)
+        self.assertEqual((summary.items, summary.item_count, summary.total), ([], 0, Decimal('0')))
+
+    def test_api_cart_totals(self):
+        self.client.force_authenticate(self.user)
+        data = self.client.get('/api/cart/').data
+        self.assertEqual(Decimal(str(data['total'])), Decimal('1600'))
+        self.assertEqual(data['item_count'], 6)
+        self.assertEqual(Decimal(str(data['items'][0]['total_price'])), Decimal('1000'))
+
+
+class CartMutationTests(TestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart = cart_service.get_cart(self.user)
+        self.product = self.products[0]
+
+    def test_add_set_decrease_remove(self):
+        self.assertEqual(cart_service.add_item(self.cart, self.product.id), 1)
+        self.assertEqual(cart_service.add_item(self.cart, self.product.id, 4), 5)
+        self.assertEqual(cart_service.decrease_item(self.cart, self.product.id, 2), 3)
+        self.assertEqual(cart_service.set_quantity(self.cart, self.product.id, 7), 7)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 7)
+        self.assertEqual(cart_service.decrease_item(self.cart, self.product.id, 7), 0)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_set_zero_removes(self):
+        cart_service.add_item(self.cart, self.product.id, 2)
+        self.assertEqual(cart_service.set_quantity(self.cart, self.product.id, 0), 0)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_api_rejects_non_positive_quantity(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/api/cart/add/', {'product_id': self.product.id, 'quantity': -3},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ImmediateTransactionsMixin:
+    """Транзакции из потоков с BEGIN IMMEDIATE (SQLITE_TRANSACTION_MODE=IMMEDIATE).
+
+    В режиме DEFERRED параллельные транзакции, которые сначала читают, а
+    потом пишут, получают "database is locked" при повышении блокировки.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Словарь общий для соединений всех потоков; читается при подключении
+        options = connection.settings_dict['OPTIONS']
+        previous = options.get('transaction_mode')
+        options['transaction_mode'] = 'IMMEDIATE'
+        connection.close()
+        cls.addClassCleanup(options.__setitem__, 'transaction_mode', previous)
+        cls.addClassCleanup(connection.close)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """N параллельных добавлений одного товара дают количество N"""
+    workers = 8
+    adds_per_worker = 5
+
+    def test_parallel_adds_are_not_lost(self):
+        user = User.objects.create_user('buyer', password='pass')
+        cart = cart_service.get_cart(user)
+        product = Product.objects.create(name='Лайтстик', description='', price=Decimal('3900'), stock=10)
+        barrier = threading.Barrier(self.workers)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.adds_per_worker):
+                    cart_service.add_item(cart.pk, product.pk)
+            except Exception as exc:  # pragma: no cover - попадет в assert ниже
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 1)
+        self.assertEqual(
+            CartItem.objects.get(cart=cart).quantity, self.workers * self.adds_per_worker
+        )
+
+
+class CartBatchTests(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart = cart_service.get_cart(self.user)
+        self.client.force_authenticate(self.user)
+
+    def post(self, operations):
+        return self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+
+    def test_applies_operations_in_order(self):
+        a, b, c = (p.id for p in self.products[:3])
+        cart_service.add_item(self.cart, c, 5)
+        response = self.post([
+            {'op': 'add', 'product_id': a},
+            {'op': 'add', 'product_id': a, 'quantity': 2},
+            {'op': 'set', 'product_id': b, 'quantity': 4},
+            {'op': 'remove', 'product_id': c},
+        ])
+        self.assertEqual(response.status_code, 200)
+        quantities = {item['product']['id']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {a: 3, b: 4})
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        ops = [{'op': 'add', 'product_id': p.id, 'quantity': 2} for p in self.products]
+        with self.assertMaxQueries(12):
+            self.post(ops)
+        ops = [{'op': 'set', 'product_id': p.id, 'quantity': 1} for p in self.products]
+        with self.assertMaxQueries(12):
+            self.post(ops)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart, quantity=1).count(), len(self.products))
+
+    def test_unknown_product_rolls_back(self):
+        response = self.post([
+            {'op': 'add', 'product_id': self.products[0].id},
+            {'op': 'add', 'product_id': 999999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_ids'], [999999])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_set_requires_quantity(self):
+        response = self.post([{'op': 'set', 'product_id': self.products[0].id}])
+        self.assertEqual(response.status_code, 400)
+
+
+class CheckoutTests(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart = cart_service.get_cart(self.user)
+
+    def fill(self, count):
+        for product in self.products[:count]:
+            cart_service.add_item(self.cart, product.id, 2)
+
+    def test_place_order_snapshots_prices_and_clears_cart(self):
+        self.fill(3)
+        order = place_order(self.user, 'Москва')
+        self.assertEqual(order.total_price, Decimal('1800'))
+        self.assertEqual(Order.objects.get().total_price, Decimal('1800'))
+        self.assertEqual(
+            list(order.items.order_by('id').values_list('product_id', 'quantity', 'price')),
+            [(p.id, 2, p.price) for p in self.products[:3]],
+        )
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.fill(1)
+        with self.assertMaxQueries(13) as small:
+            place_order(self.user, 'Москва')
+        self.fill(7)
+        with self.assertMaxQueries(13) as large:
+            place_order(self.user, 'Москва')
+        self.assertEqual(len(small), len(large))
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(self.user, 'Москва')
+
+    def test_checkout_page_meets_query_budget(self):
+        self.fill(4)
+        self.client.force_login(self.user)
+        with self.assertMaxQueries(checkout_view.query_budget):
+            key = self.client.get(reverse('checkout')).context['idempotency_key']
+        with self.assertMaxQueries(checkout_view.query_budget) as counter:
+            response = self.client.post(reverse('checkout'), {
+                'shipping_address': 'Москва', 'idempotency_key': key,
+            })
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertEqual(len(counter), checkout_view.query_budget)
+        self.assertEqual(OrderItem.objects.count(), 4)
+
+    def test_api_and_page_use_same_pipeline(self):
+        self.fill(2)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/orders/', {'shipping_address': 'Москва'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.data['id']).count(), 2)
+
+        self.fill(1)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('checkout'), {'shipping_address': 'Казань'})
+        self.assertRedirects(response, reverse('profile'))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(
+            self.client.post('/api/orders/', {'shipping_address': 'Москва'}, format='json').status_code,
+            400,
+        )
+
+
+class CheckoutConcurrencyTests(ImmediateTransactionsMixin, TransactionTestCase):
+    def test_parallel_submissions_place_one_order(self):
+        user = User.objects.create_user('buyer', password='pass')
+        cart = cart_service.get_cart(user)
+        product = Product.objects.create(name='Лайтстик', description='', price=Decimal('3900'), stock=10)
+        cart_service.add_item(cart, product.id, 3)
+        workers = 6
+        barrier = threading.Barrier(workers)
+        results = []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(place_order(user, 'Москва').pk)
+            except EmptyCartError:
+                results.append(None)
+            except Exception as exc:  # pragma: no cover
+                results.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results, key=str).count(None), workers - 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.get().quantity, 3)
+
+
+class InventoryTests(APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart = cart_service.get_cart(self.user)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def test_reserve_decrements_and_marks_sold_out(self):
+        first, second = self.products[:2]
+        Product.objects.filter(pk=second.pk).update(stock=3)
+        reserve([(first.id, 2), (second.id, 1), (second.id, 2)])
+        self.assertEqual(self.stock(first), 98)
+        self.assertTrue(first.in_stock)
+        self.assertEqual(self.stock(second), 0)
+        self.assertFalse(second.in_stock)
+
+    def test_shortage_reserves_nothing(self):
+        first, second = self.products[:2]
+        Product.objects.filter(pk=second.pk).update(stock=1)
+        with self.assertRaises(OutOfStock) as ctx:
+            reserve([(first.id, 2), (second.id, 2)])
+        self.assertEqual(ctx.exception.product_ids, [second.id])
+        self.assertEqual(self.stock(first), 100)
+        self.assertEqual(self.stock(second), 1)
+
+    def test_api_returns_conflict(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(stock=1)
+        cart_service.add_item(self.cart, product.id, 2)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/orders/', {'shipping_address': 'Москва'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['product_ids'], [product.id])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 2)
+
+    def test_cancel_returns_stock_once(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(stock=2)
+        cart_service.add_item(self.cart, product.id, 2)
+        order = place_order(self.user, 'Москва')
+        self.assertFalse(Product.objects.get(pk=product.pk).in_stock)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/orders/{order.pk}/cancel/')
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.assertEqual(self.stock(product), 2)
+        self.assertTrue(product.in_stock)
+        self.assertFalse(cancel_order(order))
+        self.assertEqual(self.stock(product), 2)
+
+    def test_api_rejects_legacy_in_stock(self):
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        data = {'name': 'Кепка', 'description': 'Хлопок', 'price': '900', 'category': self.category.id}
+        response = self.client.post('/api/products/', {**data, 'in_stock': True}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('in_stock', response.data)
+        response = self.client.post('/api/products/', {**data, 'stock': 5}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Product.objects.get(name='Кепка').in_stock)
+
+    def test_admin_stock_edit_keeps_later_reservations(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(stock=10)
+        self.client.force_login(User.objects.create_superuser('admin', password='pass'))
+        url = reverse('admin:api_product_change', args=[product.pk])
+        self.assertContains(self.client.get(url), 'name="initial-stock" value="10"')
+        data = {
+            'name': product.name, 'description': product.description, 'price': product.price,
+            'category': product.category_id, 'initial-stock': 10,
+        }
+        # Пока форма открыта, заказ резервирует 3 штуки
+        reserve([(product.id, 3)])
+
+        response = self.client.post(url, {**data, 'name': 'Новое название', 'stock': 10})
+        self.assertEqual(response.status_code, 302)
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.stock), ('Новое название', 7))
+
+        self.client.post(url, {**data, 'stock': 15})
+        self.assertEqual(self.stock(product), 12)
+        self.client.post(url, {**data, 'stock': 0, 'initial-stock': 15})
+        self.assertEqual(self.stock(product), 0)
+        self.assertFalse(product.in_stock)
+
+    def test_order_status_changes_only_through_cancel(self):
+        product = self.products[0]
+        cart_service.add_item(self.cart, product.id, 2)
+        order = place_order(self.user, 'Москва')
+        self.client.force_authenticate(self.user)
+        url = f'/api/orders/{order.pk}/'
+        response = self.client.patch(url, {
+            'status': 'cancelled', 'total_price': '1.00', 'user': 999, 'shipping_address': 'Казань',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.status, order.total_price, order.user_id, order.shipping_address),
+            ('pending', product.price * 2, self.user.pk, 'Казань'),
+        )
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(self.stock(product), 98)
+
+    def test_admin_reports_invalid_cancel(self):
+        product = self.products[0]
+        cart_service.add_item(self.cart, product.id, 2)
+        order = place_order(self.user, 'Москва')
+        Order.objects.filter(pk=order.pk).update(status='shipped')
+        admin_user = User.objects.create_superuser('admin', password='pass')
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:api_order_change', args=[order.pk]), {
+            'user': self.user.pk, 'total_price': order.total_price,
+            'status': 'cancelled', 'shipping_address': 'Москва',
+        }, follow=True)
+        self.assertEqual(
+            [m.message for m in response.context['messages'] if m.level_tag == 'error'],
+            [f'Заказ #{order.pk} в статусе "Отправлен" нельзя отменить'],
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'shipped')
+        self.assertEqual(self.stock(product), 98)
+
+
+class StockConcurrencyTests(ImmediateTransactionsMixin, TransactionTestCase):
+    def test_parallel_orders_never_oversell(self):
+        product = Product.objects.create(name='Лайтстик', description='', price=Decimal('3900'), stock=3)
+        workers = 6
+        users = [User.objects.create_user(f'buyer{i}', password='pass') for i in range(workers)]
+        for user in users:
+            cart_service.add_item(cart_service.get_cart(user), product.id, 1)
+        barrier = threading.Barrier(workers)
+        results = []
+
+        def worker(user):
+            try:
+                barrier.wait()
+                place_order(user, 'Москва')
+                results.append(True)
+            except OutOfStock:
+                results.append(False)
+            except Exception as exc:  # pragma: no cover
+                results.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results, key=str), [False] * 3 + [True] * 3)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertFalse(product.in_stock)
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.cart = cart_service.get_cart(self.user)
+        cart_service.add_item(self.cart, self.products[0].id, 2)
+        self.client.force_authenticate(self.user)
+
+    def create_order(self, key):
+        return self.client.post(
+            '/api/orders/', {'shipping_address': 'Москва'}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_returns_original_order(self):
+        first = self.create_order('abc')
+        retry = self.create_order('abc')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_key_is_not_replayed(self):
+        self.create_order('abc')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        cart_service.add_item(self.cart, self.products[1].id)
+        self.assertEqual(self.create_order('abc').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_overlong_key_is_rejected(self):
+        # Обрезка склеила бы ключи с общим префиксом в один заказ
+        prefix = 'k' * IDEMPOTENCY_KEY_MAX_LENGTH
+        self.assertEqual(self.create_order(prefix + 'a').status_code, 400)
+        self.assertEqual(self.create_order(prefix + 'b').status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create_order(prefix).status_code, 201)
+
+    def test_purge_expired_keys(self):
+        self.create_order('abc')
+        self.assertEqual(purge_expired_keys(), 0)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(purge_expired_keys(), 1)
+
+    def test_checkout_form_resubmit(self):
+        self.client.force_login(self.user)
+        key = self.client.get(reverse('checkout')).context['idempotency_key']
+        for _ in range(2):
+            response = self.client.post(reverse('checkout'), {
+                'shipping_address': 'Москва', 'idempotency_key': key,
+            })
+            self.assertRedirects(response, reverse('profile'))
+        self.assertEqual(Order.objects.count(), 1)
+
+
+def make_png(width, height, name='shot.png'):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGBA', (width, height), (40, 120, 100, 200)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=False, IMAGE_DERIVATIVE_WIDTHS=(320, 640, 960))
+class ImageDerivativeTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def create_product(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name='Худи', description='', price=Decimal('5900'), image=image, stock=1,
+            )
+        product.refresh_from_db()
+        return product
+
+    def test_upload_builds_narrower_derivatives(self):
+        product = self.create_product(make_png(800, 400))
+        self.assertTrue(images.is_current(product))
+        self.assertEqual((product.image_derivatives['width'], product.image_derivatives['height']), (800, 400))
+        for fmt in ('webp', 'jpeg'):
+            self.assertEqual(sorted(product.image_derivatives[fmt]), ['320', '640'])
+        self.assertEqual(
+            [width for width, _ in images.derivative_urls(product, 'webp')], [320, 640]
+        )
+
+    def test_serializer_and_template_expose_srcset(self):
+        product = self.create_product(make_png(800, 400))
+        data = self.client.get(f'/api/products/{product.pk}/').data['image_derivatives']
+        self.assertIn('-320w.webp 320w', data['webp']['srcset'])
+        self.assertTrue(data['jpeg']['urls']['640'].startswith('http://testserver/media/'))
+
+        html = Template('{% load product_images %}{% product_image product "card-img-top" %}').render(
+            Context({'product': product})
+        )
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('-640w.jpg 640w', html)
+
+    def test_replaced_image_is_rebuilt(self):
+        product = self.create_product(make_png(800, 400))
+        old = product.image_derivatives
+        product.image = make_png(500, 500, 'other.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertNotEqual(product.image_derivatives['source'], old['source'])
+        self.assertEqual(sorted(product.image_derivatives['webp']), ['320'])
+
+    def test_command_rebuilds_more_images_than_its_window(self):
+        products = [self.create_product(make_png(400, 200, f'p{i}.png')) for i in range(5)]
+        Product.objects.update(image_derivatives={})
+        out = io.StringIO()
+        call_command('build_image_derivatives', '--workers', '1', stdout=out)
+        self.assertIn('Обработано изображений: 5, ошибок: 0', out.getvalue())
+        for product in products:
+            product.refresh_from_db()
+            self.assertTrue(images.is_current(product))
+
+    def test_without_derivatives_falls_back_to_original(self):
+        product = Product.objects.create(name='Худи', description='', price=1, image='products/a.png')
+        self.assertIsNone(self.client.get(f'/api/products/{product.pk}/').data['image_derivatives'])
+        html = Template('{% load product_images %}{% product_image product %}').render(
+            Context({'product': product})
+        )
+        self.assertIn('src="/media/products/a.png"', html)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def test_identical_uploads_share_one_file(self):
+        first = Product.objects.create(name='A', description='', price=1, image=make_png(40, 20, 'a.PNG'))
+        second = Product.objects.create(name='B', description='', price=1, image=make_png(40, 20, 'b.png'))
+        other = Product.objects.create(name='C', description='', price=1, image=make_png(20, 40, 'a.png'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^products/[0-9a-f]{64}\.png$')
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(len(product_image_storage.listdir('products')[1]), 2)
+
+    def test_dedupe_command_merges_files_and_rewrites_paths(self):
+        data = make_png(40, 20).read()
+        names = ['products/shot.png', 'products/shot_AbCdEfG.png']
+        # Старые файлы с суффиксами Django - в обход адресации по содержимому
+        os.makedirs(product_image_storage.path('products'))
+        for name in names:
+            with open(product_image_storage.path(name), 'wb') as target:
+                target.write(data)
+        products = [
+            Product.objects.create(name=name, description='', price=1, image=name) for name in names
+        ]
+        call_command('dedupe_product_images', stdout=io.StringIO())
+
+        canonical = product_image_storage.hashed_name('products/x.png', ContentFile(data))
+        self.assertEqual(product_image_storage.listdir('products')[1], [canonical.split('/')[1]])
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.image.name, canonical)
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=False, IMAGE_DERIVATIVE_WIDTHS=(320,))
+class ProductImportExportTests(TestCase):
+    CSV_HEADER = 'sku,name,description,price,category,stock,image\n'
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(self.workdir, 'media')))
+        self.category = Category.objects.create(name='Одежда', slug='odezhda')
+
+    def write(self, name, content):
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w', encoding='utf-8', newline='') as target:
+            target.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_products', path, '--image-workers', '0', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_upserts_by_sku(self):
+        path = self.write('products.csv', self.CSV_HEADER + (
+            'H-1,Худи,"Теплое худи, оверсайз",4500,odezhda,3,\n'
+            'H-2,Футболка,Хлопок,1900.5,,0,\n'
+            'H-3,Кепка,Хлопок,-1,odezhda,1,\n'
+            'H-4,Шарф,Шерсть,900,unknown,1,\n'
+            ',Без артикула,Описание,100,,1,\n'
+            'H-2,Футболка,Хлопок 100%,1900.50,odezhda,5,\n'
+        ))
+        out, err = self.run_import(path, '--batch-size', '2')
+        self.assertIn('создано 2', out)
+        self.assertIn('ошибок 3', out)
+        self.assertIn('строка 4: price', err)
+        self.assertIn("строка 5: category: нет категории 'unknown'", err)
+
+        hoodie, shirt = Product.objects.get(sku='H-1'), Product.objects.get(sku='H-2')
+        self.assertEqual((hoodie.price, hoodie.stock, hoodie.in_stock), (Decimal('4500'), 3, True))
+        self.assertEqual(hoodie.category, self.category)
+        # Повтор артикула в файле: действует последняя строка
+        self.assertEqual((shirt.description, shirt.stock, shirt.category_id), ('Хлопок 100%', 5, self.category.id))
+        self.assertEqual(self.client.get('/api/products/search/', {'q': 'худи'}).data['results'][0]['sku'], 'H-1')
+        self.assertEqual(
+            set(CatalogChange.objects.filter(model=changes.PRODUCT).values_list('object_id', flat=True)),
+            {hoodie.id, shirt.id},
+        )
+
+        versions = catalog_cache.get_versions([catalog_cache.product_scope(hoodie.id)])
+        path = self.write('update.csv', self.CSV_HEADER + (
+            'H-1,Худи,"Теплое худи, оверсайз",4900,odezhda,0,\n'
+            'H-2,Футболка,Хлопок 100%,1900.50,odezhda,5,\n'
+        ))
+        out, _ = self.run_import(path)
+        self.assertIn('создано 0, обновлено 1, без изменений 1', out)
+        hoodie.refresh_from_db()
+        self.assertEqual((hoodie.price, hoodie.in_stock), (Decimal('4900'), False))
+        self.assertNotEqual(catalog_cache.get_versions([catalog_cache.product_scope(hoodie.id)]), versions)
+
+    def test_export_round_trip(self):
+        for i in range(5):
+            Product.objects.create(
+                sku=f'S-{i}', name=f'Товар {i}', description='Описание\nв две строки', price=Decimal(100 + i),
+                category=self.category if i % 2 else None, stock=i,
+            )
+        for fmt in ('csv', 'jsonl'):
+            path = os.path.join(self.workdir, f'export.{fmt}')
+            call_command('export_products', path, stdout=io.StringIO())
+            out, _ = self.run_import(path)
+            self.assertIn('создано 0, обновлено 0, без изменений 5', out)
+
+        out = io.StringIO()
+        call_command('export_products', '--format', 'jsonl', '--category', 'odezhda', stdout=out, stderr=io.StringIO())
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['sku'] for row in rows], ['S-1', 'S-3'])
+        self.assertEqual(rows[0]['price'], '101.00')
+
+    def test_imports_images(self):
+        images_dir = os.path.join(self.workdir, 'images')
+        os.makedirs(images_dir)
+        with open(os.path.join(images_dir, 'hoodie.png'), 'wb') as target:
+            target.write(make_png(800, 400).read())
+        path = self.write('products.jsonl', '\n'.join([
+            json.dumps({'sku': 'H-1', 'name': 'Худи', 'description': 'Теплое', 'price': 4500, 'image': 'hoodie.png'}),
+            json.dumps({'sku': 'H-2', 'name': 'Кепка', 'description': 'Хлопок', 'price': 900, 'image': 'missing.png'}),
+        ]))
+        out, err = self.run_import(path, '--images-dir', images_dir)
+        self.assertIn('изображений 1, ошибок изображений 1', out)
+        self.assertIn('изображение missing.png', err)
+        product = Product.objects.get(sku='H-1')
+        self.assertRegex(product.image.name, r'^products/[0-9a-f]{64}\.png$')
+        self.assertTrue(images.is_current(product))
+        self.assertEqual(sorted(product.image_derivatives['webp']), ['320'])
+
+        # Повторный импорт того же файла не трогает изображение
+        updated_at = product.updated_at
+        out, _ = self.run_import(path, '--images-dir', images_dir)
+        product.refresh_from_db()
+        self.assertEqual(product.updated_at, updated_at)
+
+    def test_image_paths_stay_inside_images_dir(self):
+        images_dir = os.path.join(self.workdir, 'images')
+        os.makedirs(images_dir)
+        secret = os.path.join(self.workdir, 'secret.png')
+        with open(secret, 'wb') as target:
+            target.write(make_png(100, 100).read())
+        os.symlink(secret, os.path.join(images_dir, 'link.png'))
+        references = [secret, '../secret.png', 'link.png']
+        path = self.write('products.jsonl', '\n'.join(
+            json.dumps({'sku': f'S-{i}', 'name': 'Товар', 'description': 'Описание', 'price': 100, 'image': reference})
+            for i, reference in enumerate(references)
+        ))
+        out, err = self.run_import(path, '--images-dir', images_dir)
+        self.assertIn('изображений 0, ошибок изображений 3', out)
+        self.assertEqual(err.count('путь вне каталога изображений'), 3)
+        self.assertFalse(Product.objects.exclude(image='').exists())
+
+
+class StaticAssetsTests(TestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root, ignore_errors=True)
+        self.enterContext(override_settings(
+            STATIC_ROOT=self.static_root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STORAGES={**settings.STORAGES, 'staticfiles': {
+                'BACKEND': 'shop.assets.CompressedManifestStaticFilesStorage',
+            }},
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def serve(self, path, **environ):
+        from shop.assets import StaticFilesWSGI
+
+        application = StaticFilesWSGI(lambda environ, start_response: 'django', self.static_root)
+        captured = {}
+
+        def start_response(status, headers):
+            captured['status'], captured['headers'] = status, dict(headers)
+
+        body = application({'REQUEST_METHOD': 'GET', 'PATH_INFO': path, **environ}, start_response)
+        if body == 'django':
+            return None, None, body
+        return captured['status'], captured['headers'], b''.join(body)
+
+    def test_static_tag_uses_hashed_names(self):
+        url = static('css/base.css')
+        self.assertRegex(url, r'^/static/css/base\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, url[len('/static/'):] + '.gz')))
+
+    def test_hashed_file_is_immutable_and_compressed(self):
+        url = static('css/base.css')
+        status, headers, body = self.serve(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        with open(os.path.join(self.static_root, 'css', 'base.css'), 'rb') as original:
+            self.assertEqual(gzip.decompress(body), original.read())
+
+        status, headers, _ = self.serve(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=headers['ETag'])
+        self.assertEqual(status, '304 Not Modified')
+
+    def test_plain_names_revalidate_and_other_paths_pass_through(self):
+        status, headers, _ = self.serve('/static/css/base.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(self.serve('/products/')[2], 'django')
+
+
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        category = Category.objects.create(name='Футболки', slug='t-shirts')
+        self.product = Product.objects.create(name='Футболка', price=Decimal('990'), category=category, stock=5)
+
+    @staticmethod
+    def session_writes(queries):
+        return [
+            q['sql'].split()[0] for q in queries
+            if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')
+        ]
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data)
+        return response, self.session_writes(queries)
+
+    def test_unchanged_session_is_not_written(self):
+        for store_class in (SessionStore, CachedSessionStore):
+            with self.subTest(store_class.__module__):
+                store = store_class()
+                store['cart_hint'] = 1
+                store.save()
+
+                store = store_class(store.session_key)
+                store['cart_hint'] = 1
+                with CaptureQueriesContext(connection) as queries:
+                    store.save()
+                self.assertEqual(self.session_writes(queries), [])
+
+                store['cart_hint'] = 2
+                with CaptureQueriesContext(connection) as queries:
+                    store.save()
+                self.assertEqual(self.session_writes(queries), ['UPDATE'])
+                self.assertEqual(store_class(store.session_key)['cart_hint'], 2)
+
+    def test_login_writes_session_once(self):
+        response, writes = self.request('post', '/login/', {'username': 'buyer', 'password': 'pass'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(writes, ['INSERT'])
+        # Сообщение о входе - в cookie, а не в сессии
+        self.assertIn(MESSAGES_COOKIE, response.cookies)
+
+    def test_cart_clicks_do_not_write_session(self):
+        self.client.post('/login/', {'username': 'buyer', 'password': 'pass'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('add_to_cart', args=[self.product.id]), follow=True)
+        self.assertContains(response, 'добавлен в корзину')
+        # Сообщение живет в cookie, сессия не меняется
+        self.assertEqual(self.session_writes(queries), [])
+
+    @override_settings(SESSION_ENGINE='api.cached_sessions', SESSION_CACHE_ALIAS='default')
+    def test_cached_engine_reads_session_from_cache(self):
+        self.client.post('/login/', {'username': 'buyer', 'password': 'pass'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('add_to_cart', args=[self.product.id]), follow=True)
+        self.assertContains(response, 'добавлен в корзину')
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category, self.other, self.products = make_catalog()
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.client = self.client_class(enforce_csrf_checks=True)
+
+    def add(self, product):
+        return self.client.post(reverse('add_to_cart', args=[product.id]))
+
+    def test_guest_cart_lives_in_cookie(self):
+        carts, items = Cart.objects.count(), CartItem.objects.count()
+        with self.assertNumQueries(1):
+            response = self.add(self.products[0])
+        self.assertRedirects(response, reverse('products'), fetch_redirect_response=False)
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.assertEqual((Cart.objects.count(), CartItem.objects.count()), (carts, items))
+
+        response = self.client.get(reverse('cart'))
+        self.assertEqual([(item.product, item.quantity) for item in response.context['cart_items']],
+                         [(self.products[0], 2), (self.products[1], 1)])
+        self.assertEqual(response.context['total'], self.products[0].price * 2 + self.products[1].price)
+
+        # Подделанная cookie - пустая корзина
+        self.client.cookies[guest_cart.get_cookie_name()] = f'{self.products[2].id}:5'
+        self.assertEqual(self.client.get(reverse('cart')).context['cart_items'], [])
+
+    def test_cross_site_add_is_rejected(self):
+        url = reverse('add_to_cart', args=[self.products[0].id])
+        for headers in (
+            {'HTTP_SEC_FETCH_SITE': 'cross-site'},
+            {'HTTP_SEC_FETCH_SITE': 'same-site'},
+            {'HTTP_ORIGIN': 'https://attacker.example'},
+            {'HTTP_ORIGIN': 'null'},
+            {'HTTP_REFERER': 'https://attacker.example/page'},
+        ):
+            with self.subTest(headers):
+                for method in (self.client.post, self.client.get):
+                    response = method(url, **headers)
+                    self.assertEqual(response.status_code, 403)
+                    self.assertNotIn(guest_cart.get_cookie_name(), response.cookies)
+
+        for headers in (
+            {'HTTP_SEC_FETCH_SITE': 'same-origin'},
+            {'HTTP_ORIGIN': 'http://testserver'},
+            {'HTTP_REFERER': 'http://testserver/products/'},
+        ):
+            with self.subTest(headers):
+                self.assertEqual(self.client.post(url, **headers).status_code, 302)
+        self.assertEqual(guest_cart.load(self.client.get(reverse('cart')).wsgi_request), {self.products[0].id: 3})
+
+    def test_catalog_page_stays_cached_for_guests(self):
+        self.assertEqual(self.client.get('/products/')['X-Page-Cache'], 'miss')
+        self.add(self.products[0])
+        self.client.cookies.pop('messages', None)
+        response = self.client.get('/products/')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+    def test_login_merges_with_single_upsert(self):
+        cart_service.add_item(cart_service.get_cart(self.user), self.products[0].id, 1)
+        self.add(self.products[0])
+        self.add(self.products[0])
+        self.add(self.products[1])
+        client = self.client_class()
+        client.cookies = self.client.cookies
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('login'), {'username': 'buyer', 'password': 'pass'})
+        self.assertEqual(sum(q['sql'].startswith('INSERT INTO "api_cartitem"') for q in queries), 1)
+        self.assertEqual(response.cookies[guest_cart.get_cookie_name()].value, '')
+        quantities = dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.products[0].id: 3, self.products[1].id: 1})
+
+    def test_token_login_merges(self):
+        self.add(self.products[2])
+        response = self.client.post('/api/login/', {'username': 'buyer', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            [(self.products[2].id, 1)],
+        )
+
+
+class CartLifecycleTests(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.category, self.other, self.products = make_catalog()
+
+    def test_registration_creates_no_cart(self):
+        response = self.client.post('/api/register/', {'username': 'buyer', 'password': 'secret-pass'})
+        self.assertEqual(response.status_code, 201)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {response.data["token"]}')
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.get('/api/cart/')
+        self.assertEqual((response.data['items'], response.data['item_count']), ([], 0))
+        self.assertFalse(Cart.objects.exists())
+
+        for _ in range(2):
+            self.client.post('/api/cart/add/', {'product_id': self.products[0].id})
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(self.client.get('/api/cart/').data['item_count'], 2)
+
+    def test_cart_actions_meet_query_budget(self):
+        user = User.objects.create_user('buyer')
+        self.client.force_authenticate(user)
+        budget = CartViewSet.query_budget
+        # Первое добавление создает корзину и стоит столько же, сколько следующие
+        for product in self.products[:4]:
+            with self.assertMaxQueries(budget['add_item']) as counter:
+                response = self.client.post('/api/cart/add/', {'product_id': product.id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(counter), budget['add_item'])
+        self.assertEqual(response.data['item_count'], 4)
+
+        operations = [
+            {'op': 'add', 'product_id': self.products[4].id, 'quantity': 1},
+            {'op': 'set', 'product_id': self.products[0].id, 'quantity': 3},
+            {'op': 'remove', 'product_id': self.products[1].id},
+        ]
+        with self.assertMaxQueries(budget['batch']) as counter:
+            response = self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+        self.assertEqual(len(counter), budget['batch'])
+        self.assertEqual(response.data['item_count'], 6)
+
+        with self.assertMaxQueries(budget['list']) as counter:
+            self.client.get('/api/cart/')
+        self.assertEqual(len(counter), budget['list'])
+
+        item = CartItem.objects.filter(cart__user=user).first()
+        with self.assertMaxQueries(budget['remove_item']) as counter:
+            response = self.client.delete('/api/cart/remove/', {'item_id': item.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(counter), budget['remove_item'])
+
+    def test_first_batch_meets_query_budget(self):
+        self.client.force_authenticate(User.objects.create_user('buyer'))
+        operations = [{'op': 'add', 'product_id': product.id} for product in self.products[:3]]
+        with self.assertMaxQueries(CartViewSet.query_budget['batch']):
+            response = self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+        self.assertEqual(response.data['item_count'], 3)
+
+    def test_prune_removes_stale_items_and_empty_carts(self):
+        users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        fresh, stale, empty = (cart_service.get_cart(user) for user in users)
+        cart_service.add_item(fresh, self.products[0].id)
+        cart_service.add_item(stale, self.products[0].id)
+        cart_service.add_item(stale, self.products[1].id)
+        long_ago = timezone.now() - timedelta(days=365)
+        CartItem.objects.filter(cart=stale).update(updated_at=long_ago)
+        Cart.objects.filter(pk__in=[stale.pk, empty.pk]).update(updated_at=long_ago)
+
+        # Изменение количества обновляет updated_at - строка больше не брошенная
+        cart_service.add_item(stale, self.products[1].id)
+        out = io.StringIO()
+        call_command('prune_carts', '--batch-size', '1', stdout=out)
+        self.assertIn('Удалено товаров из корзин: 1, пустых корзин: 1', out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {fresh.pk, stale.pk})
+        self.assertEqual(list(stale.items.values_list('product_id', flat=True)), [self.products[1].id])
+
+        CartItem.objects.filter(cart=stale).update(updated_at=long_ago)
+        stats = cart_service.prune_carts()
+        self.assertEqual((stats.items, stats.carts), (1, 1))
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+    def test_prune_spares_cart_being_added_to(self):
+        user = User.objects.create_user('buyer')
+        Cart.objects.create(user=user)
+        Cart.objects.filter(user=user).update(updated_at=timezone.now() - timedelta(days=1))
+
+        # Корзину получил запрос на добавление, prune_carts() успел раньше INSERT строки
+        cart = cart_service.get_cart(user)
+        self.assertEqual(cart_service.prune_carts().carts, 0)
+        self.assertEqual(cart_service.add_item(cart, self.products[0].id), 1)
+        self.assertEqual(Cart.objects.get(user=user).items.count(), 1)
+
+class QueryPlanTests(TestCase):
+    def captured_sql(self, queryset):
+        with CaptureQueriesContext(connection) as queries:
+            list(queryset)
+        return queries[-1]['sql']
+
+    def test_plan_issues(self):
+        kinds = [issue.kind for issue in queryplan.plan_issues(self.captured_sql(Product.objects.order_by('name')))]
+        self.assertEqual(kinds, ['temp-b-tree'])
+        kinds = [issue.kind for issue in queryplan.plan_issues(self.captured_sql(Product.objects.filter(name='x')))]
+        self.assertEqual(kinds, ['scan'])
+        self.assertEqual(queryplan.plan_issues(self.captured_sql(Product.objects.order_by('-price', '-id'))), [])
+
+    def test_build_path(self):
+        samples = {'product_id': 5, 'pk': {'order': 7}}
+        self.assertEqual(queryplan.build_path('cart/add/<int:product_id>/', 'add_to_cart', samples), '/cart/add/5/')
+        self.assertEqual(queryplan.build_path('api/^orders/(?P<pk>[^/.]+)/$', 'order-detail', samples), '/api/orders/7/')
+        self.assertIsNone(queryplan.build_path('api/^orders\\.(?P<format>[a-z0-9]+)/?$', 'order-list', samples))
+        self.assertIsNone(queryplan.build_path('orders/<int:order_id>/', 'order_detail', samples))
+
+    @override_settings(ANONYMOUS_PAGE_CACHE=False, PRODUCT_CARD_CACHE=False)
+    def test_hot_pages_use_indexes(self):
+        catalog_cache.get_cache().clear()
+        category, _, products = make_catalog()
+        user = User.objects.create_user('buyer', password='pass')
+        cart_service.add_item(cart_service.get_cart(user), products[0].id)
+        place_order(user, 'Казань')
+        self.client.force_login(user)
+        sorts = [{}, {'sort': 'price_asc'}, {'sort': 'price_desc'}, {'sort': 'new'}]
+        catalog = sorts + [dict(params, category=category.id) for params in sorts]
+        paths = ['/', '/products/', '/api/products/', '/cart/', '/profile/']
+        reports = queryplan.audit(self.client, paths, {'/products/': catalog, '/api/products/': catalog})
+        self.assertEqual(len(reports), 19)
+        self.assertEqual([(r.url, r.issues) for r in reports if r.issues], [])
+        self.assertTrue(all(r.status == 200 and r.queries for r in reports))
+
+    def test_command_requires_sqlite(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            with self.assertRaisesMessage(CommandError, 'только для SQLite'):
+                call_command('explain_queries', stdout=io.StringIO())
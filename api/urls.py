@@ -17,7 +17,9 @@ urlpatterns = [
     path('cart/', views.CartViewSet.as_view({'get': 'list'}), name='cart'),
     path('cart/add/', views.CartViewSet.as_view({'post': 'add_item'}), name='cart-add'),
     path('cart/remove/', views.CartViewSet.as_view({'delete': 'remove_item'}), name='cart-remove'),
+    path('cart/batch/', views.CartViewSet.as_view({'post': 'batch'}), name='cart-batch'),
     
+    path('cache/stats/', views.cache_stats_view, name='cache-stats'),
     path('test/', views.test_view, name='test'),
     
     path('', include(router.urls)),
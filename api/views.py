@@ -1,16 +1,32 @@
 # api/views.py
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from .models import Category, Product, Cart, CartItem, Favorite, Order
+from .pagination import InvalidCategory, ProductCursorPagination, filter_products, get_sort
+from . import authentication
+from . import search
+from . import guest_cart
+from . import cache as catalog_cache
+from . import changes as change_log
+from .querybudget import query_budget
+from .renderers import streaming_json_response
+from .cart import get_cart_with_items
+from . import cart as cart_service
+from .checkout import IDEMPOTENCY_KEY_MAX_LENGTH, EmptyCartError, InvalidIdempotencyKey, place_order
+from .inventory import OutOfStock, cancel_order
 from .serializers import (
     UserSerializer, CategorySerializer, ProductSerializer, 
     ProductCreateSerializer, CartSerializer, CartItemSerializer,
-    FavoriteSerializer, OrderSerializer
+    CartBatchSerializer, FavoriteSerializer, OrderSerializer,
+    ProductRowSerializer, FIELDS_PARAM, EXCLUDE_PARAM
 )
 
 
@@ -25,7 +41,6 @@ class RegisterViewSet(viewsets.ViewSet):
                 email=serializer.validated_data.get('email', ''),
                 password=request.data.get('password', '')
             )
-            Cart.objects.create(user=user)
             token, created = Token.objects.get_or_create(user=user)
             return Response({
                 'token': token.key,
@@ -35,13 +50,64 @@ class RegisterViewSet(viewsets.ViewSet):
 
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        token = Token.objects.get(key=response.data['token'])
-        user = token.user
-        return Response({
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        if authentication.is_expired(token):
+            # Просроченный токен заменяется новым, старый ключ убирается из кэшей
+            old_key = token.key
+            token.delete()
+            token = Token.objects.create(user=user)
+            authentication.forget(old_key)
+        # Первый запрос с новым токеном не пойдет в БД за аутентификацией
+        token.user = user
+        authentication.remember(token)
+        guest_cart.merge(request, user)
+        return guest_cart.forget(request, Response({
             'token': token.key,
             'user': UserSerializer(user).data
-        })
+        }))
+
+def sparse_params(request):
+    """?fields= / ?exclude= для ключа кэша: от них зависит ответ"""
+    return tuple(request.query_params.get(name) for name in (FIELDS_PARAM, EXCLUDE_PARAM))
+
+def catalog_response(request, name, scopes, parts, producer):
+    """Ответ из кэша каталога с ETag и Last-Modified.
+
+    Валидаторы строятся по версиям областей кэша, поэтому на неизменившийся
+    каталог клиент получает 304 без запросов к БД и сериализации.
+    """
+    versions = catalog_cache.get_versions(scopes)
+    etag, last_modified = catalog_cache.validators(
+        name, versions, (parts, request.accepted_renderer.format)
+    )
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        return not_modified
+    response = Response(catalog_cache.get_or_set(name, scopes, parts, producer, versions=versions))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def change_feed(viewset, request, kind):
+    """Пачка журнала изменений после ?since=: текущие версии и id удаленных"""
+    try:
+        since = change_log.parse_cursor(request.query_params.get('since'))
+    except change_log.InvalidCursor:
+        raise ValidationError({'since': 'Неверный курсор'})
+    cursor, has_more, upserts, deletes = change_log.read(
+        kind, since, change_log.get_batch_size(request.query_params.get('limit'))
+    )
+    objects = viewset.get_queryset().filter(pk__in=upserts).order_by('pk') if upserts else []
+    # Объект, удаленный уже после этой пачки, придет удалением в следующей
+    return Response({
+        'cursor': cursor,
+        'has_more': has_more,
+        'upserts': viewset.get_serializer(objects, many=True).data,
+        'deletes': deletes,
+    })
 
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
@@ -52,10 +118,46 @@ class CategoryViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return super().get_permissions()
+    
+    def list(self, request, *args, **kwargs):
+        return catalog_response(
+            request, 'api-category-list', [catalog_cache.CATEGORIES], sparse_params(request),
+            lambda: super(CategoryViewSet, self).list(request, *args, **kwargs).data,
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(
+            request, 'api-category', [catalog_cache.CATEGORIES], (kwargs['pk'], sparse_params(request)),
+            lambda: super(CategoryViewSet, self).retrieve(request, *args, **kwargs).data,
+        )
+    
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Изменения категорий после ?since=<курсор> (api/changes.py)"""
+        return change_feed(self, request, change_log.CATEGORY)
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = ProductCursorPagination
+    query_budget = {'list': 3, 'retrieve': 3, 'search': 3, 'changes': 2}
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = self.filter_catalog(queryset)
+        return queryset
+    
+    def filter_catalog(self, queryset):
+        """?category= и ?sort= списка и выгрузки"""
+        try:
+            return filter_products(
+                queryset,
+                category_id=self.request.query_params.get('category'),
+                sort=self.request.query_params.get('sort'),
+            )
+        except InvalidCategory:
+            raise ValidationError({'category': 'Ожидается id категории'})
     
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -67,41 +169,123 @@ class ProductViewSet(viewsets.ModelViewSet):
             return [permissions.IsAdminUser()]
         return super().get_permissions()
     
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        parts = (
+            request.build_absolute_uri('/'),
+            tuple((name, params.get(name)) for name in ('category', 'sort', 'cursor', 'page_size', 'count')),
+            sparse_params(request),
+        )
+        return catalog_response(
+            request, 'api-product-list', [catalog_cache.listing_scope(params.get('category'))], parts,
+            lambda: self.list_data(request),
+        )
+    
+    def list_data(self, request):
+        """Страница списка через быстрый путь: .values() и ProductRowSerializer"""
+        serializer = ProductRowSerializer(request)
+        key, _ = get_sort(request.query_params.get('sort'))
+        # id и ключ сортировки нужны пагинатору для курсоров
+        columns = dict.fromkeys([*serializer.columns(), 'id', key])
+        rows = self.paginate_queryset(self.filter_queryset(self.get_queryset()).values(*columns))
+        return self.paginator.get_paginated_data(serializer.serialize(rows))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(
+            request, 'api-product', [catalog_cache.product_scope(kwargs['pk'])],
+            (request.build_absolute_uri('/'), sparse_params(request)),
+            lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs).data,
+        )
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Весь каталог одним потоковым JSON-массивом (?category=, ?sort=, ?fields=)"""
+        serializer = ProductRowSerializer(request)
+        queryset = self.filter_catalog(self.get_queryset())
+        return streaming_json_response(queryset.values(*serializer.columns()), serializer.to_representation)
+    
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Изменения товаров после ?since=<курсор>; ?limit= - размер пачки"""
+        return change_feed(self, request, change_log.PRODUCT)
+    
     @action(detail=False, methods=['get'])
     def search(self, request):
+        """Поиск по названию и описанию с ранжированием.
+
+        Параметры: ?q=, ?page= (с 1), ?page_size=.
+        """
         query = request.query_params.get('q', '')
-        products = Product.objects.filter(name__icontains=query)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        paginator = self.paginator
+        page_size = paginator.get_page_size(request)
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+        except ValueError:
+            page = 1
+        
+        serializer = ProductRowSerializer(request)
+        products = search.search_products(
+            self.get_queryset().values(*dict.fromkeys([*serializer.columns(), 'id'])), query,
+            limit=page_size + 1, offset=(page - 1) * page_size,
+        )
+        has_more = len(products) > page_size
+        return Response({
+            'page': page,
+            'next_page': page + 1 if has_more else None,
+            'results': serializer.serialize(products[:page_size]),
+        })
 
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    # Измеренные значения; первое добавление стоит столько же, сколько следующие:
+    # INSERT корзины окупается пропуском UPDATE в пустой корзине (Cart.is_new).
+    # Ответ строится из уже полученной корзины (cart_service.with_items)
+    query_budget = {'list': 3, 'add_item': 10, 'remove_item': 5, 'batch': 10}
     
     def list(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        try:
+            cart = get_cart_with_items(request.user)
+        except Cart.DoesNotExist:
+            # Пустая корзина без строки в БД; get_cart() создаст ее при добавлении товара
+            cart = Cart(user=request.user)
+        serializer = CartSerializer(cart, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
         product_id = request.data.get('product_id')
-        quantity = request.data.get('quantity', 1)
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            return Response({'detail': 'Количество должно быть положительным числом'},
+                           status=status.HTTP_400_BAD_REQUEST)
         
         product = get_object_or_404(Product, id=product_id)
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart = cart_service.get_cart(request.user)
+        cart_service.add_item(cart, product.id, quantity, return_quantity=False)
         
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart, 
-            product=product,
-            defaults={'quantity': quantity}
-        )
+        serializer = CartSerializer(cart_service.with_items(cart), context={'request': request})
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Пакет операций над корзиной за один запрос.
+
+        {"operations": [{"op": "add" | "set" | "remove", "product_id": 1, "quantity": 2}, ...]}
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        cart = cart_service.get_cart(request.user)
+        try:
+            cart_service.apply_operations(cart, serializer.validated_data['operations'])
+        except cart_service.UnknownProducts as exc:
+            return Response({'detail': 'Товары не найдены', 'product_ids': exc.product_ids},
+                           status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return Response(CartSerializer(cart_service.with_items(cart), context={'request': request}).data)
     
     @action(detail=False, methods=['delete'])
     def remove_item(self, request):
@@ -110,15 +294,16 @@ class CartViewSet(viewsets.ViewSet):
         item = get_object_or_404(CartItem, id=item_id, cart=cart)
         item.delete()
         
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart_service.with_items(cart), context={'request': request})
         return Response(serializer.data)
 
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'list': 3}
     
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        return Favorite.objects.filter(user=self.request.user).select_related('product__category')
     
     def create(self, request):
         product_id = request.data.get('product_id')
@@ -138,31 +323,46 @@ class FavoriteViewSet(viewsets.ModelViewSet):
 class OrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Без DELETE: удаление заказа не вернуло бы товар на склад, отмена - action cancel
+    http_method_names = ['get', 'post', 'put', 'patch', 'head', 'options']
     
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user)
     
     def create(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
-        cart_items = cart.items.all()
-        
-        if not cart_items:
+        try:
+            order = place_order(
+                request.user,
+                request.data.get('shipping_address', ''),
+                idempotency_key=request.headers.get('Idempotency-Key'),
+            )
+        except EmptyCartError:
             return Response({'detail': 'Корзина пуста'}, 
                            status=status.HTTP_400_BAD_REQUEST)
-        
-        total_price = sum(item.product.price * item.quantity 
-                         for item in cart_items)
-        
-        order = Order.objects.create(
-            user=request.user,
-            total_price=total_price,
-            shipping_address=request.data.get('shipping_address', '')
-        )
-
-        cart.items.all().delete()
+        except InvalidIdempotencyKey:
+            return Response({'detail': f'Idempotency-Key длиннее {IDEMPOTENCY_KEY_MAX_LENGTH} символов'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        except OutOfStock as exc:
+            return Response({'detail': 'Недостаточно товара на складе', 'product_ids': exc.product_ids},
+                           status=status.HTTP_409_CONFLICT)
         
         serializer = self.get_serializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        headers = {'Idempotent-Replayed': 'true'} if order.replayed else {}
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        order = self.get_object()
+        if not cancel_order(order):
+            return Response({'detail': 'Заказ нельзя отменить'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(order).data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats_view(request):
+    """Счетчики попаданий/промахов кэша каталога (в текущем процессе)"""
+    return Response(catalog_cache.stats.as_dict())
 
 def test_view(request):
     from django.http import JsonResponse
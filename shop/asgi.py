@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_asgi_application()
+
+if not settings.DEBUG:
+    # Статика из STATIC_ROOT (после collectstatic) отдается до Django
+    from shop.assets import StaticFilesASGI
+
+    application = StaticFilesASGI(application)
@@ -0,0 +1,245 @@
+# shop/assets.py
+"""Статические файлы для продакшена.
+
+collectstatic с CompressedManifestStaticFilesStorage кладет в STATIC_ROOT
+копии с хэшем содержимого в имени (css/base.1a2b3c4d5e6f.css), manifest
+staticfiles.json и сжатые варианты .gz/.br; {% static %} берет имена из
+manifest. StaticFilesWSGI / StaticFilesASGI отдают STATIC_ROOT раньше Django:
+файлы с хэшем - с Cache-Control: immutable на год, сжатый вариант выбирается
+по Accept-Encoding. brotli - необязательная зависимость.
+"""
+import asyncio
+import gzip
+import json
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico',
+    '.ttf', '.otf', '.eot', '.webmanifest',
+}
+# Меньше этого размера сжатие не окупает лишний заголовок
+MIN_COMPRESS_SIZE = 256
+# Сжатый вариант сохраняется, только если он заметно меньше оригинала
+MAX_COMPRESS_RATIO = 0.9
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# Порядок предпочтения кодировок и расширения файлов с ними
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compress(data):
+    """Сжатые варианты содержимого: {'.gz': bytes, '.br': bytes}"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {
+        suffix: compressed for suffix, compressed in variants.items()
+        if len(compressed) <= len(data) * MAX_COMPRESS_RATIO
+    }
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest-хранилище, дополнительно сохраняющее .gz/.br рядом с файлами"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = self.path(name)
+            with open(path, 'rb') as source:
+                data = source.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            for suffix, compressed in compress(data).items():
+                with open(path + suffix, 'wb') as target:
+                    target.write(compressed)
+
+
+@dataclass
+class StaticFile:
+    path: str
+    size: int
+    etag: str
+    last_modified: str
+    content_type: str
+    cache_control: str
+    # кодировка -> (путь, размер, etag)
+    encodings: dict = field(default_factory=dict)
+
+
+@dataclass
+class StaticResponse:
+    status: str
+    headers: list
+    path: str = None
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, f'"{int(stat.st_mtime):x}-{stat.st_size:x}"', stat.st_mtime
+
+
+def _accepted(header):
+    """Кодировки из Accept-Encoding с ненулевым q"""
+    accepted = set()
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFiles:
+    """Индекс STATIC_ROOT, построенный один раз при старте процесса"""
+
+    def __init__(self, root=None, prefix=None):
+        self.root = str(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = self.scan()
+
+    def _hashed_names(self):
+        try:
+            with open(os.path.join(self.root, ManifestStaticFilesStorage.manifest_name)) as manifest:
+                return set(json.load(manifest).get('paths', {}).values())
+        except (OSError, ValueError):
+            return set()
+
+    def scan(self):
+        files = {}
+        if not os.path.isdir(self.root):
+            return files
+        hashed = self._hashed_names()
+        suffixes = {suffix for _, suffix in ENCODINGS}
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if os.path.splitext(filename)[1] in suffixes:
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                size, etag, mtime = _stat(path)
+                content_type, _ = mimetypes.guess_type(filename)
+                if content_type and content_type.startswith('text/'):
+                    content_type += '; charset=utf-8'
+                static_file = StaticFile(
+                    path=path, size=size, etag=etag,
+                    last_modified=formatdate(mtime, usegmt=True),
+                    content_type=content_type or 'application/octet-stream',
+                    cache_control=IMMUTABLE if name in hashed else REVALIDATE,
+                )
+                for coding, suffix in ENCODINGS:
+                    if os.path.exists(path + suffix):
+                        encoded_size, encoded_etag, _ = _stat(path + suffix)
+                        static_file.encodings[coding] = (path + suffix, encoded_size, encoded_etag)
+                files[self.prefix + name] = static_file
+        return files
+
+    def lookup(self, method, path, accept_encoding='', if_none_match=None):
+        """StaticResponse для запроса или None, если это не статический файл"""
+        if method not in ('GET', 'HEAD'):
+            return None
+        static_file = self.files.get(path)
+        if static_file is None:
+            return None
+
+        file_path, size, etag = static_file.path, static_file.size, static_file.etag
+        headers = [
+            ('Content-Type', static_file.content_type),
+            ('Cache-Control', static_file.cache_control),
+            ('Last-Modified', static_file.last_modified),
+        ]
+        if static_file.encodings:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accepted = _accepted(accept_encoding)
+            for coding, _ in ENCODINGS:
+                if coding in accepted and coding in static_file.encodings:
+                    file_path, size, etag = static_file.encodings[coding]
+                    headers.append(('Content-Encoding', coding))
+                    break
+        headers.append(('ETag', etag))
+
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(',')):
+            return StaticResponse('304 Not Modified', headers)
+        headers.append(('Content-Length', str(size)))
+        return StaticResponse('200 OK', headers, None if method == 'HEAD' else file_path)
+
+
+class StaticFilesWSGI:
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.static_files = StaticFiles(root, prefix)
+
+    def __call__(self, environ, start_response):
+        # PATH_INFO в WSGI - UTF-8, декодированный как latin-1
+        path = environ.get('PATH_INFO', '').encode('iso-8859-1').decode('utf-8', 'replace')
+        response = self.static_files.lookup(
+            environ['REQUEST_METHOD'], path,
+            environ.get('HTTP_ACCEPT_ENCODING', ''), environ.get('HTTP_IF_NONE_MATCH'),
+        )
+        if response is None:
+            return self.application(environ, start_response)
+        start_response(response.status, response.headers)
+        if response.path is None:
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(response.path, 'rb'), CHUNK_SIZE)
+
+
+class StaticFilesASGI:
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.static_files = StaticFiles(root, prefix)
+
+    async def __call__(self, scope, receive, send):
+        response = None
+        if scope['type'] == 'http':
+            headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                       for name, value in scope['headers']}
+            response = self.static_files.lookup(
+                scope['method'], scope['path'],
+                headers.get('accept-encoding', ''), headers.get('if-none-match'),
+            )
+        if response is None:
+            return await self.application(scope, receive, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(response.status.split()[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers],
+        })
+        if response.path is None:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        with open(response.path, 'rb') as source:
+            while True:
+                chunk = await asyncio.to_thread(source.read, CHUNK_SIZE)
+                more = len(chunk) == CHUNK_SIZE
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+                if not more:
+                    break
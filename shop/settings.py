@@ -71,9 +71,72 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Ждать освобождения блокировки вместо "database is locked"
+            'timeout': 20,
+            # IMMEDIATE - блокировка на запись с начала каждой транзакции (в том
+            # числе только читающей): параллельные оформления заказов не упираются в
+            # "database is locked" при повышении блокировки, но все atomic() идут по
+            # очереди. По умолчанию - режим SQLite (DEFERRED)
+            'transaction_mode': os.environ.get('SQLITE_TRANSACTION_MODE') or None,
+        },
+        # Тестовая база в файле: тесты на конкурентный доступ работают из потоков
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Кэш. Бэкенд кэша каталога задается через окружение, например
+# CATALOG_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# CATALOG_CACHE_LOCATION=/var/tmp/shop_catalog_cache
+# В production кэш каталога должен быть общим для всех процессов: версии
+# сброса кэша в LocMemCache видит только один процесс, остальные отдают
+# устаревшие страницы и ETag. manage.py check --deploy без DEBUG считает
+# LocMemCache ошибкой (api/checks.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': os.environ.get('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 300  # секунд
+# HTML карточек товаров (api/templatetags/product_cards.py); ключ меняется
+# вместе с товаром, поэтому срок жизни может быть долгим
+PRODUCT_CARD_CACHE = True
+PRODUCT_CARD_CACHE_TIMEOUT = 24 * 60 * 60  # секунд
+# Целые страницы каталога для анонимных посетителей (api/pagecache.py)
+ANONYMOUS_PAGE_CACHE = True
+# Размер пачки ленты изменений каталога (api/changes.py)
+CHANGE_FEED_BATCH_SIZE = 500
+
+# Кэш аутентификации по токену (api/authentication.py)
+TOKEN_AUTH_CACHE_ALIAS = 'default'
+TOKEN_AUTH_CACHE_TIMEOUT = 300  # секунд
+TOKEN_AUTH_LOCAL_CACHE_SIZE = 1024
+# Сколько LRU процесса может не знать об отзыве токена в другом процессе
+TOKEN_AUTH_LOCAL_TIMEOUT = 30  # секунд
+# Срок жизни токена от создания; None - бессрочно
+TOKEN_EXPIRY = None
+
+# Корзина гостя в подписанной cookie (api/guest_cart.py)
+GUEST_CART_COOKIE_NAME = 'cart'
+GUEST_CART_COOKIE_AGE = 30 * 24 * 60 * 60  # секунд
+
+# Очистка корзин (manage.py prune_carts): товары, не менявшиеся дольше
+# CART_ITEM_TTL, и пустые корзины старше CART_EMPTY_TTL
+CART_ITEM_TTL = 90 * 24 * 60 * 60  # секунд
+CART_EMPTY_TTL = 60 * 60  # секунд
+
+# Время жизни ключей идемпотентности оформления заказа
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # секунд
+
 # Валидация паролей (можно упростить для разработки)
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -106,10 +169,32 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # для продакшена
 
+# Без DEBUG collectstatic добавляет хэш в имена файлов, пишет manifest и
+# сжатые .gz/.br копии, а shop/wsgi.py и shop/asgi.py отдают их с
+# Cache-Control: immutable (shop/assets.py)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'shop.assets.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
 # Медиа файлы
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Уменьшенные копии изображений товаров (api/images.py)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 960)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_PROCESSING_WORKERS = 2
+# False - обработка прямо в запросе (удобно для тестов и отладки)
+IMAGE_PROCESSING_ASYNC = True
+
 # CORS настройки
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Разрешить все в режиме разработки
 CORS_ALLOWED_ORIGINS = [
@@ -124,12 +209,17 @@ CORS_ALLOWED_ORIGINS = [
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',  # Добавьте для web интерфейса
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
-    ]
+    ],
+    # orjson, если установлен; иначе - обычный JSONRenderer (api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -142,6 +232,25 @@ LOGOUT_REDIRECT_URL = '/'  # Перенаправление после выхо
 # Настройки сессии (для разработки)
 SESSION_COOKIE_SECURE = False  # True для production с HTTPS
 CSRF_COOKIE_SECURE = False     # True для production с HTTPS
+# Сессия в БД пишется только при изменении содержимого (api/sessions.py).
+# Чтение сессий из кэша включается общим для всех процессов бэкендом, например
+# SESSION_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# SESSION_CACHE_LOCATION=redis://127.0.0.1:6379/1
+# Локальный кэш процесса для этого не подходит: выход очистил бы сессию
+# только в одном процессе (api/cached_sessions.py)
+if os.environ.get('SESSION_CACHE_BACKEND'):
+    CACHES['sessions'] = {
+        'BACKEND': os.environ['SESSION_CACHE_BACKEND'],
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', ''),
+    }
+    SESSION_ENGINE = 'api.cached_sessions'
+    SESSION_CACHE_ALIAS = 'sessions'
+else:
+    SESSION_ENGINE = 'api.sessions'
+SESSION_SAVE_EVERY_REQUEST = False
+# Флеш-сообщения в подписанной cookie 'messages', а не в сессии: сообщение
+# после клика по корзине не пишет в django_session (см. api/pagecache.py)
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
 
 # Для отладки
 if DEBUG:
@@ -150,4 +259,8 @@ if DEBUG:
     # Добавляем внутренний IP
     import socket
     hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
-    INTERNAL_IPS = [ip[:-1] + '1' for ip in ips] + ['127.0.0.1', '10.0.2.2']
\ No newline at end of file
+    INTERNAL_IPS = [ip[:-1] + '1' for ip in ips] + ['127.0.0.1', '10.0.2.2']
+    # Проверка бюджета SQL-запросов на view (api/querybudget.py):
+    # 'log' - предупреждение в лог, 'raise' - ошибка
+    MIDDLEWARE.insert(0, 'api.querybudget.QueryBudgetMiddleware')
+    QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'log')
\ No newline at end of file
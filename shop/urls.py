@@ -1,11 +1,14 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # API выше страниц: при совпадении имен ('cart', 'login', 'register')
+    # reverse() и {% url %} берут последний шаблон, т.е. страницы магазина
+    path('api/', include('api.urls')),
     
     path('', views.home_view, name='home'),
     path('products/', views.products_view, name='products'),
@@ -1,78 +1,105 @@
+import uuid
+from urllib.parse import urlparse
+
+from django.http import HttpResponseForbidden
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout as auth_logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 from .forms import RegisterForm, UserUpdateForm, PasswordChangeFormCustom
-from api.models import Product, Category, Cart, CartItem, Order, OrderItem
+from api.models import Product, Category, Cart, CartItem, Order
+from api.pagination import KeysetPaginator, InvalidCategory, InvalidCursor, filter_products, page_querystring
+from api import cache as catalog_cache
+from api.querybudget import query_budget
+from api.pagecache import anonymous_page_cache
+from api.cart import cart_summary
+from api import cart as cart_service
+from api import guest_cart
+from api.checkout import EmptyCartError, InvalidIdempotencyKey, place_order
+from api.inventory import OutOfStock
+
 
+def _cached_categories():
+    return catalog_cache.get_or_set(
+        'category-list', [catalog_cache.CATEGORIES], (),
+        lambda: list(Category.objects.all()),
+    )
+
+@query_budget(4)
+@anonymous_page_cache('home', scopes=lambda query: [catalog_cache.PRODUCTS, catalog_cache.CATEGORIES])
 def home_view(request):
     """Главная страница"""
-    latest_products = Product.objects.all().order_by('-created_at')[:6]
-    categories = Category.objects.all()
+    latest_products = catalog_cache.get_or_set(
+        'home-latest', [catalog_cache.PRODUCTS], (),
+        lambda: list(Product.objects.select_related('category').order_by('-created_at')[:6]),
+    )
+    categories = _cached_categories()
     return render(request, 'shop/index.html', {
         'latest_products': latest_products,
         'categories': categories,
     })
 
+@query_budget(4)
+@anonymous_page_cache(
+    'products', params=('category', 'sort', 'cursor'),
+    scopes=lambda query: [catalog_cache.listing_scope(query.get('category')), catalog_cache.CATEGORIES],
+)
 def products_view(request):
     """Страница всех товаров"""
-    all_products = Product.objects.all()
-    categories = Category.objects.all()
+    categories = _cached_categories()
     
     category_id = request.GET.get('category')
-    if category_id:
-        all_products = all_products.filter(category_id=category_id)
-    
     sort = request.GET.get('sort')
-    if sort == 'price_asc':
-        all_products = all_products.order_by('price')
-    elif sort == 'price_desc':
-        all_products = all_products.order_by('-price')
-    elif sort == 'new':
-        all_products = all_products.order_by('-created_at')
+    cursor = request.GET.get('cursor')
+    paginator = KeysetPaginator.for_sort(sort)
+    try:
+        all_products = filter_products(
+            Product.objects.select_related('category'), category_id=category_id, sort=sort
+        )
+        page = catalog_cache.get_or_set(
+            'product-page', [catalog_cache.listing_scope(category_id)],
+            (category_id, sort, cursor),
+            lambda: paginator.paginate(all_products, cursor=cursor),
+        )
+    except (InvalidCursor, InvalidCategory):
+        return redirect(reverse('products'))
     
     return render(request, 'shop/products.html', {
-        'products': all_products,
+        'products': page,
         'categories': categories,
+        'next_query': page_querystring(request, page.next_cursor),
+        'prev_query': page_querystring(request, page.prev_cursor),
     })
 
+@query_budget(5)
 def cart_view(request):
     """Страница корзины"""
     if request.user.is_authenticated:
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.all()
-            total = sum(item.product.price * item.quantity for item in cart_items)
+            summary = cart_summary(Cart.objects.get(user=request.user))
+            cart_items = summary.items
+            total = summary.total
         except Cart.DoesNotExist:
             cart_items = []
             total = 0
     else:
-        cart_items = []
-        total = 0
+        summary = guest_cart.summary(guest_cart.load(request))
+        cart_items = summary.items
+        total = summary.total
     
     return render(request, 'shop/cart.html', {
         'cart_items': cart_items,
         'total': total,
     })
 
+# POST с ключом идемпотентности и несколькими товарами - 19 запросов
+@query_budget(19)
 @login_required
 def checkout_view(request):
     """Страница оформления заказа"""
-    try:
-        cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.all()
-        if not cart_items:
-            messages.warning(request, 'Ваша корзина пуста')
-            return redirect('cart')
-        
-        total = sum(item.product.price * item.quantity for item in cart_items)
-    except Cart.DoesNotExist:
-        messages.warning(request, 'Ваша корзина пуста')
-        return redirect('cart')
-    
     if request.method == 'POST':
         shipping_address = request.POST.get('shipping_address')
         
@@ -81,34 +108,41 @@ def checkout_view(request):
             return redirect('checkout')
         
         try:
-            with transaction.atomic():
-                order = Order.objects.create(
-                    user=request.user,
-                    total_price=total,
-                    shipping_address=shipping_address,
-                    status='pending'
-                )
-                
-                for cart_item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product.price
-                    )
-                
-                cart.items.all().delete()
-                
-                messages.success(request, f'Заказ #{order.id} успешно оформлен!')
-                return redirect('profile')
-        
+            order = place_order(
+                request.user, shipping_address,
+                idempotency_key=request.POST.get('idempotency_key'),
+            )
+        except EmptyCartError:
+            messages.warning(request, 'Ваша корзина пуста')
+            return redirect('cart')
+        except OutOfStock as e:
+            names = ', '.join(Product.objects.filter(id__in=e.product_ids).values_list('name', flat=True))
+            messages.error(request, f'Недостаточно товара на складе: {names}')
+            return redirect('cart')
+        except InvalidIdempotencyKey:
+            messages.error(request, 'Форма устарела, отправьте ее еще раз')
+            return redirect('checkout')
         except Exception as e:
             messages.error(request, f'Произошла ошибка при оформлении заказа: {str(e)}')
             return redirect('checkout')
+        
+        if not order.replayed:
+            messages.success(request, f'Заказ #{order.id} успешно оформлен!')
+        return redirect('profile')
+    
+    try:
+        summary = cart_summary(Cart.objects.get(user=request.user))
+    except Cart.DoesNotExist:
+        summary = None
+    if summary is None or not summary.items:
+        messages.warning(request, 'Ваша корзина пуста')
+        return redirect('cart')
     
     return render(request, 'shop/checkout.html', {
-        'cart_items': cart_items,
-        'total': total,
+        'cart_items': summary.items,
+        'total': summary.total,
+        # Повторная отправка формы (таймаут, двойной клик) не создаст второй заказ
+        'idempotency_key': uuid.uuid4().hex,
     })
 
 @login_required
@@ -173,36 +207,32 @@ def change_password_view(request):
     
     return redirect('profile')
 
-@login_required
 def update_cart_item_view(request, item_id):
     """Изменение количества товара в корзине"""
+    if not request.user.is_authenticated:
+        return _update_guest_cart(request, item_id)
     try:
-        cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
+        cart_item = CartItem.objects.select_related('product').get(id=item_id, cart__user=request.user)
+        product = cart_item.product
         
         if request.method == 'POST':
             action = request.POST.get('action')
             
             if action == 'increase':
-                cart_item.quantity += 1
-                cart_item.save()
-                messages.success(request, f'Количество товара "{cart_item.product.name}" увеличено до {cart_item.quantity}')
+                quantity = cart_service.add_item(cart_item.cart_id, product.id)
+                messages.success(request, f'Количество товара "{product.name}" увеличено до {quantity}')
             elif action == 'decrease':
-                if cart_item.quantity > 1:
-                    cart_item.quantity -= 1
-                    cart_item.save()
-                    messages.success(request, f'Количество товара "{cart_item.product.name}" уменьшено до {cart_item.quantity}')
+                quantity = cart_service.decrease_item(cart_item.cart_id, product.id)
+                if quantity:
+                    messages.success(request, f'Количество товара "{product.name}" уменьшено до {quantity}')
                 else:
-                    cart_item.delete()
-                    messages.success(request, f'Товар "{cart_item.product.name}" удален из корзины')
+                    messages.success(request, f'Товар "{product.name}" удален из корзины')
             elif action == 'set':
                 quantity = int(request.POST.get('quantity', 1))
-                if quantity > 0:
-                    cart_item.quantity = quantity
-                    cart_item.save()
-                    messages.success(request, f'Количество товара "{cart_item.product.name}" изменено на {quantity}')
+                if cart_service.set_quantity(cart_item.cart_id, product.id, quantity):
+                    messages.success(request, f'Количество товара "{product.name}" изменено на {quantity}')
                 else:
-                    cart_item.delete()
-                    messages.success(request, f'Товар "{cart_item.product.name}" удален из корзины')
+                    messages.success(request, f'Товар "{product.name}" удален из корзины')
         
     except CartItem.DoesNotExist:
         messages.error(request, 'Товар не найден в корзине')
@@ -210,9 +240,10 @@ def update_cart_item_view(request, item_id):
     return redirect('cart')
 
 
-@login_required
 def remove_from_cart_view(request, item_id):
     """Удаление товара из корзины"""
+    if not request.user.is_authenticated:
+        return _remove_from_guest_cart(request, item_id)
     try:
         cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
         product_name = cart_item.product.name
@@ -224,9 +255,14 @@ def remove_from_cart_view(request, item_id):
     return redirect('cart')
 
 
-@login_required
 def clear_cart_view(request):
     """Очистка всей корзины"""
+    if not request.user.is_authenticated:
+        response = redirect('cart')
+        if request.method == 'POST':
+            guest_cart.save(response, {})
+            messages.success(request, 'Корзина очищена')
+        return response
     if request.method == 'POST':
         try:
             cart = Cart.objects.get(user=request.user)
@@ -242,7 +278,7 @@ def clear_cart_view(request):
 def order_detail_view(request, order_id):
     """Детали заказа"""
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = order.items.all()
+    order_items = order.items.select_related('product__category')
     
     return render(request, 'shop/order_detail.html', {
         'order': order,
@@ -258,8 +294,9 @@ def login_view(request):
         
         if user is not None:
             login(request, user)
+            guest_cart.merge(request, user)
             messages.success(request, f'Добро пожаловать, {username}!')
-            return redirect('home')
+            return guest_cart.forget(request, redirect('home'))
         else:
             messages.error(request, 'Неверное имя пользователя или пароль')
     
@@ -272,8 +309,9 @@ def register_view(request):
         if form.is_valid():
             user = form.save()
             login(request, user)
+            guest_cart.merge(request, user)
             messages.success(request, 'Регистрация прошла успешно!')
-            return redirect('home')
+            return guest_cart.forget(request, redirect('home'))
     else:
         form = RegisterForm()
     
@@ -293,25 +331,101 @@ def contacts_view(request):
     """Страница "Контакты" """
     return render(request, 'shop/contacts.html')
 
-@login_required
+@csrf_exempt
 def add_to_cart_view(request, product_id):
-    """Добавление товара в корзину"""
+    """Добавление товара в корзину.
+
+    Форма гостя на страницах каталога идет без CSRF-токена, чтобы страница
+    оставалась в кэше анонимных страниц. Вместо токена у гостя проверяется,
+    что запрос пришел с этого же сайта (_is_same_origin): иначе чужая
+    страница подменила бы cookie корзины, а при входе merge() перенес бы ее
+    товары в корзину пользователя. У вошедшего пользователя токен
+    проверяется как обычно.
+    """
+    if not request.user.is_authenticated:
+        if not _is_same_origin(request):
+            return HttpResponseForbidden('Запрос с другого сайта отклонен')
+        return _add_to_guest_cart(request, product_id)
+    return _add_to_cart(request, product_id)
+
+
+def _is_same_origin(request):
+    """Запрос отправлен страницей этого сайта или набран в адресной строке.
+
+    Sec-Fetch-Site браузер выставляет сам, и страница не может его изменить;
+    без него (старые браузеры) сверяются Origin, затем Referer. Запрос без
+    всех трех заголовков - не из браузера, cookie жертвы в нем нет.
+    """
+    fetch_site = request.headers.get('Sec-Fetch-Site')
+    if fetch_site is not None:
+        return fetch_site in ('same-origin', 'none')
+    source = request.headers.get('Origin') or request.headers.get('Referer')
+    if source is None:
+        return True
+    # Origin: null (песочница, file://) не совпадет ни с одним адресом
+    parsed = urlparse(source)
+    return (parsed.scheme, parsed.netloc) == (request.scheme, request.get_host())
+
+
+@csrf_protect
+def _add_to_cart(request, product_id):
     try:
         product = Product.objects.get(id=product_id)
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': 1}
-        )
-        
-        if not created:
-            cart_item.quantity += 1
-            cart_item.save()
+        cart_service.add_item(cart_service.get_cart(request.user), product.id)
         
         messages.success(request, f'Товар "{product.name}" добавлен в корзину!')
     except Product.DoesNotExist:
         messages.error(request, 'Товар не найден!')
     
-    return redirect('products')
\ No newline at end of file
+    return redirect('products')
+
+
+def _add_to_guest_cart(request, product_id):
+    items = guest_cart.load(request)
+    response = redirect('products')
+    try:
+        product = Product.objects.only('id', 'name').get(id=product_id)
+        guest_cart.add(items, product.id)
+        messages.success(request, f'Товар "{product.name}" добавлен в корзину!')
+    except Product.DoesNotExist:
+        messages.error(request, 'Товар не найден!')
+    except guest_cart.GuestCartFull as e:
+        messages.warning(request, f'{e}. Войдите, чтобы добавить больше.')
+    guest_cart.save(response, items)
+    return response
+
+
+def _update_guest_cart(request, product_id):
+    """Изменение количества в корзине гостя; item_id в URL - id товара"""
+    items = guest_cart.load(request)
+    response = redirect('cart')
+    if product_id not in items:
+        messages.error(request, 'Товар не найден в корзине')
+        return response
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'increase':
+            quantity = guest_cart.add(items, product_id)
+        elif action == 'decrease':
+            quantity = guest_cart.decrease(items, product_id)
+        elif action == 'set':
+            quantity = guest_cart.set_quantity(items, product_id, int(request.POST.get('quantity', 1)))
+        else:
+            return response
+        if quantity:
+            messages.success(request, f'Количество товара изменено на {quantity}')
+        else:
+            messages.success(request, 'Товар удален из корзины')
+        guest_cart.save(response, items)
+    return response
+
+
+def _remove_from_guest_cart(request, product_id):
+    items = guest_cart.load(request)
+    response = redirect('cart')
+    if items.pop(product_id, None) is None:
+        messages.error(request, 'Товар не найден в корзине')
+    else:
+        messages.success(request, 'Товар удален из корзины')
+        guest_cart.save(response, items)
+    return response
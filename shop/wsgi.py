@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_wsgi_application()
+
+if not settings.DEBUG:
+    # Статика из STATIC_ROOT (после collectstatic) отдается до Django
+    from shop.assets import StaticFilesWSGI
+
+    application = StaticFilesWSGI(application)